@@ -4,3 +4,22 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+        from django.db.models.signals import post_delete, post_save
+        from core.metrics import collector
+        from .usercache import invalidate_user, user_cache
+
+        post_save.connect(invalidate_user, sender=User, dispatch_uid="usercache_save")
+        post_delete.connect(invalidate_user, sender=User, dispatch_uid="usercache_delete")
+
+        @collector
+        def user_cache_metrics():
+            st = user_cache.stats()
+            return {
+                "accounts_user_cache_hits_total": ("counter", "User cache hits.", st["hits"]),
+                "accounts_user_cache_misses_total": ("counter", "User cache misses.", st["misses"]),
+                "accounts_user_cache_size": ("gauge", "Users currently cached.", st["size"]),
+                "accounts_user_cache_maxsize": ("gauge", "User cache capacity.", st["maxsize"]),
+            }
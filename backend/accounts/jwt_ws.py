@@ -1,8 +1,30 @@
 from urllib.parse import parse_qs
-from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
-from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import AnonymousUser, User
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from .usercache import user_cache
+
+
+async def user_from_token(raw_token: str):
+    """
+    User for an access token, or AnonymousUser. Signature/expiry checks are
+    CPU only and the user row comes from the shared cache, so a warm lookup
+    never leaves the event loop.
+    """
+    authenticator = JWTAuthentication()
+    try:
+        validated = authenticator.get_validated_token(raw_token)
+        # the claim is a string in recent simplejwt; the cache is keyed by the pk value
+        user_id = User._meta.pk.to_python(validated[api_settings.USER_ID_CLAIM])
+    except Exception:
+        return AnonymousUser()
+    user = await user_cache.aget(id=user_id)
+    if user is None or not user.is_active:
+        return AnonymousUser()
+    return user
+
 
 class JWTAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
@@ -14,14 +36,5 @@ class JWTAuthMiddleware(BaseMiddleware):
             auth = headers.get(b"authorization")
             if auth and auth.lower().startswith(b"bearer "):
                 token = auth.split()[1].decode()
-        scope["user"] = await self._get_user(token) if token else AnonymousUser()
+        scope["user"] = await user_from_token(token) if token else AnonymousUser()
         return await super().__call__(scope, receive, send)
-
-    @database_sync_to_async
-    def _get_user(self, raw_token):
-        authenticator = JWTAuthentication()
-        try:
-            validated = authenticator.get_validated_token(raw_token)
-            return authenticator.get_user(validated)
-        except Exception:
-            return AnonymousUser()
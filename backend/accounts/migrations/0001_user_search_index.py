@@ -0,0 +1,77 @@
+"""
+Search index over auth_user (see accounts.search).
+
+Postgres: pg_trgm GIN indexes on lower(username) and the full name.
+SQLite: an FTS5 trigram table kept in sync with auth_user by triggers.
+Other backends get nothing and search falls back to a scan.
+"""
+from django.db import migrations
+
+PG_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS accounts_user_username_trgm ON auth_user USING gin (lower(username) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS accounts_user_name_trgm ON auth_user "
+    "USING gin (lower(first_name || ' ' || last_name) gin_trgm_ops)",
+]
+PG_BACKWARD = [
+    "DROP INDEX IF EXISTS accounts_user_name_trgm",
+    "DROP INDEX IF EXISTS accounts_user_username_trgm",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS accounts_user_fts USING fts5("
+    "username, first_name, last_name, content='auth_user', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS accounts_user_fts_ai AFTER INSERT ON auth_user BEGIN "
+    "INSERT INTO accounts_user_fts(rowid, username, first_name, last_name) "
+    "VALUES (new.id, new.username, new.first_name, new.last_name); END",
+    "CREATE TRIGGER IF NOT EXISTS accounts_user_fts_ad AFTER DELETE ON auth_user BEGIN "
+    "INSERT INTO accounts_user_fts(accounts_user_fts, rowid, username, first_name, last_name) "
+    "VALUES ('delete', old.id, old.username, old.first_name, old.last_name); END",
+    "CREATE TRIGGER IF NOT EXISTS accounts_user_fts_au AFTER UPDATE OF username, first_name, last_name ON auth_user BEGIN "
+    "INSERT INTO accounts_user_fts(accounts_user_fts, rowid, username, first_name, last_name) "
+    "VALUES ('delete', old.id, old.username, old.first_name, old.last_name); "
+    "INSERT INTO accounts_user_fts(rowid, username, first_name, last_name) "
+    "VALUES (new.id, new.username, new.first_name, new.last_name); END",
+    "INSERT INTO accounts_user_fts(accounts_user_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS accounts_user_fts_au",
+    "DROP TRIGGER IF EXISTS accounts_user_fts_ad",
+    "DROP TRIGGER IF EXISTS accounts_user_fts_ai",
+    "DROP TABLE IF EXISTS accounts_user_fts",
+]
+
+
+def _run(schema_editor, statements):
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def forward(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        _run(schema_editor, PG_FORWARD)
+    elif vendor == "sqlite":
+        try:
+            _run(schema_editor, SQLITE_FORWARD)
+        except Exception:  # SQLite built without FTS5 / trigram (< 3.34): scan fallback
+            _run(schema_editor, SQLITE_BACKWARD)
+
+
+def backward(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        _run(schema_editor, PG_BACKWARD)
+    elif vendor == "sqlite":
+        _run(schema_editor, SQLITE_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
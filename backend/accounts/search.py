@@ -0,0 +1,108 @@
+# accounts/search.py
+"""
+User directory search over username / first_name / last_name.
+
+Ranking: username prefix matches first, then fuzzy similarity.
+
+- Postgres: pg_trgm. The WHERE clause only uses operators the GIN indexes
+  from migration 0001 serve (LIKE 'q%', %, <%), so the cost follows the
+  number of candidates, not the table size (pg_trgm.similarity_threshold
+  decides what counts as a candidate).
+- SQLite: the FTS5 trigram table. The query is split into its trigrams and
+  OR-ed, so a typo still shares most trigrams with the name and bm25 puts
+  the closest rows first.
+- Anything else (SQLite without FTS5, queries shorter than a trigram): a
+  LIKE scan, prefix matches first.
+"""
+from typing import List, Tuple
+
+from django.contrib.auth.models import User
+from django.db import connections, router
+from django.db.models import Q
+
+MAX_QUERY_LEN = 64
+MAX_OFFSET = 500  # ranked results past this are noise; keeps deep pages cheap
+
+_COLUMNS = "u.id, u.username, u.first_name, u.last_name"
+
+_PG_SQL = f"""
+SELECT {_COLUMNS},
+       (CASE WHEN lower(u.username) LIKE %(prefix)s THEN 1 ELSE 0 END)
+       + GREATEST(similarity(lower(u.username), %(q)s),
+                  word_similarity(%(q)s, lower(u.first_name || ' ' || u.last_name))) AS score
+FROM auth_user u
+WHERE u.is_active AND u.id <> %(me)s
+  AND (lower(u.username) LIKE %(prefix)s
+       OR lower(u.username) %% %(q)s
+       OR %(q)s <%% lower(u.first_name || ' ' || u.last_name))
+ORDER BY score DESC, u.id
+LIMIT %(limit)s OFFSET %(offset)s
+"""
+
+_SQLITE_FTS_SQL = f"""
+SELECT {_COLUMNS}
+FROM accounts_user_fts f JOIN auth_user u ON u.id = f.rowid
+WHERE accounts_user_fts MATCH %s AND u.is_active AND u.id <> %s
+ORDER BY (u.username LIKE %s ESCAPE '\\') DESC, bm25(accounts_user_fts, 4.0, 1.0, 1.0), u.id
+LIMIT %s OFFSET %s
+"""
+
+_has_fts = None
+
+
+def _db():
+    """Connection the router reads User rows from (a replica inside ReplicaReadMixin views)."""
+    return connections[router.db_for_read(User)]
+
+
+def _sqlite_fts() -> bool:
+    global _has_fts
+    if _has_fts is None:
+        with _db().cursor() as cur:
+            cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'accounts_user_fts'")
+            _has_fts = cur.fetchone() is not None
+    return _has_fts
+
+
+def _like_prefix(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _fts_query(q: str) -> str:
+    grams = dict.fromkeys(q[i:i + 3] for i in range(len(q) - 2))
+    return " OR ".join('"{}"'.format(g.replace('"', '""')) for g in grams)
+
+
+def _rows(sql: str, params) -> List[Tuple]:
+    with _db().cursor() as cur:
+        cur.execute(sql, params)
+        return [row[:4] for row in cur.fetchall()]
+
+
+def _scan(q: str, me_id: int, limit: int, offset: int) -> List[Tuple]:
+    qs = (
+        User.objects
+        .filter(is_active=True)
+        .exclude(id=me_id)
+        .filter(Q(username__icontains=q) | Q(first_name__icontains=q) | Q(last_name__icontains=q))
+        .order_by("username")
+        .values_list("id", "username", "first_name", "last_name")
+    )
+    prefixed = list(qs.filter(username__istartswith=q)[:offset + limit])
+    if len(prefixed) >= offset + limit:
+        return prefixed[offset:]
+    rest = list(qs.exclude(username__istartswith=q)[:offset + limit - len(prefixed)])
+    return (prefixed + rest)[offset:]
+
+
+def search_users(q: str, me_id: int, *, limit: int, offset: int = 0) -> List[Tuple]:
+    """Ranked (id, username, first_name, last_name) rows matching `q`, excluding me."""
+    q = " ".join(q.lower().split())[:MAX_QUERY_LEN]
+    if not q or offset >= MAX_OFFSET:
+        return []
+    limit = min(limit, MAX_OFFSET - offset)
+    if _db().vendor == "postgresql":
+        return _rows(_PG_SQL, {"q": q, "prefix": _like_prefix(q), "me": me_id, "limit": limit, "offset": offset})
+    if _db().vendor == "sqlite" and len(q) >= 3 and _sqlite_fts():
+        return _rows(_SQLITE_FTS_SQL, [_fts_query(q), me_id, _like_prefix(q), limit, offset])
+    return _scan(q, me_id, limit, offset)
@@ -1,9 +1,10 @@
 from django.urls import path
-from .views import RegisterView, LoginView, MeView, RefreshView
+from .views import RegisterView, LoginView, MeView, RefreshView, UserCacheStatsView
 
 urlpatterns = [
     path("register/", RegisterView.as_view(), name="register"),
     path("login/",    LoginView.as_view(),    name="login"),
     path("me/",       MeView.as_view(),       name="me"),
     path("refresh/",  RefreshView.as_view(),  name="token_refresh"),
+    path("user-cache/", UserCacheStatsView.as_view(), name="user_cache_stats"),
 ]
@@ -0,0 +1,127 @@
+# accounts/usercache.py
+"""
+Per-process LRU + TTL cache of lightweight user records, looked up by id or
+username. Shared by the WebSocket consumers, the JWT middleware and the chat
+views; entries are dropped on User save/delete (see AccountsConfig.ready).
+Other processes only see a change once their entry expires.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from core.db import db_sync_to_async
+
+
+class CachedUser(NamedTuple):
+    id: int
+    username: str
+    first_name: str
+    last_name: str
+    is_active: bool
+
+    # lets a record stand in for request.user / scope["user"]
+    is_authenticated = True
+
+    @property
+    def pk(self):
+        return self.id
+
+
+_FIELDS = ("id", "username", "first_name", "last_name", "is_active")
+
+
+class UserCache:
+    def __init__(self, maxsize=None, ttl=None):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._by_id: "OrderedDict[int, tuple]" = OrderedDict()  # id -> (record, expires_at)
+        self._by_name = {}  # username -> id
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize or getattr(settings, "USER_CACHE_MAX_SIZE", 10000)
+
+    @property
+    def ttl(self) -> float:
+        return self._ttl if self._ttl is not None else getattr(settings, "USER_CACHE_TTL_SEC", 300)
+
+    # --- memory only ---
+
+    def peek(self, *, id: Optional[int] = None, username: Optional[str] = None) -> Optional[CachedUser]:
+        with self._lock:
+            if id is None:
+                id = self._by_name.get(username)
+            entry = self._by_id.get(id) if id is not None else None
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._drop(id)
+                self.misses += 1
+                return None
+            self._by_id.move_to_end(id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, record: CachedUser) -> None:
+        with self._lock:
+            self._drop(record.id)
+            self._by_id[record.id] = (record, time.monotonic() + self.ttl)
+            self._by_name[record.username] = record.id
+            while len(self._by_id) > self.maxsize:
+                old = self._by_id.popitem(last=False)[1][0]
+                self._drop_name(old)
+
+    def invalidate(self, id: int) -> None:
+        with self._lock:
+            self._drop(id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_id.clear()
+            self._by_name.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._by_id), "maxsize": self.maxsize}
+
+    def _drop(self, id) -> None:
+        entry = self._by_id.pop(id, None)
+        if entry is not None:
+            self._drop_name(entry[0])
+
+    def _drop_name(self, record: CachedUser) -> None:
+        if self._by_name.get(record.username) == record.id:
+            del self._by_name[record.username]
+
+    # --- read-through (sync: ORM context) ---
+
+    def get(self, *, id: Optional[int] = None, username: Optional[str] = None) -> Optional[CachedUser]:
+        rec = self.peek(id=id, username=username)
+        return rec if rec is not None else self._load(id, username)
+
+    async def aget(self, *, id: Optional[int] = None, username: Optional[str] = None) -> Optional[CachedUser]:
+        """Hits are served on the event loop; only misses take a threadpool hop."""
+        rec = self.peek(id=id, username=username)
+        return rec if rec is not None else await db_sync_to_async(self._load)(id, username)
+
+    def _load(self, id, username) -> Optional[CachedUser]:
+        lookup = {"id": id} if id is not None else {"username": username}
+        row = User.objects.filter(**lookup).values_list(*_FIELDS).first()
+        if row is None:
+            return None
+        rec = CachedUser(*row)
+        self.put(rec)
+        return rec
+
+
+user_cache = UserCache()
+
+
+def invalidate_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
@@ -4,6 +4,7 @@ from rest_framework.response import Response
 from rest_framework import status, permissions
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from .serializers import RegisterSerializer
+from .usercache import user_cache
 
 class RegisterView(APIView):
     permission_classes = [permissions.AllowAny]
@@ -61,3 +62,8 @@ class RefreshView(APIView):
         if s.is_valid():
             return Response(s.validated_data)
         return Response(s.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class UserCacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    def get(self, request):
+        return Response(user_cache.stats())
@@ -1,57 +1,97 @@
 # chat/consumers.py  (replace file if easier)
-import json
+import asyncio
 from typing import Any, Dict
+from django.conf import settings
 from django.db import transaction
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.contrib.auth.models import AnonymousUser, User
-from channels.db import database_sync_to_async
+from django.contrib.auth.models import AnonymousUser
 from django.utils import timezone
+from accounts.usercache import user_cache
+from core import metrics
+from core.db import db_sync_to_async
+from . import ingest
+from .encoders import message_dict, user_public
+from .fanout import inbox_updates, room_group
 from .models import Message
-from .presence import is_online
+from .presence import ais_online
+from .ratelimit import aallow
+from .receipts import mark_all_seen
+from .sync import next_version
+from .threads import record_message, record_seen
+from .versions import touch
+from .wire import WireProtocolMixin
 
-def room_name(a, b): return "chat_" + "__".join(sorted([a, b]))
-def inbox_group(u): return f"inbox_{u}"
+# client event types we label metrics with; anything else is "unknown"
+EVENTS = frozenset({"message.send", "receipt.delivered", "receipt.seen_all", "typing.start", "typing.stop"})
+# client event -> token bucket (settings.CHAT_RATE_LIMITS)
+RATE_BUCKETS = {
+    "message.send": "message.send",
+    "receipt.delivered": "receipt", "receipt.seen_all": "receipt",
+    "typing.start": "typing", "typing.stop": "typing",
+}
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        user = self.scope.get("user")
-        if not user or isinstance(user, AnonymousUser) or not user.is_authenticated:
-            await self.close(); return
-        self.me = user
-        self.peer_username = self.scope["url_route"]["kwargs"]["username"]
-        self.room_name = room_name(self.me.username, self.peer_username)
-        await self.channel_layer.group_add(self.room_name, self.channel_name)
-        await self.accept()
+class ChatRoom:
+    """
+    One conversation as seen from one socket: the room group, this socket's
+    typing state and the handlers for client chat events. ChatConsumer owns
+    a single room; SessionConsumer (consumers_session) one per subscription.
+    `conn` is the consumer: it provides `me`, `group_send` and `send_frame`.
+    """
 
-    async def disconnect(self, code):
-        await self.channel_layer.group_discard(self.room_name, self.channel_name)
+    def __init__(self, conn, peer_username: str):
+        self.conn = conn
+        self.me = conn.me
+        self.peer_username = peer_username
+        self.room_name = room_group(self.me.username, peer_username)
+        # typing state: what the client wants vs what the room was last told
+        self._typing_want = self._typing_sent = False
+        self._typing_at = float("-inf")  # loop time of the last published transition
+        self._typing_flush = self._typing_expiry = None
 
-    async def receive(self, text_data):
-        try:
-          data = json.loads(text_data)
-        except Exception:
-          return
-        evt = data.get("type")
+    async def join(self):
+        await self.conn.channel_layer.group_add(self.room_name, self.conn.channel_name)
+
+    async def leave(self):
+        for task in (self._typing_flush, self._typing_expiry):
+            if task is not None:
+                task.cancel()
+        if self._typing_sent:
+            # don't leave the peer looking at a stuck indicator
+            await self._send({"type": "chat.typing", "from": self.me.username, "active": False})
+        await self.conn.channel_layer.group_discard(self.room_name, self.conn.channel_name)
+
+    async def _send(self, event):
+        # events carry their room so a multiplexed socket can tell them apart
+        event["room"] = self.room_name
+        await self.conn.group_send(self.room_name, event)
+
+    async def dispatch(self, evt, data):
+        bucket = RATE_BUCKETS.get(evt)
+        if bucket:
+            ok, retry_after = await aallow(self.me, bucket)
+            if not ok:
+                if bucket != "typing":  # typing is lossy anyway, drop it quietly
+                    await self._slow_down(evt, retry_after, data)
+                return
 
         if evt == "message.send":
             text = (data.get("text") or "").strip()
             if not text: return
+            if ingest.enabled():
+                await self._enqueue_message(text)
+                return
             msg = await self._create_message(self.me.username, self.peer_username, text)
-            await self.channel_layer.group_send(self.room_name, {"type": "chat.message_new", "message": msg})
+            if not msg: return
+            await self._send({"type": "chat.message_new", "message": msg})
 
             # delivered if peer is online anywhere
-            if await database_sync_to_async(is_online)(self.peer_username):
+            if await ais_online(self.peer_username):
                 upd = await self._mark_delivered(msg["id"])
                 if upd:
-                    await self.channel_layer.group_send(
-                        self.room_name, {"type": "chat.receipt_update", "message_id": msg["id"], "status": "delivered", "ts": upd["ts"]}
-                    )
+                    await self._send({"type": "chat.receipt_update", "message_id": msg["id"], "status": "delivered", "ts": upd["ts"]})
 
             # 🔔 notify both inbox lists (sender & receiver)
-            s_summary = await self._thread_summary(self.me.username, self.peer_username)
-            r_summary = await self._thread_summary(self.peer_username, self.me.username)
-            await self.channel_layer.group_send(inbox_group(self.me.username), {"type": "thread.update", **s_summary})
-            await self.channel_layer.group_send(inbox_group(self.peer_username), {"type": "thread.update", **r_summary})
+            self._notify_inboxes()
             return
 
         if evt == "receipt.delivered":
@@ -59,122 +99,191 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if isinstance(mid, int):
                 upd = await self._mark_delivered(mid)
                 if upd:
-                    await self.channel_layer.group_send(
-                        self.room_name,
-                        {"type": "chat.receipt_update", "message_id": mid, "status": "delivered", "ts": upd["ts"]},
-                    )
+                    await self._send({"type": "chat.receipt_update", "message_id": mid, "status": "delivered", "ts": upd["ts"]})
                     # 🔔 also refresh both inbox summaries (sender sees ✓✓)
-                    s_summary = await self._thread_summary(self.me.username, self.peer_username)
-                    r_summary = await self._thread_summary(self.peer_username, self.me.username)
-                    from .consumers import inbox_group as _inbox  # or define at top
-                    await self.channel_layer.group_send(_inbox(self.me.username), {"type": "thread.update", **s_summary})
-                    await self.channel_layer.group_send(_inbox(self.peer_username), {"type": "thread.update", **r_summary})
+                    self._notify_inboxes()
             return
 
         if evt == "receipt.seen_all":
             ids_ts = await self._mark_all_seen(self.me.username, self.peer_username)
             if ids_ts:
-                await self.channel_layer.group_send(self.room_name, {"type": "chat.receipt_bulk_seen", "items": ids_ts})
+                await self._send({"type": "chat.receipt_bulk_seen", "items": ids_ts})
 
                 # 🔔 after seeing, update both inbox threads (receiver unread -> 0)
-                s_summary = await self._thread_summary(self.me.username, self.peer_username)
-                r_summary = await self._thread_summary(self.peer_username, self.me.username)
-                await self.channel_layer.group_send(inbox_group(self.me.username), {"type": "thread.update", **s_summary})
-                await self.channel_layer.group_send(inbox_group(self.peer_username), {"type": "thread.update", **r_summary})
+                self._notify_inboxes()
             return
 
         if evt == "typing.start":
-            await self.channel_layer.group_send(self.room_name, {"type": "chat.typing", "from": self.me.username, "active": True})
+            await self._set_typing(True)
             return
         if evt == "typing.stop":
-            await self.channel_layer.group_send(self.room_name, {"type": "chat.typing", "from": self.me.username, "active": False})
+            await self._set_typing(False)
             return
 
-    # === group forwards ===
-    async def chat_message_new(self, event):
-        await self.send(text_data=json.dumps({"type": "message.new", "message": event["message"]}))
+    def frame_for(self, event):
+        """Client frame for a room group event (None: nothing to send)."""
+        kind = event["type"]
+        if kind == "chat.message_new":
+            return {"type": "message.new", "message": event["message"]}
+        if kind == "chat.receipt_update":
+            return {"type": "receipt.update", "message_id": event["message_id"], "status": event["status"], "ts": event.get("ts")}
+        if kind == "chat.receipt_bulk_seen":
+            return {"type": "receipt.bulk_seen", "items": event["items"]}
+        if kind == "chat.receipt_bulk_delivered":
+            return {"type": "receipt.bulk_delivered", "items": event["items"]}
+        if kind == "chat.typing":
+            if event.get("from") == self.me.username: return None
+            return {"type": "typing", "from": event["from"], "active": event["active"]}
+        return None
 
-    async def chat_receipt_update(self, event):
-        await self.send(text_data=json.dumps(event | {"type": "receipt.update"}))
+    # === typing ===
+    # Only transitions reach the channel layer (start->start / stop->stop are
+    # dropped), at most one per CHAT_TYPING_MIN_INTERVAL_MS; a change inside
+    # the interval is published when it ends if it still holds. The server
+    # sends the stop itself after CHAT_TYPING_TIMEOUT_MS without a start.
+    async def _set_typing(self, active: bool):
+        self._typing_want = active
+        if self._typing_expiry is not None:
+            self._typing_expiry.cancel()
+            self._typing_expiry = None
+        loop = asyncio.get_running_loop()
+        if active:
+            self._typing_expiry = loop.create_task(self._expire_typing())
+        if self._typing_flush is not None:
+            return  # a deferred publish is already due and will pick up the latest state
+        wait = self._typing_at + settings.CHAT_TYPING_MIN_INTERVAL_MS / 1000 - loop.time()
+        if wait > 0:
+            self._typing_flush = loop.create_task(self._publish_typing_later(wait))
+        else:
+            await self._publish_typing()
 
-    async def chat_receipt_bulk_seen(self, event):
-        await self.send(text_data=json.dumps({"type": "receipt.bulk_seen", "items": event["items"]}))
+    async def _publish_typing(self):
+        if self._typing_want == self._typing_sent:
+            return
+        self._typing_sent = self._typing_want
+        self._typing_at = asyncio.get_running_loop().time()
+        await self._send({"type": "chat.typing", "from": self.me.username, "active": self._typing_sent})
 
-    async def chat_typing(self, event):
-        if event.get("from") == self.me.username: return
-        await self.send(text_data=json.dumps({"type":"typing","from":event["from"],"active":event["active"]}))
+    async def _publish_typing_later(self, wait: float):
+        await asyncio.sleep(wait)
+        self._typing_flush = None
+        await self._publish_typing()
+
+    async def _expire_typing(self):
+        await asyncio.sleep(settings.CHAT_TYPING_TIMEOUT_MS / 1000)
+        self._typing_expiry = None
+        await self._set_typing(False)
 
     # === helpers ===
-    @database_sync_to_async
+    async def _slow_down(self, evt, retry_after, data):
+        frame = {"type": "rate_limited", "event": evt, "retry_after": retry_after}
+        if evt == "message.send":
+            frame["text"] = data.get("text")  # not stored; lets the client put it back
+        await self.conn.send_frame(frame, self)
+
+    def _notify_inboxes(self):
+        # coalesced: summaries are computed once per window at flush time
+        inbox_updates.schedule(self.me.username, self.peer_username)
+        inbox_updates.schedule(self.peer_username, self.me.username)
+
+    async def _enqueue_message(self, text):
+        # write-behind: id from Redis, row written later by chat.tasks.drain_message_stream,
+        # which also pushes the inbox updates once the row exists
+        peer = await user_cache.aget(username=self.peer_username)
+        if not peer: return
+        msg = await ingest.enqueue(self.me, peer, text, delivered=await ais_online(self.peer_username))
+        await self._send({"type": "chat.message_new", "message": msg})
+
+    @db_sync_to_async
     def _create_message(self, sender, receiver, text) -> Dict[str, Any]:
-        s = User.objects.get(username=sender)
-        r = User.objects.get(username=receiver)
-        m = Message.objects.create(sender=s, receiver=r, text=text)  # status=sent
-        return {
-            "id": m.id, "text": m.text, "created_at": m.created_at.isoformat(), "status": m.status,
-            "delivered_at": m.delivered_at.isoformat() if m.delivered_at else None,
-            "seen_at": m.seen_at.isoformat() if m.seen_at else None,
-            "sender": {"id": s.id, "username": s.username},
-            "receiver": {"id": r.id, "username": r.username},
-        }
-
-    @database_sync_to_async
-    def _mark_delivered(self, message_id: int):
-        try:
-            msg = Message.objects.get(id=message_id)
-        except Message.DoesNotExist:
+        s = user_cache.get(username=sender)
+        r = user_cache.get(username=receiver)
+        if not s or not r:
             return None
-        if msg.status == Message.STATUS_SENT:
-            msg.status = Message.STATUS_DELIVERED
-            msg.delivered_at = timezone.now()
-            msg.save(update_fields=["status", "delivered_at"])
+        with transaction.atomic():
+            m = Message.objects.create(sender_id=s.id, receiver_id=r.id, text=text, version=next_version(s.id, r.id))  # status=sent
+            record_message(m)
+        return message_dict(m, user_public(s), user_public(r))
+
+    @db_sync_to_async
+    def _mark_delivered(self, message_id: int):
+        with transaction.atomic():
+            try:
+                msg = Message.objects.select_for_update().get(id=message_id)
+            except Message.DoesNotExist:
+                if not ingest.enabled():
+                    return None
+                # may still be in the ingest stream: applied once it's stored
+                now = timezone.now()
+                ingest.enqueue_receipt("delivered", self.me.id, now, id=message_id)
+                return {"ts": now.isoformat()}
+            if msg.status == Message.STATUS_SENT:
+                msg.status = Message.STATUS_DELIVERED
+                msg.delivered_at = timezone.now()
+                msg.version = next_version(msg.sender_id, msg.receiver_id)
+                msg.save(update_fields=["status", "delivered_at", "version"])
+                touch((msg.sender_id, msg.receiver_id))
         return {"ts": msg.delivered_at.isoformat() if msg.delivered_at else None}
 
-    @database_sync_to_async
+    @db_sync_to_async
     def _mark_all_seen(self, me: str, peer: str):
-        now = timezone.now()
+        peer_user = user_cache.get(username=peer)
+        if not peer_user:
+            return []
+        at = timezone.now()
         with transaction.atomic():
-            qs = Message.objects.select_for_update().filter(
-                sender__username=peer, receiver__username=me
-            ).exclude(status=Message.STATUS_SEEN)
-            changed = []
-            for msg in qs:
-                msg.status = Message.STATUS_SEEN
-                msg.seen_at = now
-                msg.is_read = True
-                if not msg.delivered_at:
-                    msg.delivered_at = now
-                msg.save(update_fields=["status", "seen_at", "is_read", "delivered_at"])
-                changed.append({"id": msg.id, "ts": msg.seen_at.isoformat()})
-            return changed
-
-    @database_sync_to_async
-    def _thread_summary(self, me_username: str, other_username: str):
-        """
-        Return dict shaped for InboxConsumer.thread_update:
-         { "user": {...}, "unread_count": int, "last_message": {... or None} }
-        where 'last_message.from_me' is relative to 'me_username'.
-        """
-        from django.db.models import Q
-        from .serializers import MessageSerializer, UserPublicSerializer
-
-        try:
-            me = User.objects.get(username=me_username)
-            other = User.objects.get(username=other_username)
-        except User.DoesNotExist:
-            return {"user": None, "unread_count": 0, "last_message": None}
-
-        qs = Message.objects.filter(Q(sender=me, receiver=other) | Q(sender=other, receiver=me)).order_by("-created_at")
-        last = qs.first()
-        unread = Message.objects.filter(sender=other, receiver=me, is_read=False).count()
-
-        payload = None
-        if last:
-            payload = MessageSerializer(last).data
-            payload["from_me"] = (last.sender_id == me.id)
-
-        return {
-            "user": UserPublicSerializer(other).data,
-            "unread_count": unread,
-            "last_message": payload,
-        }
+            changed = mark_all_seen(self.me.id, peer_user.id)
+            if changed:
+                record_seen(self.me.id, peer_user.id, len(changed))
+        if ingest.enabled():  # also covers messages still in the ingest stream
+            ingest.enqueue_receipt("seen_all", self.me.id, at, peer=peer_user.id)
+        return changed
+
+
+class RoomEventsMixin:
+    """Channel-layer handlers for room group events; the consumer routes them with `room_event`."""
+
+    async def chat_message_new(self, event):
+        await self.room_event(event)
+
+    async def chat_receipt_update(self, event):
+        await self.room_event(event)
+
+    async def chat_receipt_bulk_seen(self, event):
+        await self.room_event(event)
+
+    async def chat_receipt_bulk_delivered(self, event):
+        await self.room_event(event)
+
+    async def chat_typing(self, event):
+        await self.room_event(event)
+
+
+class ChatConsumer(RoomEventsMixin, WireProtocolMixin, metrics.MeteredConsumerMixin, AsyncWebsocketConsumer):
+    room = None
+
+    async def connect(self):
+        user = self.scope.get("user")
+        if not user or isinstance(user, AnonymousUser) or not user.is_authenticated:
+            await self.close(); return
+        self.me = user
+        self.room = ChatRoom(self, self.scope["url_route"]["kwargs"]["username"])
+        await self.room.join()
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.room is not None:
+            await self.room.leave()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode_frame(text_data, bytes_data)
+        if data is None:
+            return
+        evt = data.get("type")
+        with metrics.ws_event("ChatConsumer", evt if evt in EVENTS else "unknown"):
+            await self.room.dispatch(evt, data)
+
+    async def room_event(self, event):
+        frame = self.room.frame_for(event)
+        if frame is not None:
+            await self.send_frame(frame)
@@ -1,22 +1,54 @@
 # chat/consumers_inbox.py
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.contrib.auth.models import AnonymousUser, User
-from channels.db import database_sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
 from django.utils import timezone
-from django.db.models import Q
-
-from .presence import set_online, refresh_online
-from .models import Message
-from .serializers import MessageSerializer, UserPublicSerializer
-
-def inbox_group(username: str) -> str:
-    return f"inbox_{username}"
-
-def room_name_for(a: str, b: str) -> str:
-    return "chat_" + "__".join(sorted([a, b]))
-
-class InboxConsumer(AsyncWebsocketConsumer):
+from accounts.usercache import user_cache
+from core import metrics
+from core.db import db_sync_to_async
+
+from . import ingest
+from .fanout import inbox_group, inbox_updates, room_group
+from .presence import aset_online, arefresh_online
+from .receipts import deliver_all_pending
+from .versions import touch
+from .wire import WireProtocolMixin
+
+
+async def come_online(conn):
+    """
+    Presence side of a fresh connection: mark `conn.me` online and deliver
+    everything that was waiting for them.
+    """
+    await aset_online(conn.me.username)
+
+    # Deliver any pending messages → delivered (one UPDATE, one event per room)
+    pending = await _deliver_all_pending(conn.me.id)
+    # pending: [(sender_username, [ids], delivered_iso)]
+    for sender_username, ids, ts in pending:
+        room = room_group(sender_username, conn.me.username)
+        # 1) Update the open room (sender side) so ticks flip to ✓✓ there
+        await conn.group_send(
+            room,
+            {"type": "chat.receipt_bulk_delivered", "room": room, "items": [{"id": mid, "ts": ts} for mid in ids]},
+        )
+        # 2) Update the sender's inbox list (last message + unread/ticks)
+        inbox_updates.schedule(sender_username, conn.me.username)
+
+@db_sync_to_async
+def _deliver_all_pending(me_id: int):
+    at = timezone.now()
+    with transaction.atomic():
+        ts, by_sender = deliver_all_pending(me_id)
+        touch(*((me_id, sid) for sid in by_sender))
+    if ingest.enabled():  # also covers messages still in the ingest stream
+        ingest.enqueue_receipt("delivered_all", me_id, at)
+    if not by_sender:
+        return []
+    senders = {sid: user_cache.get(id=sid) for sid in by_sender}
+    return [(senders[sid].username, ids, ts) for sid, ids in by_sender.items() if senders[sid]]
+
+class InboxConsumer(WireProtocolMixin, metrics.MeteredConsumerMixin, AsyncWebsocketConsumer):
     async def connect(self):
         user = self.scope.get("user")
         if not user or isinstance(user, AnonymousUser) or not user.is_authenticated:
@@ -30,86 +62,28 @@ class InboxConsumer(AsyncWebsocketConsumer):
         await self.channel_layer.group_discard(self.group, self.channel_name)
 
     async def thread_update(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             "type": "thread.update",
             "user": event["user"],
             "unread_count": event["unread_count"],
             "last_message": event.get("last_message"),
-        }))
+        })
 
-class PresenceConsumer(AsyncWebsocketConsumer):
+class PresenceConsumer(WireProtocolMixin, metrics.MeteredConsumerMixin, AsyncWebsocketConsumer):
     async def connect(self):
         user = self.scope.get("user")
         if not user or isinstance(user, AnonymousUser) or not user.is_authenticated:
             await self.close(); return
         self.me = user
         await self.accept()
-        await database_sync_to_async(set_online)(self.me.username)
-
-        # Deliver any pending messages → delivered
-        items = await self._deliver_all_pending(self.me.username)
-        # items: [(id, sender_username, delivered_iso)]
-        for mid, sender_username, ts in items:
-            # 1) Update the open room (sender side) so ticks flip to ✓✓ there
-            await self.channel_layer.group_send(
-                room_name_for(sender_username, self.me.username),
-                {"type": "chat.receipt_update", "message_id": mid, "status": "delivered", "ts": ts},
-            )
-            # 2) Update the sender's inbox list (last message + unread/ticks)
-            summary = await self._thread_summary(owner_username=sender_username, other_username=self.me.username)
-            await self.channel_layer.group_send(
-                inbox_group(sender_username),
-                {"type": "thread.update", **summary}
-            )
+        with metrics.ws_event("PresenceConsumer", "connect"):
+            await come_online(self)
 
     async def disconnect(self, code):
         pass  # TTL expiry handles offline; last_seen updated on ping
 
     async def receive(self, text_data=None, bytes_data=None):
-        try:
-            data = json.loads(text_data or "{}")
-        except Exception:
-            return
-        if data.get("type") == "ping":
-            await database_sync_to_async(refresh_online)(self.me.username)
-
-    # ==== DB helpers ====
-
-    @database_sync_to_async
-    def _deliver_all_pending(self, me_username: str):
-        qs = Message.objects.select_related("sender", "receiver").filter(
-            receiver__username=me_username, status=Message.STATUS_SENT
-        )
-        now = timezone.now()
-        items = []
-        for m in qs:
-            m.status = Message.STATUS_DELIVERED
-            m.delivered_at = now
-            m.save(update_fields=["status", "delivered_at"])
-            items.append((m.id, m.sender.username, m.delivered_at.isoformat()))
-        return items
-
-    @database_sync_to_async
-    def _thread_summary(self, owner_username: str, other_username: str):
-        try:
-            owner = User.objects.get(username=owner_username)
-            other = User.objects.get(username=other_username)
-        except User.DoesNotExist:
-            return {"user": None, "unread_count": 0, "last_message": None}
-
-        qs = Message.objects.filter(
-            Q(sender=owner, receiver=other) | Q(sender=other, receiver=owner)
-        ).order_by("-created_at")
-        last = qs.first()
-        unread = Message.objects.filter(sender=other, receiver=owner, is_read=False).count()
-
-        payload = None
-        if last:
-            payload = MessageSerializer(last).data
-            payload["from_me"] = (last.sender_id == owner.id)
-
-        return {
-            "user": UserPublicSerializer(other).data,
-            "unread_count": unread,
-            "last_message": payload,
-        }
+        data = self.decode_frame(text_data, bytes_data)
+        if data is not None and data.get("type") == "ping":
+            with metrics.ws_event("PresenceConsumer", "ping"):
+                await arefresh_online(self.me.username)
@@ -0,0 +1,120 @@
+# chat/consumers_session.py
+"""
+ws/session/: one socket per client session instead of presence + inbox +
+one chat socket per open conversation.
+
+Client frames:
+  {"type": "ping"}
+  {"type": "subscribe", "with": "<username>"}    -> {"type": "subscribed", "with": ...}
+  {"type": "unsubscribe", "with": "<username>"}  -> {"type": "unsubscribed", "with": ...}
+  any ChatConsumer event plus "with", e.g. {"type": "message.send", "with": "bob", "text": "hi"}
+
+Server frames are the ones the single-purpose sockets send; room frames
+carry "with" so the client can route them to the right conversation.
+Frames are JSON or MessagePack depending on the subprotocol (chat.wire).
+"""
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from accounts.usercache import user_cache
+from core import metrics
+
+from .consumers import EVENTS, ChatRoom, RoomEventsMixin
+from .consumers_inbox import come_online
+from .fanout import inbox_group, room_group
+from .presence import arefresh_online
+from .wire import WireProtocolMixin
+
+SESSION_EVENTS = frozenset({"ping", "subscribe", "unsubscribe"})
+
+
+class SessionConsumer(RoomEventsMixin, WireProtocolMixin, metrics.MeteredConsumerMixin, AsyncWebsocketConsumer):
+    group = None
+
+    async def connect(self):
+        user = self.scope.get("user")
+        if not user or isinstance(user, AnonymousUser) or not user.is_authenticated:
+            await self.close(); return
+        self.me = user
+        self.rooms = {}  # room group name -> ChatRoom
+        self.group = inbox_group(self.me.username)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+        with metrics.ws_event("SessionConsumer", "connect"):
+            await come_online(self)
+
+    async def disconnect(self, code):
+        if self.group is None:
+            return
+        for room in list(self.rooms.values()):
+            await room.leave()
+        self.rooms.clear()
+        await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode_frame(text_data, bytes_data)
+        if data is None:
+            return
+        evt = data.get("type")
+        label = evt if evt in EVENTS or evt in SESSION_EVENTS else "unknown"
+        with metrics.ws_event("SessionConsumer", label):
+            if evt == "ping":
+                await arefresh_online(self.me.username)
+            elif evt == "subscribe":
+                await self._subscribe(data.get("with"))
+            elif evt == "unsubscribe":
+                await self._unsubscribe(data.get("with"))
+            elif evt in EVENTS:
+                room = self._room(data.get("with"))
+                if room is None:
+                    await self.send_frame({"type": "error", "error": "not_subscribed", "event": evt, "with": data.get("with")})
+                    return
+                await room.dispatch(evt, data)
+
+    def _room(self, peer):
+        if not isinstance(peer, str):
+            return None
+        return self.rooms.get(room_group(self.me.username, peer))
+
+    async def _subscribe(self, peer):
+        if self._room(peer) is None:
+            if not isinstance(peer, str) or peer == self.me.username or not await user_cache.aget(username=peer):
+                await self.send_frame({"type": "error", "error": "unknown_user", "event": "subscribe", "with": peer})
+                return
+            if len(self.rooms) >= settings.CHAT_SESSION_MAX_ROOMS:
+                await self.send_frame({"type": "error", "error": "too_many_subscriptions", "event": "subscribe", "with": peer})
+                return
+            room = ChatRoom(self, peer)
+            self.rooms[room.room_name] = room
+            await room.join()
+        await self.send_frame({"type": "subscribed", "with": peer})
+
+    async def _unsubscribe(self, peer):
+        room = self._room(peer)
+        if room is not None:
+            del self.rooms[room.room_name]
+            await room.leave()
+        await self.send_frame({"type": "unsubscribed", "with": peer})
+
+    # ==== server -> client ====
+
+    async def room_event(self, event):
+        room = self.rooms.get(event.get("room"))
+        if room is None:
+            return  # unsubscribed while the event was in flight
+        frame = room.frame_for(event)
+        if frame is not None:
+            await self.send_frame(frame, room)
+
+    async def thread_update(self, event):
+        await self.send_frame({
+            "type": "thread.update",
+            "user": event["user"],
+            "unread_count": event["unread_count"],
+            "last_message": event.get("last_message"),
+        })
+
+    async def send_frame(self, frame, room=None):
+        if room is not None:
+            frame["with"] = room.peer_username
+        await super().send_frame(frame)
@@ -0,0 +1,132 @@
+# chat/encoders.py
+"""
+Hand-written encoders for the hot payloads (messages, thread summaries).
+
+They produce exactly what MessageSerializer / UserPublicSerializer produce
+(same keys, same key order, DRF's datetime format) without DRF's per-field
+machinery, and every REST and WebSocket response goes through the same
+`dumps`, so the JSON is byte-identical on both transports.
+`python manage.py bench_serializers` compares them against the DRF serializers.
+MessagePack is offered next to JSON when `msgpack` is installed.
+"""
+import json
+from datetime import datetime
+from typing import Any, Iterable, List, Optional
+
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: binary REST / WebSocket encoding (chat.wire)
+    msgpack = None
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def dumps_text(obj: Any) -> str:
+    return dumps(obj).decode()
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def encode_dt(value: Optional[datetime], tz=None) -> Optional[str]:
+    """
+    Same output as rest_framework.fields.DateTimeField.to_representation.
+    Looking up the active timezone is the expensive part, so batch callers
+    resolve it once and pass it in.
+    """
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(tz or timezone.get_current_timezone())
+    s = value.isoformat()
+    return s[:-6] + "Z" if s.endswith("+00:00") else s
+
+
+def user_public(u) -> dict:
+    """User or accounts.usercache.CachedUser -> UserPublicSerializer shape."""
+    return {"id": u.id, "username": u.username, "first_name": u.first_name, "last_name": u.last_name}
+
+
+def message_dict(m, sender: Optional[dict] = None, receiver: Optional[dict] = None, tz=None) -> dict:
+    """
+    MessageSerializer shape. Pass `sender`/`receiver` (user_public dicts) when
+    they're already at hand; otherwise m.sender / m.receiver are used, so
+    select_related them.
+    """
+    tz = tz or timezone.get_current_timezone()
+    return {
+        "id": m.id,
+        "sender": sender if sender is not None else user_public(m.sender),
+        "receiver": receiver if receiver is not None else user_public(m.receiver),
+        "text": m.text,
+        "created_at": encode_dt(m.created_at, tz),
+        "status": m.status,
+        "delivered_at": encode_dt(m.delivered_at, tz),
+        "seen_at": encode_dt(m.seen_at, tz),
+    }
+
+
+def message_list(msgs: Iterable) -> List[dict]:
+    """message_dict over a page; a conversation has two users, so encode each once."""
+    tz = timezone.get_current_timezone()
+    users = {}
+    out = []
+    for m in msgs:
+        s = users.get(m.sender_id)
+        if s is None:
+            s = users[m.sender_id] = user_public(m.sender)
+        r = users.get(m.receiver_id)
+        if r is None:
+            r = users[m.receiver_id] = user_public(m.receiver)
+        out.append(message_dict(m, s, r, tz))
+    return out
+
+
+def thread_summary_dict(other, unread_count: int, last, owner_id: int) -> dict:
+    payload = None
+    if last is not None:
+        payload = message_dict(last)
+        payload["from_me"] = (last.sender_id == owner_id)
+    return {"user": user_public(other), "unread_count": unread_count, "last_message": payload}
+
+
+class FastJSONRenderer(BaseRenderer):
+    """JSON renderer backed by `dumps` (orjson when installed)."""
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return dumps(data)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """`Accept: application/msgpack`: the same payloads, MessagePack encoded."""
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, use_bin_type=True)
+
+
+# JSON first: it stays the default for clients that don't ask
+CHAT_RENDERERS = [FastJSONRenderer] + ([MessagePackRenderer] if msgpack is not None else [])
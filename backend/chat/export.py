@@ -0,0 +1,210 @@
+# chat/export.py
+"""
+Full conversation exports, as NDJSON (one MessageSerializer-shaped object
+per line) or CSV.
+
+Rows come off the database CHAT_EXPORT_CHUNK at a time through
+`iterator()` / `aiterator()`, which is a server-side cursor on Postgres. They
+are encoded one by one and written out in ~EXPORT_WRITE_BYTES pieces, so
+memory stays flat whatever the size of the thread:
+
+- GET /history/<u>/export/ streams the export to the client
+  (views_async.ConversationExportView)
+- chat.tasks.export_conversation writes a gzipped file under
+  MEDIA_ROOT/CHAT_EXPORT_DIR instead, for exports too big to wait on
+
+Queued exports are tracked by a record in Redis (KEY_EXPORT: owner, file,
+status) that lives CHAT_EXPORT_TTL_SEC. Only the owner can read it or
+download the file (views_async.ExportStatusView / ExportDownloadView), and
+chat.tasks.expire_exports deletes files older than that.
+"""
+import csv
+import gzip
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from secrets import token_hex
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .encoders import dumps, encode_dt, loads, message_dict, user_public
+from .models import Message
+from .redis_clients import get_aredis, get_redis
+
+log = logging.getLogger(__name__)
+
+FORMATS = {
+    # format -> (content type, file extension)
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+}
+CSV_COLUMNS = ["id", "created_at", "sender", "receiver", "text", "status", "delivered_at", "seen_at"]
+
+EXPORT_WRITE_BYTES = 64 * 1024  # bytes buffered before each write / streamed chunk
+
+KEY_EXPORT = "export:{}"  # export id -> {"owner", "peer", "format", "file", "status", "messages", "expires_at"}
+STATUS_PENDING, STATUS_READY, STATUS_FAILED = "pending", "ready", "failed"
+
+
+def export_rows(me_id: int, other_id: int):
+    """The whole me_id <-> other_id history, oldest first, no joins (both users are known up front)."""
+    return (
+        Message.objects
+        .filter(Q(sender_id=me_id, receiver_id=other_id) | Q(sender_id=other_id, receiver_id=me_id))
+        .only("id", "sender", "receiver", "text", "created_at", "status", "delivered_at", "seen_at")
+        .order_by("created_at", "id")
+    )
+
+
+class _Line:
+    """csv.writer target that hands back the row it was given instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+class Encoder:
+    """Message rows -> bytes in one export format, with the two users encoded once."""
+
+    def __init__(self, fmt: str, me, other):
+        self.fmt = fmt
+        self.users = {me.id: user_public(me), other.id: user_public(other)}
+        self.tz = timezone.get_current_timezone()
+        self._csv = csv.writer(_Line())
+
+    def header(self) -> bytes:
+        return self._csv.writerow(CSV_COLUMNS).encode() if self.fmt == "csv" else b""
+
+    def row(self, m) -> bytes:
+        sender, receiver = self.users[m.sender_id], self.users[m.receiver_id]
+        if self.fmt == "csv":
+            return self._csv.writerow([
+                m.id, encode_dt(m.created_at, self.tz), sender["username"], receiver["username"], m.text,
+                m.status, encode_dt(m.delivered_at, self.tz), encode_dt(m.seen_at, self.tz),
+            ]).encode()
+        return dumps(message_dict(m, sender, receiver, self.tz)) + b"\n"
+
+
+def iter_export(rows, encoder: Encoder):
+    """Export bytes in ~EXPORT_WRITE_BYTES pieces from a sync row iterator."""
+    buf, size = [encoder.header()], 0
+    for m in rows:
+        line = encoder.row(m)
+        buf.append(line)
+        size += len(line)
+        if size >= EXPORT_WRITE_BYTES:
+            yield b"".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b"".join(buf)
+
+
+async def aiter_export(rows, encoder: Encoder):
+    """iter_export for an async row iterator."""
+    buf, size = [encoder.header()], 0
+    async for m in rows:
+        line = encoder.row(m)
+        buf.append(line)
+        size += len(line)
+        if size >= EXPORT_WRITE_BYTES:
+            yield b"".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b"".join(buf)
+
+
+def export_filename(me, other, fmt: str, now: Optional[datetime] = None) -> str:
+    """Path of a new export file, relative to MEDIA_ROOT (hard to guess: MEDIA_URL may be served)."""
+    stamp = (now or timezone.now()).strftime("%Y%m%dT%H%M%SZ")
+    name = f"{me.username}-{other.username}-{stamp}-{token_hex(8)}.{FORMATS[fmt][1]}.gz"
+    return os.path.join(settings.CHAT_EXPORT_DIR, str(me.id), name)
+
+
+def write_export(me, other, fmt: str, name: str, using: Optional[str] = None) -> int:
+    """
+    Write the export gzipped to MEDIA_ROOT/`name` (via a .part file, so a
+    half-written export is never visible under the final name). Returns the
+    number of messages written.
+    """
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    encoder = Encoder(fmt, me, other)
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for m in rows:
+            count += 1
+            yield m
+
+    rows = export_rows(me.id, other.id).using(using).iterator(chunk_size=settings.CHAT_EXPORT_CHUNK)
+    try:
+        with gzip.open(path + ".part", "wb", compresslevel=6) as f:
+            for piece in iter_export(counted(rows), encoder):
+                f.write(piece)
+        os.replace(path + ".part", path)
+    except BaseException:
+        if os.path.exists(path + ".part"):
+            os.remove(path + ".part")
+        raise
+    return count
+
+
+# ---------- queued exports ----------
+
+async def acreate_record(me, other, fmt: str) -> Dict[str, Any]:
+    """Record (with a fresh "id") of an export about to be queued; expires with the file."""
+    ttl = settings.CHAT_EXPORT_TTL_SEC
+    record = {
+        "id": token_hex(16), "owner": me.id, "peer": other.id, "format": fmt,
+        "file": export_filename(me, other, fmt), "status": STATUS_PENDING, "messages": None,
+        "expires_at": (timezone.now() + timedelta(seconds=ttl)).isoformat(),
+    }
+    await get_aredis().set(KEY_EXPORT.format(record["id"]), dumps(record), ex=ttl)
+    return record
+
+
+async def aget_record(export_id: str, owner_id: int) -> Optional[Dict[str, Any]]:
+    """The record of `export_id`, or None if it expired or belongs to someone else."""
+    raw = await get_aredis().get(KEY_EXPORT.format(export_id))
+    record = loads(raw) if raw else None
+    return record if record and record["owner"] == owner_id else None
+
+
+def get_record(export_id: str) -> Optional[Dict[str, Any]]:
+    raw = get_redis().get(KEY_EXPORT.format(export_id))
+    return loads(raw) if raw else None
+
+
+def update_record(record: Dict[str, Any], **changes) -> None:
+    """Save `changes` to a record that still exists, keeping its expiry."""
+    record.update(changes)
+    get_redis().set(KEY_EXPORT.format(record["id"]), dumps(record), keepttl=True, xx=True)
+
+
+def expire_files(now: Optional[float] = None) -> int:
+    """Delete export files (and leftover .part files) older than CHAT_EXPORT_TTL_SEC; returns how many."""
+    root = os.path.join(settings.MEDIA_ROOT, settings.CHAT_EXPORT_DIR)
+    cutoff = (now or time.time()) - settings.CHAT_EXPORT_TTL_SEC
+    removed = 0
+    for dirpath, _, filenames in os.walk(root, topdown=False):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        if dirpath != root:
+            try:
+                os.rmdir(dirpath)  # only succeeds once the user's directory is empty
+            except OSError:
+                pass
+    if removed:
+        log.info("removed %d expired exports", removed)
+    return removed
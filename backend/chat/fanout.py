@@ -0,0 +1,69 @@
+# chat/fanout.py
+"""
+Coalesced inbox fan-out. Consumers call `inbox_updates.schedule(owner, peer)`
+instead of computing and sending a thread.update themselves; repeated
+requests for the same (owner, peer) thread inside the window collapse into a
+single summary computed at flush time.
+"""
+import asyncio
+import logging
+from typing import Dict, Tuple
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from core.db import db_sync_to_async
+from core.metrics import group_send_total
+from .threads import thread_summary
+
+log = logging.getLogger(__name__)
+
+
+def inbox_group(username: str) -> str:
+    return f"inbox_{username}"
+
+
+def room_group(a: str, b: str) -> str:
+    """The a <-> b conversation's room group; the one place its name is derived (rooms, sessions, receipts)."""
+    return "chat_" + "__".join(sorted([a, b]))
+
+
+class InboxCoalescer:
+    def __init__(self, window_ms=None):
+        self._window_ms = window_ms
+        self._pending: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    @property
+    def window(self) -> float:
+        ms = self._window_ms if self._window_ms is not None else getattr(settings, "CHAT_INBOX_COALESCE_MS", 100)
+        return max(ms, 0) / 1000
+
+    def schedule(self, owner: str, peer: str) -> None:
+        """Ask for owner's view of the owner<->peer thread to be pushed to owner's inbox."""
+        key = (owner, peer)
+        if key in self._pending:
+            return
+        self._pending[key] = asyncio.get_running_loop().create_task(self._flush_later(key))
+
+    async def _flush_later(self, key):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            # anything scheduled from here on gets its own flush, so the last
+            # state always goes out
+            self._pending.pop(key, None)
+        owner, peer = key
+        try:
+            summary = await db_sync_to_async(thread_summary)(owner, peer)
+            group_send_total.inc("thread.update")
+            await get_channel_layer().group_send(inbox_group(owner), {"type": "thread.update", **summary})
+        except Exception:
+            log.exception("inbox flush failed for %s/%s", owner, peer)
+
+    async def drain(self) -> None:
+        """Wait for everything currently pending (tests / shutdown)."""
+        while self._pending:
+            await asyncio.gather(*list(self._pending.values()), return_exceptions=True)
+
+
+inbox_updates = InboxCoalescer()
@@ -0,0 +1,421 @@
+# chat/ingest.py
+"""
+Write-behind message ingestion (CHAT_INGEST_MODE = "stream").
+
+ChatConsumer assigns the id, appends the message to a Redis stream and
+broadcasts straight away; `chat.tasks.drain_message_stream` (Celery) reads
+the stream through a consumer group and persists batches with bulk_create.
+
+One drain at a time: drains hold a Redis lock (`<CHAT_INGEST_STREAM>:drain`,
+refreshed after every batch, expiring CHAT_INGEST_DRAIN_LOCK_SEC after a
+crash), so entries are applied in stream order. A receipt is therefore
+never applied before the message queued ahead of it has committed; a drain
+that finds the lock taken just returns.
+
+Crash safety: entries are acked (and deleted) only after the DB transaction
+commits. A drain first re-reads its own unacked entries and claims entries
+left idle by dead workers, and persisting skips entries whose row already
+exists, so a replay never double-inserts or double-counts unread messages.
+An id taken by a *different* row (a sync-path insert while both modes run,
+a stale id floor) is an error: the entry is logged and stored under a new
+id rather than dropped.
+
+Receipts: a client can ack a message that is still in the stream. The
+consumers apply receipts to the database right away as usual and, in
+stream mode, also append them to the stream (`enqueue_receipt`); persist
+re-applies each one after the messages queued before it, as of the time
+it was sent, and broadcasts whatever it changed.
+
+Poison entries: a batch that fails on its data (a user deleted meanwhile,
+...) is retried row by row, and rows that still fail go to the dead-letter
+stream `<CHAT_INGEST_STREAM>:dead` with the error, so one bad message never
+blocks the stream. Entries delivered more than CHAT_INGEST_MAX_DELIVERIES
+times (the database keeps failing on them) are dead-lettered unread.
+Infrastructure errors (database down) leave the batch unacked for the next
+drain.
+"""
+import logging
+import os
+import socket
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import redis
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import DataError, IntegrityError, connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from accounts.usercache import user_cache
+from core.db import db_sync_to_async
+from core.metrics import group_send_total, ingest_dead_letters_total
+from .encoders import dumps_text, loads, message_dict, user_public
+from .fanout import inbox_group, room_group
+from .models import Message
+from .receipts import deliver_all_pending, mark_all_seen
+from .sync import next_version, stamp
+from .redis_clients import get_aredis, get_redis
+from .threads import record_messages, record_seen, thread_summary
+from .versions import touch
+
+log = logging.getLogger(__name__)
+
+GROUP = "ingest"
+KEY_NEXT_ID = "chat:ingest:next_id"
+DEAD_LETTER_MAXLEN = 100_000  # approximate cap on the dead-letter stream
+
+# INCR that never hands out an id at or below ARGV[1] (the DB's max id), so
+# the counter can't fall behind rows written by the synchronous path.
+_NEXT_ID_LUA = """
+local cur = tonumber(redis.call('GET', KEYS[1]) or '0')
+local floor = tonumber(ARGV[1])
+if cur < floor then redis.call('SET', KEYS[1], floor) end
+return redis.call('INCR', KEYS[1])
+"""
+
+_db_floor: Optional[int] = None  # max(Message.id) seen by this process
+_db_floor_at = float("-inf")     # when it was read (monotonic)
+DB_FLOOR_REFRESH_SEC = 60
+
+
+def enabled() -> bool:
+    return getattr(settings, "CHAT_INGEST_MODE", "sync") == "stream"
+
+
+def stream_key() -> str:
+    return getattr(settings, "CHAT_INGEST_STREAM", "chat:ingest")
+
+
+def dead_letter_key() -> str:
+    return stream_key() + ":dead"
+
+
+def drain_lock_key() -> str:
+    return stream_key() + ":drain"
+
+
+def _max_message_id() -> int:
+    return Message.objects.aggregate(m=Max("id"))["m"] or 0
+
+
+# ---------- producer side (consumers, async) ----------
+
+async def _next_id() -> int:
+    global _db_floor, _db_floor_at
+    if _db_floor is None or time.monotonic() - _db_floor_at > DB_FLOOR_REFRESH_SEC:
+        _db_floor, _db_floor_at = await db_sync_to_async(_max_message_id)(), time.monotonic()
+    return int(await get_aredis().eval(_NEXT_ID_LUA, 1, KEY_NEXT_ID, _db_floor))
+
+
+def _reallocate_id() -> int:
+    """A fresh id above every row in the table (and every id handed out so far)."""
+    global _db_floor, _db_floor_at
+    _db_floor, _db_floor_at = _max_message_id(), time.monotonic()
+    return int(get_redis().eval(_NEXT_ID_LUA, 1, KEY_NEXT_ID, _db_floor))
+
+
+async def enqueue(sender, receiver, text: str, delivered: bool = False) -> Dict[str, Any]:
+    """
+    Assign an id, append to the stream and return the message payload
+    (same shape ChatConsumer broadcasts in sync mode). `sender`/`receiver`
+    are user records with id + username.
+    """
+    now = timezone.now()
+    m = Message(
+        id=await _next_id(), sender_id=sender.id, receiver_id=receiver.id, text=text, created_at=now,
+        status=Message.STATUS_DELIVERED if delivered else Message.STATUS_SENT,
+        delivered_at=now if delivered else None,
+    )
+    msg = message_dict(m, user_public(sender), user_public(receiver))
+    await get_aredis().xadd(stream_key(), {"m": dumps_text(msg)})
+    return msg
+
+
+def enqueue_receipt(kind: str, me_id: int, ts: datetime, **fields) -> None:
+    """
+    Queue a receipt behind the messages already in the stream (sync; the
+    consumers call it from their DB thread). kind: "delivered" (id),
+    "seen_all" (peer) or "delivered_all".
+    """
+    payload = {"kind": kind, "me": me_id, "ts": ts.isoformat(), **fields}
+    get_redis().xadd(stream_key(), {"r": dumps_text(payload)})
+
+
+# ---------- consumer side (celery, sync) ----------
+
+def _consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _ensure_group(r) -> None:
+    try:
+        r.xgroup_create(stream_key(), GROUP, id="0", mkstream=True)
+    except Exception as exc:  # BUSYGROUP: already there
+        if "BUSYGROUP" not in str(exc):
+            raise
+
+
+def _parse_dt(value: str) -> datetime:
+    # encoders.encode_dt writes UTC as "...Z"; fromisoformat wants +00:00 before 3.11
+    return datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+
+
+def _to_message(payload: Dict[str, Any]) -> Message:
+    delivered_at = payload.get("delivered_at")
+    return Message(
+        id=payload["id"],
+        sender_id=payload["sender"]["id"],
+        receiver_id=payload["receiver"]["id"],
+        text=payload["text"],
+        created_at=_parse_dt(payload["created_at"]),
+        status=payload.get("status") or Message.STATUS_SENT,
+        delivered_at=_parse_dt(delivered_at) if delivered_at else None,
+    )
+
+
+def _advance_pg_sequence(max_id: int) -> None:
+    # explicit ids don't move the Postgres sequence; keep it ahead so the
+    # synchronous path never reuses an id handed out here
+    if connection.vendor != "postgresql":
+        return
+    table = Message._meta.db_table
+    with connection.cursor() as cur:
+        cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        seq = cur.fetchone()[0]
+        cur.execute(f"SELECT setval(%s, GREATEST(%s, (SELECT last_value FROM {seq})))", [seq, max_id])
+
+
+def persist(entries: List[tuple]) -> int:
+    """
+    Insert a batch of (stream_id, fields) entries; returns rows inserted.
+    Entries that can't be stored are dead-lettered, so the whole batch can
+    be acked once this returns.
+    """
+    msgs, receipts, dead = [], [], []
+    for entry_id, fields in entries:
+        try:
+            if "r" in fields:
+                receipts.append((entry_id, fields, loads(fields["r"])))
+            else:
+                msgs.append((entry_id, fields, _to_message(loads(fields["m"]))))
+        except Exception as exc:
+            log.exception("malformed ingest entry %s", entry_id)
+            dead.append((entry_id, fields, exc))
+
+    inserted = 0
+    if msgs:
+        try:
+            inserted = _insert([m for _, _, m in msgs])
+        except (IntegrityError, DataError):
+            log.warning("ingest batch of %d failed; retrying one by one", len(msgs), exc_info=True)
+            for entry_id, fields, m in msgs:
+                try:
+                    inserted += _insert([m])
+                except (IntegrityError, DataError) as exc:
+                    log.error("ingest entry %s (message %s) failed: %s", entry_id, m.id, exc)
+                    dead.append((entry_id, fields, exc))
+    # receipts only refer to messages queued before them, and drains run one
+    # at a time (see drain): those are committed by now
+    for entry_id, fields, receipt in receipts:
+        try:
+            _apply_receipt(receipt)
+        except (IntegrityError, DataError, KeyError, ValueError) as exc:
+            log.error("ingest receipt %s failed: %s", entry_id, exc)
+            dead.append((entry_id, fields, exc))
+    dead_letter(dead)
+    return inserted
+
+
+def _insert(msgs: List[Message]) -> int:
+    with transaction.atomic():
+        existing = {
+            row[0]: row[1:]
+            for row in Message.objects.filter(id__in=[m.id for m in msgs])
+            .values_list("id", "sender_id", "receiver_id", "created_at")
+        }
+        fresh = []
+        for m in msgs:
+            row = existing.get(m.id)
+            if row == (m.sender_id, m.receiver_id, m.created_at):
+                continue  # replay of an entry stored before its ack was lost
+            if row is not None:
+                same = Message.objects.filter(sender_id=m.sender_id, receiver_id=m.receiver_id, created_at=m.created_at)
+                if same.exists():
+                    continue  # replay of an entry already stored under a new id
+                old_id, m.id = m.id, _reallocate_id()
+                log.error("ingest id %s is taken by another message; storing %s -> %s as %s instead",
+                          old_id, m.sender_id, m.receiver_id, m.id)
+            fresh.append(m)
+        if fresh:
+            users = {m.sender_id for m in fresh} | {m.receiver_id for m in fresh}
+            version = next_version(*users)  # one per batch
+            for m in fresh:
+                m.version = version
+            Message.objects.bulk_create(fresh)
+            record_messages(fresh)
+            _advance_pg_sequence(max(m.id for m in fresh))
+    if fresh:
+        try:
+            _notify_inboxes({(m.sender_id, m.receiver_id) for m in fresh})
+        except Exception:
+            log.exception("inbox notify after ingest failed")
+    return len(fresh)
+
+
+def _apply_receipt(r: Dict[str, Any]) -> None:
+    me_id, at = r["me"], _parse_dt(r["ts"])
+    seen, delivered = [], {}
+    with transaction.atomic():
+        if r["kind"] == "delivered":
+            msg = Message.objects.filter(id=r["id"], receiver_id=me_id, status=Message.STATUS_SENT)
+            sender_id = msg.values_list("sender_id", flat=True).first()
+            if sender_id is not None and msg.update(status=Message.STATUS_DELIVERED, delivered_at=at):
+                stamp([r["id"]], sender_id, me_id)
+                touch((sender_id, me_id))
+            # the consumer broadcast this one already
+        elif r["kind"] == "seen_all":
+            seen = mark_all_seen(me_id, r["peer"], at=at)
+            if seen:
+                record_seen(me_id, r["peer"], len(seen))
+        elif r["kind"] == "delivered_all":
+            _, delivered = deliver_all_pending(me_id, at=at)
+            touch(*((me_id, sender_id) for sender_id in delivered))
+        else:
+            raise ValueError(f"unknown receipt kind {r['kind']!r}")
+    if seen or delivered:
+        try:
+            _broadcast_receipts(me_id, r.get("peer"), seen, delivered, r["ts"])
+        except Exception:
+            log.exception("receipt broadcast after ingest failed")
+
+
+def _broadcast_receipts(me_id: int, peer_id: Optional[int], seen, delivered, ts: str) -> None:
+    layer = get_channel_layer()
+    me = user_cache.get(id=me_id)
+    if layer is None or not me:
+        return
+    if seen:
+        peer = user_cache.get(id=peer_id)
+        if peer:
+            room = room_group(me.username, peer.username)
+            group_send_total.inc("chat.receipt_bulk_seen")
+            async_to_sync(layer.group_send)(room, {"type": "chat.receipt_bulk_seen", "room": room, "items": seen})
+    for sender_id, ids in delivered.items():
+        sender = user_cache.get(id=sender_id)
+        if sender:
+            room = room_group(me.username, sender.username)
+            group_send_total.inc("chat.receipt_bulk_delivered")
+            async_to_sync(layer.group_send)(room, {
+                "type": "chat.receipt_bulk_delivered", "room": room, "items": [{"id": i, "ts": ts} for i in ids],
+            })
+    pairs = {(me_id, sender_id) for sender_id in delivered}
+    if seen:
+        pairs.add((me_id, peer_id))
+    _notify_inboxes(pairs)
+
+
+def dead_letter(items) -> None:
+    """Move (stream_id, fields, error) entries to the dead-letter stream."""
+    if not items:
+        return
+    pipe = get_redis().pipeline(transaction=False)
+    for entry_id, fields, error in items:
+        pipe.xadd(dead_letter_key(), {**fields, "entry": entry_id, "error": str(error)[:1000]},
+                  maxlen=DEAD_LETTER_MAXLEN, approximate=True)
+    pipe.execute()
+    ingest_dead_letters_total.inc(amount=len(items))
+
+
+def _notify_inboxes(pairs) -> None:
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    done = set()
+    for a_id, b_id in pairs:
+        a, b = user_cache.get(id=a_id), user_cache.get(id=b_id)
+        if not a or not b:
+            continue
+        for owner, peer in ((a, b), (b, a)):
+            if (owner.id, peer.id) in done:
+                continue
+            done.add((owner.id, peer.id))
+            summary = thread_summary(owner.username, peer.username)
+            group_send_total.inc("thread.update")
+            async_to_sync(layer.group_send)(inbox_group(owner.username), {"type": "thread.update", **summary})
+
+
+def drain(batch_size: Optional[int] = None, max_batches: int = 20, min_idle_ms: int = 60_000) -> int:
+    """
+    Persist what's in the stream; returns the number of messages inserted
+    (0 without doing anything if another drain holds the lock).
+    """
+    r = get_redis()
+    lock = r.lock(drain_lock_key(), timeout=settings.CHAT_INGEST_DRAIN_LOCK_SEC)
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        return _drain(r, lock, batch_size, max_batches, min_idle_ms)
+    except redis.exceptions.LockError:
+        log.error("ingest drain lost its lock (a batch took over %ss); stopping", settings.CHAT_INGEST_DRAIN_LOCK_SEC)
+        return 0
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            pass  # expired, or taken over by the next drain
+
+
+def _drain(r, lock, batch_size, max_batches, min_idle_ms) -> int:
+    key = stream_key()
+    batch_size = batch_size or getattr(settings, "CHAT_INGEST_BATCH_SIZE", 500)
+    name = _consumer_name()
+    _ensure_group(r)
+
+    def ack(entries):
+        ids = [e[0] for e in entries]
+        pipe = r.pipeline(transaction=False)
+        pipe.xack(key, GROUP, *ids)
+        pipe.xdel(key, *ids)
+        pipe.execute()
+        lock.reacquire()  # still ours, for another CHAT_INGEST_DRAIN_LOCK_SEC
+
+    inserted = 0
+    # 1) replay: our own unacked entries, then ones abandoned by dead workers
+    pending = r.xreadgroup(GROUP, name, {key: "0"}, count=batch_size)
+    for _, entries in pending or []:
+        if entries:
+            inserted += persist(_under_delivery_limit(r, entries))
+            ack(entries)
+    claimed = r.xautoclaim(key, GROUP, name, min_idle_time=min_idle_ms, start_id="0-0", count=batch_size)
+    if claimed and claimed[1]:
+        inserted += persist(_under_delivery_limit(r, claimed[1]))
+        ack(claimed[1])
+
+    # 2) new entries
+    for _ in range(max_batches):
+        resp = r.xreadgroup(GROUP, name, {key: ">"}, count=batch_size)
+        entries = resp[0][1] if resp else []
+        if not entries:
+            break
+        inserted += persist(entries)
+        ack(entries)
+    return inserted
+
+
+def _under_delivery_limit(r, entries: List[tuple]) -> List[tuple]:
+    """Replayed entries still worth a try; the rest are dead-lettered."""
+    limit = settings.CHAT_INGEST_MAX_DELIVERIES
+    info = r.xpending_range(stream_key(), GROUP, min=entries[0][0], max=entries[-1][0], count=len(entries))
+    deliveries = {p["message_id"]: p["times_delivered"] for p in info}
+    keep, dead = [], []
+    for entry_id, fields in entries:
+        if deliveries.get(entry_id, 0) > limit:
+            log.error("ingest entry %s failed %d deliveries; dead-lettering it", entry_id, deliveries[entry_id])
+            dead.append((entry_id, fields, f"delivered {deliveries[entry_id]} times"))
+        else:
+            keep.append((entry_id, fields))
+    dead_letter(dead)
+    return keep
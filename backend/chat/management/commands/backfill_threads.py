@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from chat.models import Message, Thread, ThreadParticipant
+from chat.threads import get_or_create_thread
+
+
+class Command(BaseCommand):
+    help = "Populate Thread / ThreadParticipant rows from existing Message history (idempotent)."
+
+    def handle(self, *args, **options):
+        # per-direction unread counts: (sender, receiver) -> unread
+        unread = {}
+        pairs = set()
+        rows = (
+            Message.objects
+            .values("sender_id", "receiver_id")
+            .annotate(unread=Count("id", filter=Q(is_read=False)))
+        )
+        for row in rows.iterator():
+            s, r = row["sender_id"], row["receiver_id"]
+            unread[(s, r)] = row["unread"]
+            pairs.add((min(s, r), max(s, r)))
+
+        for n, (a, b) in enumerate(sorted(pairs), start=1):
+            last = (
+                Message.objects
+                .filter(Q(sender_id=a, receiver_id=b) | Q(sender_id=b, receiver_id=a))
+                .order_by("-created_at", "-id")
+                .first()
+            )
+            with transaction.atomic():
+                thread = get_or_create_thread(a, b)
+                Thread.objects.filter(pk=thread.pk).update(last_message=last, last_activity=last.created_at)
+                ThreadParticipant.objects.filter(thread=thread).update(last_activity=last.created_at)
+                # participant `user` receives from `peer`
+                ThreadParticipant.objects.filter(user_id=a, peer_id=b).update(unread_count=unread.get((b, a), 0))
+                ThreadParticipant.objects.filter(user_id=b, peer_id=a).update(unread_count=unread.get((a, b), 0))
+            if n % 1000 == 0:
+                self.stdout.write(f"{n}/{len(pairs)} threads")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {len(pairs)} threads"))
@@ -0,0 +1,69 @@
+import json
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from chat.encoders import FastJSONRenderer, message_list, orjson
+from chat.models import Message
+from chat.serializers import MessageSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare chat.encoders against the DRF serializers on in-memory messages (no DB access)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=5000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--json", action="store_true", help="machine-readable output")
+
+    def handle(self, *args, **opts):
+        n, repeat = opts["messages"], opts["repeat"]
+        a = User(id=1, username="alice", first_name="Alice", last_name="A")
+        b = User(id=2, username="bob", first_name="Bob", last_name="B")
+        now = timezone.now()
+        msgs = [
+            Message(id=i, sender=a if i % 2 else b, receiver=b if i % 2 else a, text=f"message number {i} ✓",
+                    created_at=now + timedelta(microseconds=i), status=Message.STATUS_SEEN,
+                    delivered_at=now, seen_at=now)
+            for i in range(1, n + 1)
+        ]
+
+        drf_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+
+        def drf():
+            return drf_renderer.render(MessageSerializer(msgs, many=True).data)
+
+        def fast():
+            return fast_renderer.render(message_list(msgs))
+
+        if json.loads(drf()) != json.loads(fast()):
+            raise SystemExit("encoders.message_dict output differs from MessageSerializer")
+
+        results = {}
+        for name, fn in (("drf", drf), ("fast", fast)):
+            best = min(self._time(fn) for _ in range(repeat))
+            results[name] = {"seconds": best, "us_per_message": best / n * 1e6}
+        report = {
+            "messages": n,
+            "repeat": repeat,
+            "orjson": orjson is not None,
+            "results": results,
+            "speedup": results["drf"]["seconds"] / results["fast"]["seconds"],
+        }
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(report))
+            return
+        for name, r in results.items():
+            self.stdout.write(f"{name:>5}: {r['seconds'] * 1000:8.1f} ms  ({r['us_per_message']:.2f} µs/message)")
+        self.stdout.write(f"speedup: {report['speedup']:.1f}x  (orjson={'yes' if report['orjson'] else 'no'})")
+
+    @staticmethod
+    def _time(fn):
+        t = time.perf_counter()
+        fn()
+        return time.perf_counter() - t
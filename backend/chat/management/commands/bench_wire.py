@@ -0,0 +1,114 @@
+import json
+import random
+import time
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat import wire
+from chat.encoders import dumps, dumps_text, message_dict, message_list, msgpack, orjson, thread_summary_dict
+from chat.models import Message
+
+WORDS = (
+    "ok sure see you at the station tomorrow morning did you get my email about the invoice "
+    "lol that's great can we move the call to 3pm I'm running late sorry traffic is terrible "
+    "thanks! sounds good 👍 what time works for you where are you I'll be there in 10 min "
+    "haha yes exactly no worries let me check and get back to you ❤️ happy birthday 🎉"
+).split()
+
+
+class Command(BaseCommand):
+    help = ("Bytes on the wire and encode cost of chat.wire MessagePack frames vs JSON frames, "
+            "uncompressed and zlib-compressed (no DB access).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=2000, help="encodes per frame and run")
+        parser.add_argument("--seed", type=int, default=1, help="seed for the generated conversation")
+        parser.add_argument("--json", action="store_true", help="machine-readable output")
+
+    def handle(self, *args, **opts):
+        if msgpack is None:
+            raise SystemExit("msgpack is not installed")
+        repeat = opts["repeat"]
+        rnd = random.Random(opts["seed"])
+        a = User(id=1, username="alice.anderson", first_name="Alice", last_name="Anderson")
+        b = User(id=2, username="bob_brown93", first_name="Bob", last_name="Brown")
+        msgs = self._conversation(rnd, a, b, 50)
+        last = msgs[-1]
+        frames = {
+            "message.new": {"type": "message.new", "message": message_dict(last)},
+            "message.new(long)": {"type": "message.new", "message": message_dict(self._conversation(
+                rnd, a, b, 1, words=(150, 250))[0])},
+            "receipt.update": {"type": "receipt.update", "message_id": last.id, "status": "delivered",
+                               "ts": self._ts(rnd)},
+            "typing": {"type": "typing", "from": a.username, "active": True},
+            "thread.update": {"type": "thread.update", **thread_summary_dict(b, 3, last, a.id)},
+            "receipt.bulk_seen(200)": {"type": "receipt.bulk_seen",
+                                       "items": [{"id": last.id - 200 + i, "ts": self._ts(rnd)} for i in range(200)]},
+            "history(50)": {"results": message_list(msgs), "before": "MjAyNS0wMS0wMVQxMjowMDowMHwxMDAw", "after": None},
+        }
+
+        results = {}
+        for name, frame in frames.items():
+            if any(wire.unpack(wire.pack(frame, compress=c)) != frame for c in (False, True)):
+                raise SystemExit(f"{name}: MessagePack round trip differs")
+            results[name] = {
+                "json_bytes": len(dumps(frame)),
+                "msgpack_bytes": len(wire.pack(frame, compress=False)),
+                "json_zlib_bytes": len(zlib.compress(dumps(frame), 6)),
+                "msgpack_zlib_bytes": len(wire.pack(frame, compress=True)),
+                "sent_bytes": len(wire.pack(frame)),
+                "json_us": self._time(lambda: dumps_text(frame), repeat),
+                "msgpack_us": self._time(lambda: wire.pack(frame, compress=False), repeat),
+            }
+        report = {"repeat": repeat, "orjson": orjson is not None,
+                  "compress_min_bytes": settings.CHAT_WS_COMPRESS_MIN_BYTES, "results": results}
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(report))
+            return
+        self.stdout.write(f"{'':<24}{'-- uncompressed --':>24}{'------ zlib ------':>24}")
+        self.stdout.write(f"{'frame':<24}{'json B':>8}{'mpack B':>9}{'saved':>7}"
+                          f"{'json B':>8}{'mpack B':>9}{'saved':>7}{'sent B':>8}{'json µs':>9}{'mpack µs':>10}")
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<24}{r['json_bytes']:>8}{r['msgpack_bytes']:>9}{1 - r['msgpack_bytes'] / r['json_bytes']:>7.0%}"
+                f"{r['json_zlib_bytes']:>8}{r['msgpack_zlib_bytes']:>9}"
+                f"{1 - r['msgpack_zlib_bytes'] / r['json_zlib_bytes']:>7.0%}{r['sent_bytes']:>8}"
+                f"{r['json_us']:>9.1f}{r['msgpack_us']:>10.1f}"
+            )
+        self.stdout.write(f"(orjson={'yes' if report['orjson'] else 'no'}; sent B is what the server actually sends "
+                          f"on chat.msgpack.v1: frames >= {report['compress_min_bytes']} B go out zlib-compressed. "
+                          f"Compare it with zlib json B for a JSON client behind permessage-deflate.)")
+
+    @staticmethod
+    def _ts(rnd):
+        return (timezone.now() - timedelta(seconds=rnd.randrange(86400), microseconds=rnd.randrange(10 ** 6))).isoformat()
+
+    @staticmethod
+    def _conversation(rnd, a, b, n, words=(1, 25)):
+        """n messages with varied senders, lengths, statuses and timestamps, oldest first."""
+        t = timezone.now() - timedelta(days=2)
+        msgs = []
+        for i in range(n):
+            t += timedelta(seconds=rnd.randrange(2, 900), microseconds=rnd.randrange(10 ** 6))
+            sender = rnd.choice((a, b))
+            status = rnd.choice((Message.STATUS_SEEN,) * 6 + (Message.STATUS_DELIVERED,) * 2 + (Message.STATUS_SENT,))
+            delivered = t + timedelta(seconds=rnd.randrange(1, 60)) if status != Message.STATUS_SENT else None
+            seen = delivered + timedelta(seconds=rnd.randrange(1, 3600)) if status == Message.STATUS_SEEN else None
+            text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(*words)))
+            msgs.append(Message(id=48_211 + i * rnd.randint(1, 40), sender=sender, receiver=b if sender is a else a,
+                                text=text[0].upper() + text[1:], created_at=t, status=status,
+                                delivered_at=delivered, seen_at=seen))
+        return msgs
+
+    @staticmethod
+    def _time(fn, repeat):
+        t = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        return (time.perf_counter() - t) / repeat * 1e6
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+import uuid
+from collections import Counter
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+
+class QueryCounter:
+    """Counts queries on every DB connection, including the threadpool's."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def attach(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def percentiles(values, ps=(50, 90, 99)):
+    if not values:
+        return {f"p{p}": None for p in ps} | {"max": None}
+    values = sorted(values)
+    out = {f"p{p}": values[min(len(values) - 1, int(len(values) * p / 100))] for p in ps}
+    out["max"] = values[-1]
+    return out
+
+
+class Command(BaseCommand):
+    help = (
+        "In-process WebSocket load test: runs core.asgi.application with N simulated users "
+        "(chat + inbox + presence sockets each) and reports latency percentiles, DB queries per "
+        "event and throughput as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20, help="simulated users (paired into conversations)")
+        parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+        parser.add_argument("--send-rate", type=float, default=1.0, help="message.send per user per second")
+        parser.add_argument("--typing-rate", type=float, default=2.0, help="typing.start/stop per user per second")
+        parser.add_argument("--receipt-rate", type=float, default=0.5, help="receipt.seen_all per user per second")
+        parser.add_argument("--layer", choices=["memory", "configured"], default="memory",
+                            help="in-memory channel layer, or CHANNEL_LAYERS from settings")
+        parser.add_argument("--fake-redis", action="store_true",
+                            help="serve presence/ingest Redis calls from fakeredis (must be installed)")
+        parser.add_argument("--current-db", action="store_true",
+                            help="run against the configured database instead of a throwaway test DB")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="write the JSON report here instead of stdout")
+
+    def handle(self, *args, **opts):
+        if opts["users"] < 2 or opts["users"] % 2:
+            raise CommandError("--users must be an even number >= 2")
+        random.seed(opts["seed"])
+
+        if opts["layer"] == "memory":
+            from channels.layers import channel_layers
+            settings.CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+            channel_layers.backends.clear()
+        if opts["fake_redis"]:
+            self._use_fake_redis()
+
+        old_db = None
+        if not opts["current_db"]:
+            if connection.vendor != "sqlite":
+                raise CommandError("the throwaway DB is SQLite-only; pass --current-db to use the configured one")
+            old_db = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        counter = QueryCounter()
+        connection_created.connect(counter.attach, dispatch_uid="bench_ws_counter")
+        counter.attach(connection=connection)
+        try:
+            users = self._make_users(opts["users"])
+            report = asyncio.run(self._run(users, counter, opts))
+        finally:
+            connection_created.disconnect(dispatch_uid="bench_ws_counter")
+            if old_db is not None:
+                connection.creation.destroy_test_db(old_db, verbosity=0)
+
+        out = json.dumps(report, indent=2)
+        if opts["output"]:
+            with open(opts["output"], "w") as f:
+                f.write(out + "\n")
+        else:
+            self.stdout.write(out)
+
+    # ---------- setup ----------
+
+    def _use_fake_redis(self):
+        try:
+            import fakeredis
+        except ImportError:
+            raise CommandError("--fake-redis needs the 'fakeredis' package")
+        from chat import presence, redis_clients
+        server = fakeredis.FakeServer()
+        redis_clients._sync_client = presence._r = fakeredis.FakeStrictRedis(server=server, decode_responses=True)
+        self._fake_aredis = lambda: fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+
+    def _make_users(self, n):
+        from rest_framework_simplejwt.tokens import AccessToken
+        users = []
+        for i in range(n):
+            u, _ = User.objects.get_or_create(username=f"bench_{i}")
+            users.append((u.username, str(AccessToken.for_user(u))))
+        return users
+
+    # ---------- load ----------
+
+    async def _run(self, users, counter, opts):
+        from channels.testing import WebsocketCommunicator
+        from core.asgi import application
+        from chat.fanout import inbox_updates
+        from chat import redis_clients
+
+        if opts["fake_redis"]:
+            redis_clients._async_clients[asyncio.get_running_loop()] = self._fake_aredis()
+
+        sent_at = {}        # message tag -> perf_counter at send
+        latencies = []      # seconds, sender send -> peer receives message.new
+        events = Counter()  # client -> server
+        received = Counter()  # server -> client
+        stop = asyncio.Event()
+
+        async def open_ws(path, token):
+            c = WebsocketCommunicator(application, f"{path}?token={token}")
+            ok, _ = await c.connect(timeout=10)
+            if not ok:
+                raise CommandError(f"connect refused: {path}")
+            return c
+
+        async def reader(c, owner=None):
+            # read the output queue directly: receive_from(timeout=...) cancels
+            # the application when it times out
+            while not stop.is_set():
+                try:
+                    out = await asyncio.wait_for(c.output_queue.get(), timeout=0.2)
+                except asyncio.TimeoutError:
+                    continue
+                if out.get("type") != "websocket.send":
+                    return
+                data = json.loads(out["text"])
+                received[data.get("type")] += 1
+                if owner and data.get("type") == "message.new":
+                    msg = data["message"]
+                    if msg["receiver"]["username"] == owner:
+                        t0 = sent_at.pop(msg["text"], None)
+                        if t0 is not None:
+                            latencies.append(time.perf_counter() - t0)
+
+        async def actor(me, chat):
+            rates = (
+                ("message.send", opts["send_rate"]),
+                ("typing", opts["typing_rate"]),
+                ("receipt.seen_all", opts["receipt_rate"]),
+            )
+            total = sum(r for _, r in rates)
+            if total <= 0:
+                return
+            typing = False
+            while not stop.is_set():
+                await asyncio.sleep(random.expovariate(total))
+                if stop.is_set():
+                    return
+                pick = random.uniform(0, total)
+                for kind, rate in rates:
+                    if pick < rate:
+                        break
+                    pick -= rate
+                if kind == "message.send":
+                    tag = f"bench:{me}:{uuid.uuid4().hex}"
+                    sent_at[tag] = time.perf_counter()
+                    await chat.send_to(json.dumps({"type": "message.send", "text": tag}))
+                elif kind == "typing":
+                    typing = not typing
+                    kind = "typing.start" if typing else "typing.stop"
+                    await chat.send_to(json.dumps({"type": kind}))
+                else:
+                    await chat.send_to(json.dumps({"type": kind}))
+                events[kind] += 1
+
+        sockets, readers, chats = [], [], []
+        for i, (name, token) in enumerate(users):
+            peer = users[i ^ 1][0]
+            presence = await open_ws("/ws/presence/", token)
+            inbox = await open_ws("/ws/inbox/", token)
+            chat = await open_ws(f"/ws/chat/{peer}/", token)
+            sockets += [presence, inbox, chat]
+            chats.append((name, chat))
+            readers += [asyncio.create_task(reader(presence)), asyncio.create_task(reader(inbox)),
+                        asyncio.create_task(reader(chat, owner=name))]
+
+        q0 = counter.count
+        t0 = time.perf_counter()
+        actors = [asyncio.create_task(actor(name, chat)) for name, chat in chats]
+        await asyncio.sleep(opts["duration"])
+        stop.set()
+        await asyncio.gather(*actors)
+        elapsed = time.perf_counter() - t0
+        await inbox_updates.drain()
+        queries = counter.count - q0
+        await asyncio.gather(*readers)
+        for c in sockets:
+            await c.disconnect()
+
+        n_events = sum(events.values())
+        return {
+            "meta": {
+                "commit": self._git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "db": connection.vendor,
+                "channel_layer": settings.CHANNEL_LAYERS["default"]["BACKEND"],
+            },
+            "config": {k: opts[k] for k in ("users", "duration", "send_rate", "typing_rate", "receipt_rate", "seed")},
+            "events_sent": dict(events),
+            "frames_received": dict(received),
+            "messages": {
+                "sent": events["message.send"],
+                "delivered_to_peer": len(latencies),
+                "latency_ms": {k: (v * 1000 if v is not None else None) for k, v in percentiles(latencies).items()},
+            },
+            "db": {
+                "queries": queries,
+                "queries_per_event": queries / n_events if n_events else None,
+                "queries_per_message": queries / events["message.send"] if events["message.send"] else None,
+            },
+            "throughput": {
+                "elapsed_s": elapsed,
+                "events_per_s": n_events / elapsed,
+                "messages_per_s": len(latencies) / elapsed,
+                "frames_out_per_s": sum(received.values()) / elapsed,
+            },
+        }
+
+    @staticmethod
+    def _git_commit():
+        try:
+            return subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL, text=True
+            ).strip()
+        except Exception:
+            return None
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_clock(apps, schema_editor):
+    apps.get_model("chat", "SyncClock").objects.get_or_create(id=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_created_at_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncClock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'version', 'id'], name='chat_msg_sender_version_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['receiver', 'version', 'id'], name='chat_msg_receiver_version_idx'),
+        ),
+        migrations.RunPython(create_clock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:36
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_last_activity(apps, schema_editor):
+    Thread = apps.get_model("chat", "Thread")
+    ThreadParticipant = apps.get_model("chat", "ThreadParticipant")
+    ThreadParticipant.objects.update(
+        last_activity=Subquery(Thread.objects.filter(pk=OuterRef("thread_id")).values("last_activity")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_message_version_syncclock'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='threadparticipant',
+            name='last_activity',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='threadparticipant',
+            index=models.Index(fields=['user', '-last_activity', '-id'], name='chat_participant_inbox_idx'),
+        ),
+        migrations.RunPython(copy_last_activity, migrations.RunPython.noop),
+    ]
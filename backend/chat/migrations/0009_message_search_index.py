@@ -0,0 +1,69 @@
+"""
+Full-text index over Message.text (see chat.search).
+
+Postgres: GIN expression index on to_tsvector('simple', text); Postgres
+keeps it current on every insert/update.
+SQLite: an FTS5 table with chat_message as external content, kept in sync
+by triggers (bulk_create included).
+"""
+from django.db import migrations
+
+PG_FORWARD = [
+    "CREATE INDEX IF NOT EXISTS chat_message_text_fts ON chat_message "
+    "USING gin (to_tsvector('simple'::regconfig, text))",
+]
+PG_BACKWARD = ["DROP INDEX IF EXISTS chat_message_text_fts"]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_fts USING fts5("
+    "text, content='chat_message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS chat_message_fts_ai AFTER INSERT ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS chat_message_fts_ad AFTER DELETE ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS chat_message_fts_au AFTER UPDATE OF text ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO chat_message_fts(rowid, text) VALUES (new.id, new.text); END",
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_au",
+    "DROP TRIGGER IF EXISTS chat_message_fts_ad",
+    "DROP TRIGGER IF EXISTS chat_message_fts_ai",
+    "DROP TABLE IF EXISTS chat_message_fts",
+]
+
+
+def _run(schema_editor, statements):
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def forward(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        _run(schema_editor, PG_FORWARD)
+    elif vendor == "sqlite":
+        try:
+            _run(schema_editor, SQLITE_FORWARD)
+        except Exception:  # SQLite built without FTS5: search falls back to a scan
+            _run(schema_editor, SQLITE_BACKWARD)
+
+
+def backward(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        _run(schema_editor, PG_BACKWARD)
+    elif vendor == "sqlite":
+        _run(schema_editor, SQLITE_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0008_participant_last_activity"),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
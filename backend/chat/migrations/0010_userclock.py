@@ -0,0 +1,47 @@
+"""
+Per-user sync clocks (chat.sync.next_version) instead of the single
+SyncClock row, whose lock serialized every chat write.
+
+Every existing user starts at the old global value, so cursors handed out
+before the switch stay valid.
+"""
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_clock(apps, schema_editor):
+    value = apps.get_model("chat", "SyncClock").objects.filter(id=1).values_list("value", flat=True).first() or 0
+    if not value:
+        return
+    UserClock = apps.get_model("chat", "UserClock")
+    users = apps.get_model(*settings.AUTH_USER_MODEL.split(".")).objects.values_list("pk", flat=True)
+    UserClock.objects.bulk_create((UserClock(user_id=pk, value=value) for pk in users.iterator()),
+                                  batch_size=1000)
+
+
+def restore_clock(apps, schema_editor):
+    value = apps.get_model("chat", "UserClock").objects.aggregate(v=models.Max("value"))["v"] or 0
+    apps.get_model("chat", "SyncClock").objects.update_or_create(id=1, defaults={"value": value})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_message_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserClock',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sync_clock', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(copy_clock, restore_clock),
+        migrations.DeleteModel(
+            name='SyncClock',
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 class Message(models.Model):
     STATUS_SENT = "sent"
@@ -14,7 +15,9 @@ class Message(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="sent")
     receiver = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="received")
     text = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # not auto_now_add: write-behind ingestion (chat.ingest) persists the
+    # timestamp the message was broadcast with
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     # receipts
     status = models.CharField(max_length=12, choices=STATUS_CHOICES, default=STATUS_SENT)
@@ -23,6 +26,9 @@ class Message(models.Model):
 
     is_read = models.BooleanField(default=False)  # kept for compatibility; mirrors STATUS_SEEN
 
+    # UserClock value of the last change (create / receipt); see chat.sync
+    version = models.BigIntegerField(default=0)
+
     class Meta:
         ordering = ["created_at"]
         indexes = [
@@ -30,7 +36,59 @@ class Message(models.Model):
             models.Index(fields=["receiver", "is_read"]),
             models.Index(fields=["status"]),
             models.Index(fields=["sender", "receiver"]),
+            models.Index(fields=["sender", "version", "id"], name="chat_msg_sender_version_idx"),
+            models.Index(fields=["receiver", "version", "id"], name="chat_msg_receiver_version_idx"),
         ]
 
     def __str__(self):
         return f"{self.sender} → {self.receiver}: {self.text[:30]}"
+
+
+class Thread(models.Model):
+    """
+    One row per conversation pair (user_a.id < user_b.id), maintained on write
+    so inbox/summary reads don't have to scan Message.
+    """
+    user_a = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    user_b = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    last_message = models.ForeignKey(Message, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user_a", "user_b"], name="chat_thread_unique_pair"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_a} ↔ {self.user_b}"
+
+
+class ThreadParticipant(models.Model):
+    """Per-user side of a Thread: who the peer is, how many messages are unread, when it last moved."""
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name="participants")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="threads")
+    peer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    unread_count = models.PositiveIntegerField(default=0)
+    # copy of thread.last_activity so a user's inbox is one index range scan
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "peer"], name="chat_participant_unique_user_peer"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-last_activity", "-id"], name="chat_participant_inbox_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user} → {self.peer} ({self.unread_count} unread)"
+
+
+class UserClock(models.Model):
+    """Per-user clock handing out Message.version values; see chat.sync.next_version."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                                related_name="sync_clock")
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"sync clock of {self.user_id} @ {self.value}"
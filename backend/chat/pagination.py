@@ -0,0 +1,99 @@
+# chat/pagination.py
+import base64
+import heapq
+from datetime import datetime
+from typing import Optional, Tuple
+
+from django.db.models import Q
+
+from .models import Message
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+Cursor = Tuple[datetime, int]  # (created_at, id)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, pk: int) -> str:
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(value: str) -> Cursor:
+    try:
+        padded = value + "=" * (-len(value) % 4)
+        ts, pk = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(ts), int(pk)
+    except Exception as exc:
+        raise InvalidCursor(value) from exc
+
+
+def parse_page_size(value: Optional[str]) -> int:
+    try:
+        size = int(value) if value else DEFAULT_PAGE_SIZE
+    except (TypeError, ValueError):
+        size = DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _direction(sender_id: int, receiver_id: int, *, before: Optional[Cursor], after: Optional[Cursor]):
+    """
+    One side of the conversation (sender -> receiver), ordered along the
+    (sender, receiver, created_at) index in the walking direction. Callers
+    slice it, so the cost does not depend on how deep into the history the
+    cursor points. The redundant created_at bound in front of the tie-break
+    OR is what lets the planner start the index scan at the cursor.
+    """
+    qs = Message.objects.filter(sender_id=sender_id, receiver_id=receiver_id)
+    if before:
+        ts, pk = before
+        return (qs.filter(created_at__lte=ts).filter(Q(created_at__lt=ts) | Q(created_at=ts, id__lt=pk))
+                .order_by("-created_at", "-id"))
+    if after:
+        ts, pk = after
+        return (qs.filter(created_at__gte=ts).filter(Q(created_at__gt=ts) | Q(created_at=ts, id__gt=pk))
+                .order_by("created_at", "id"))
+    return qs.order_by("-created_at", "-id")
+
+
+async def aconversation_page(me_id: int, other_id: int, *, before: Optional[Cursor] = None,
+                             after: Optional[Cursor] = None, page_size: int = DEFAULT_PAGE_SIZE,
+                             using: Optional[str] = None) -> dict:
+    """
+    Keyset page of the me_id <-> other_id history on (created_at, id):
+    {"results": [Message], "before": cursor | None, "after": cursor | None}.
+
+    Without a cursor the newest page is returned; `before` walks towards older
+    messages and `after` towards newer ones. Messages inside a page are always
+    in chronological order. The returned `before`/`after` cursors are None when
+    there is nothing more in that direction. The rows and the cursors come
+    from the same (at most page_size + 1 rows per side) queries.
+    """
+    limit = page_size + 1  # one extra row tells us whether another page exists
+    sides = []
+    for sender_id, receiver_id in ((me_id, other_id), (other_id, me_id)):
+        qs = _direction(sender_id, receiver_id, before=before, after=after).using(using)
+        sides.append([m async for m in qs.select_related("sender", "receiver")[:limit]])
+
+    key = lambda m: (m.created_at, m.id)
+    rows = list(heapq.merge(*sides, key=key, reverse=not after))[:limit]
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if not after:
+        rows.reverse()
+
+    older = newer = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        if after:
+            older = encode_cursor(*key(first))
+            newer = encode_cursor(*key(last)) if has_more else None
+        else:
+            older = encode_cursor(*key(first)) if has_more else None
+            newer = encode_cursor(*key(last)) if before else None
+
+    return {"results": rows, "before": older, "after": newer}
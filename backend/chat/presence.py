@@ -1,11 +1,11 @@
 # chat/presence.py
-import os
-import redis
-from typing import Optional
+from typing import Dict, Iterable, Optional
 from datetime import datetime, timezone
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
-_r = redis.StrictRedis.from_url(REDIS_URL, decode_responses=True)
+from .redis_clients import get_aredis, get_redis
+
+_r = get_redis()
+_ar = get_aredis
 
 PRESENCE_TTL_SEC = 60
 KEY_ONLINE = "presence:online:{}"   # TTL key — exists => online
@@ -14,18 +14,46 @@ KEY_LAST   = "presence:lastseen:{}" # ISO8601 string
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
+# --- pipeline builders, shared by the sync and async APIs ---
+
+def _queue_online(pipe, username: str) -> None:
+    pipe.set(KEY_ONLINE.format(username), "1", ex=PRESENCE_TTL_SEC)
+    pipe.set(KEY_LAST.format(username), _now_iso())
+
+def _queue_refresh(pipe, username: str) -> None:
+    # extend TTL and bump last_seen
+    pipe.expire(KEY_ONLINE.format(username), PRESENCE_TTL_SEC)
+    pipe.set(KEY_LAST.format(username), _now_iso())
+
+def _queue_presence(pipe, names) -> None:
+    for u in names:
+        pipe.exists(KEY_ONLINE.format(u))
+    pipe.mget([KEY_LAST.format(u) for u in names])
+
+def _presence_result(names, results) -> Dict[str, dict]:
+    *online, last_seen = results
+    return {
+        u: {"online": on == 1, "last_seen": ls, "ttl": PRESENCE_TTL_SEC}
+        for u, on, ls in zip(names, online, last_seen)
+    }
+
+# --- sync API (views, management commands, celery) ---
+
 def set_online(username: str) -> None:
-    _r.set(KEY_ONLINE.format(username), "1", ex=PRESENCE_TTL_SEC)
-    _r.set(KEY_LAST.format(username), _now_iso())
+    pipe = _r.pipeline(transaction=False)
+    _queue_online(pipe, username)
+    pipe.execute()
 
 def refresh_online(username: str) -> None:
-    # extend TTL and bump last_seen
-    _r.expire(KEY_ONLINE.format(username), PRESENCE_TTL_SEC)
-    _r.set(KEY_LAST.format(username), _now_iso())
+    pipe = _r.pipeline(transaction=False)
+    _queue_refresh(pipe, username)
+    pipe.execute()
 
 def clear_online(username: str) -> None:
-    _r.delete(KEY_ONLINE.format(username))
-    _r.set(KEY_LAST.format(username), _now_iso())
+    pipe = _r.pipeline(transaction=False)
+    pipe.delete(KEY_ONLINE.format(username))
+    pipe.set(KEY_LAST.format(username), _now_iso())
+    pipe.execute()
 
 def is_online(username: str) -> bool:
     return _r.exists(KEY_ONLINE.format(username)) == 1
@@ -34,8 +62,36 @@ def get_last_seen(username: str) -> Optional[str]:
     return _r.get(KEY_LAST.format(username))
 
 def get_presence(username: str) -> dict:
-    return {
-        "online": is_online(username),
-        "last_seen": get_last_seen(username),
-        "ttl": PRESENCE_TTL_SEC,  # optional
-    }
+    return get_presence_many([username])[username]
+
+def get_presence_many(usernames: Iterable[str]) -> Dict[str, dict]:
+    """Presence for any number of users in one pipelined round trip (EXISTS xN + MGET)."""
+    names = list(dict.fromkeys(usernames))
+    if not names:
+        return {}
+    pipe = _r.pipeline(transaction=False)
+    _queue_presence(pipe, names)
+    return _presence_result(names, pipe.execute())
+
+# --- async API (consumers) — awaited directly, no threadpool hop ---
+
+async def aset_online(username: str) -> None:
+    async with _ar().pipeline(transaction=False) as pipe:
+        _queue_online(pipe, username)
+        await pipe.execute()
+
+async def arefresh_online(username: str) -> None:
+    async with _ar().pipeline(transaction=False) as pipe:
+        _queue_refresh(pipe, username)
+        await pipe.execute()
+
+async def ais_online(username: str) -> bool:
+    return await _ar().exists(KEY_ONLINE.format(username)) == 1
+
+async def aget_presence_many(usernames: Iterable[str]) -> Dict[str, dict]:
+    names = list(dict.fromkeys(usernames))
+    if not names:
+        return {}
+    async with _ar().pipeline(transaction=False) as pipe:
+        _queue_presence(pipe, names)
+        return _presence_result(names, await pipe.execute())
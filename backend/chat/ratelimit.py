@@ -0,0 +1,123 @@
+# chat/ratelimit.py
+"""
+Per-user token buckets in Redis.
+
+Each check is one EVALSHA: the script refills the bucket from the time
+elapsed since the last call (Redis server clock, so app servers can't skew
+it), takes `cost` tokens if there are enough and reports how long to wait
+otherwise. Buckets live in `ratelimit:<bucket>:<user_id>` and expire once
+they would be full again.
+
+Limits come from settings.CHAT_RATE_LIMITS ({bucket: (tokens_per_sec, burst)})
+with per-user overrides in CHAT_RATE_LIMIT_OVERRIDES ({username: {bucket: ...}}).
+If Redis is unavailable the limiter fails open.
+"""
+import logging
+import math
+from typing import Optional, Tuple
+
+import redis
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from .redis_clients import get_aredis, get_redis
+
+log = logging.getLogger(__name__)
+
+KEY_BUCKET = "ratelimit:{}:{}"
+
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local allowed, retry = 0, 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  retry = math.ceil((cost - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return {allowed, retry}
+"""
+
+_sync_script = None
+# async clients are per event loop, so the script is registered once and each
+# call passes the current loop's client
+_async_script = None
+
+
+def enabled() -> bool:
+    return getattr(settings, "CHAT_RATE_LIMIT_ENABLED", True)
+
+
+def limit_for(bucket: str, username: Optional[str] = None) -> Optional[Tuple[float, float]]:
+    """(tokens_per_sec, burst) for this bucket/user, or None when unlimited."""
+    per_user = getattr(settings, "CHAT_RATE_LIMIT_OVERRIDES", {}).get(username) or {}
+    if bucket in per_user:
+        return per_user[bucket]
+    return getattr(settings, "CHAT_RATE_LIMITS", {}).get(bucket)
+
+
+def _args(bucket, user, cost):
+    limit = limit_for(bucket, user.username) if enabled() else None
+    if not limit:
+        return None
+    rate, burst = limit
+    return [KEY_BUCKET.format(bucket, user.id)], [rate, burst, cost]
+
+
+def _result(res) -> Tuple[bool, float]:
+    allowed, retry_ms = res
+    return allowed == 1, int(retry_ms) / 1000
+
+
+def allow(user, bucket: str, cost: int = 1) -> Tuple[bool, float]:
+    """Take `cost` tokens from user's bucket; returns (allowed, retry_after_sec)."""
+    global _sync_script
+    args = _args(bucket, user, cost)
+    if args is None:
+        return True, 0.0
+    if _sync_script is None:
+        _sync_script = get_redis().register_script(_TOKEN_BUCKET_LUA)
+    try:
+        return _result(_sync_script(keys=args[0], args=args[1]))
+    except redis.RedisError:
+        log.warning("rate limiter unavailable, allowing %s for user %s", bucket, user.id, exc_info=True)
+        return True, 0.0
+
+
+async def aallow(user, bucket: str, cost: int = 1) -> Tuple[bool, float]:
+    global _async_script
+    args = _args(bucket, user, cost)
+    if args is None:
+        return True, 0.0
+    client = get_aredis()
+    if _async_script is None:
+        _async_script = client.register_script(_TOKEN_BUCKET_LUA)
+    try:
+        return _result(await _async_script(keys=args[0], args=args[1], client=client))
+    except redis.RedisError:
+        log.warning("rate limiter unavailable, allowing %s for user %s", bucket, user.id, exc_info=True)
+        return True, 0.0
+
+
+class ChatRateThrottle(BaseThrottle):
+    """DRF throttle over the same buckets; views pick one with `throttle_scope` (default "rest")."""
+
+    def allow_request(self, request, view):
+        user = request.user
+        if not user or not user.is_authenticated:
+            return True  # the permission check rejects these anyway
+        ok, self._wait = allow(user, getattr(view, "throttle_scope", "rest"))
+        return ok
+
+    def wait(self):
+        return math.ceil(self._wait) or 1
@@ -0,0 +1,89 @@
+# chat/receipts.py
+"""
+Set-based receipt transitions. Each helper is one UPDATE that reports the
+rows it changed (UPDATE ... RETURNING where the backend supports it), so a
+user coming back to thousands of pending messages costs one statement, plus
+one more to stamp the changed rows for delta sync (chat.sync).
+"""
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import Message
+from .sync import stamp
+
+
+def _can_return() -> bool:
+    if connection.vendor == "postgresql":
+        return True
+    return connection.vendor == "sqlite" and sqlite3.sqlite_version_info >= (3, 35)
+
+
+def _update_returning(sql: str, params: list, returning: str) -> List[tuple]:
+    with connection.cursor() as cur:
+        cur.execute(f"{sql} RETURNING {returning}", params)
+        return cur.fetchall()
+
+
+def mark_all_seen(me_id: int, peer_id: int, at: Optional[datetime] = None) -> List[Dict]:
+    """
+    peer -> me: everything not yet seen becomes seen. Returns [{id, ts}].
+    With `at`, as of that time: only messages created by then, stamped
+    with it (replaying a receipt later, see chat.ingest).
+    """
+    now = at or timezone.now()
+    ts = now.isoformat()
+    if _can_return():
+        t = Message._meta.db_table
+        dt = connection.ops.adapt_datetimefield_value(now)
+        rows = _update_returning(
+            f"UPDATE {t} SET status = %s, seen_at = %s, is_read = %s, delivered_at = COALESCE(delivered_at, %s) "
+            f"WHERE sender_id = %s AND receiver_id = %s AND status <> %s"
+            + (" AND created_at <= %s" if at else ""),
+            [Message.STATUS_SEEN, dt, True, dt, peer_id, me_id, Message.STATUS_SEEN] + ([dt] if at else []),
+            "id",
+        )
+        ids = [r[0] for r in rows]
+    else:
+        qs = Message.objects.filter(sender_id=peer_id, receiver_id=me_id).exclude(status=Message.STATUS_SEEN)
+        if at:
+            qs = qs.filter(created_at__lte=at)
+        ids = list(qs.select_for_update().values_list("id", flat=True))
+        Message.objects.filter(id__in=ids, delivered_at__isnull=True).update(delivered_at=now)
+        Message.objects.filter(id__in=ids).update(status=Message.STATUS_SEEN, seen_at=now, is_read=True)
+    stamp(ids, me_id, peer_id)
+    return [{"id": i, "ts": ts} for i in sorted(ids)]
+
+
+def deliver_all_pending(receiver_id: int, at: Optional[datetime] = None) -> Tuple[str, Dict[int, List[int]]]:
+    """
+    Every 'sent' message addressed to receiver becomes 'delivered' (as of
+    `at`, like mark_all_seen). Returns (ts, {sender_id: [message ids]}).
+    """
+    now = at or timezone.now()
+    if _can_return():
+        t = Message._meta.db_table
+        dt = connection.ops.adapt_datetimefield_value(now)
+        rows = _update_returning(
+            f"UPDATE {t} SET status = %s, delivered_at = %s WHERE receiver_id = %s AND status = %s"
+            + (" AND created_at <= %s" if at else ""),
+            [Message.STATUS_DELIVERED, dt, receiver_id, Message.STATUS_SENT] + ([dt] if at else []),
+            "id, sender_id",
+        )
+    else:
+        qs = Message.objects.filter(receiver_id=receiver_id, status=Message.STATUS_SENT)
+        if at:
+            qs = qs.filter(created_at__lte=at)
+        rows = list(qs.select_for_update().values_list("id", "sender_id"))
+        Message.objects.filter(id__in=[r[0] for r in rows]).update(status=Message.STATUS_DELIVERED, delivered_at=now)
+    stamp((r[0] for r in rows), receiver_id, *{r[1] for r in rows})
+
+    by_sender: Dict[int, List[int]] = {}
+    for mid, sender_id in rows:
+        by_sender.setdefault(sender_id, []).append(mid)
+    for ids in by_sender.values():
+        ids.sort()
+    return now.isoformat(), by_sender
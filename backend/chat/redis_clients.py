@@ -0,0 +1,87 @@
+# chat/redis_clients.py
+"""
+Process-wide Redis clients shared by presence, ingestion, counters etc.
+
+Each sits on a blocking pool capped at REDIS_POOL_MAX_CONNECTIONS: when all
+connections are busy a command waits (up to REDIS_POOL_TIMEOUT_SEC) instead
+of opening yet another socket. Waits show up as chat_redis_pool_wait_seconds.
+"""
+import asyncio
+import os
+import time
+import weakref
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+from core import metrics
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+
+
+# one send_packed_command per round trip (a pipeline is a single call), so
+# counting here gives round trips, not commands
+class _CountingConnection(redis.Connection):
+    def send_packed_command(self, command, check_health=True):
+        metrics.note_redis_call()
+        return super().send_packed_command(command, check_health)
+
+
+class _AsyncCountingConnection(aioredis.Connection):
+    async def send_packed_command(self, command, check_health=True):
+        metrics.note_redis_call()
+        return await super().send_packed_command(command, check_health)
+
+class _MeteredPool(redis.BlockingConnectionPool):
+    def get_connection(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().get_connection(*args, **kwargs)
+        except redis.ConnectionError:
+            if time.perf_counter() - t0 >= self.timeout:
+                metrics.redis_pool_timeouts_total.inc("sync")
+            raise
+        finally:
+            metrics.redis_pool_wait_seconds.observe(time.perf_counter() - t0, "sync")
+
+
+class _AsyncMeteredPool(aioredis.BlockingConnectionPool):
+    async def get_connection(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return await super().get_connection(*args, **kwargs)
+        except redis.ConnectionError:
+            if time.perf_counter() - t0 >= self.timeout:
+                metrics.redis_pool_timeouts_total.inc("async")
+            raise
+        finally:
+            metrics.redis_pool_wait_seconds.observe(time.perf_counter() - t0, "async")
+
+
+def _pool_kwargs() -> dict:
+    return {"max_connections": settings.REDIS_POOL_MAX_CONNECTIONS, "timeout": settings.REDIS_POOL_TIMEOUT_SEC,
+            "decode_responses": True}
+
+
+_sync_client = None
+# redis.asyncio connections belong to the loop that opened them, so keep one
+# pooled client per running loop (Daphne runs one; tests may run several).
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis() -> redis.Redis:
+    global _sync_client
+    if _sync_client is None:
+        pool = _MeteredPool.from_url(REDIS_URL, connection_class=_CountingConnection, **_pool_kwargs())
+        _sync_client = redis.StrictRedis(connection_pool=pool)
+    return _sync_client
+
+
+def get_aredis() -> aioredis.Redis:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool = _AsyncMeteredPool.from_url(REDIS_URL, connection_class=_AsyncCountingConnection, **_pool_kwargs())
+        client = _async_clients[loop] = aioredis.Redis(connection_pool=pool)
+    return client
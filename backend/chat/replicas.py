@@ -0,0 +1,164 @@
+# chat/replicas.py
+"""
+Read replicas (settings.DATABASE_REPLICAS, aliases in DATABASES).
+
+- Writes, and reads outside a ReplicaReadMixin view, use "default".
+- ReplicaReadMixin views (and async views, via aread_alias_for) read from
+  a random healthy replica, unless the user wrote something in the last
+  CHAT_DB_PIN_SEC seconds: writers call `pin_primary(user ids)` (through
+  chat.versions.touch; it takes effect on commit) and those users read
+  from the primary until the pin expires, so nobody misses their own
+  just-sent message or just-cleared unread badge. Within one request, a
+  write sends the rest of its reads to the primary straight away.
+- A replica whose replay lag is over CHAT_DB_REPLICA_MAX_LAG_SEC (checked
+  at most every CHAT_DB_LAG_CHECK_SEC per process) is skipped; with none
+  left, reads go to the primary.
+
+With no replicas configured all of this is a no-op (no Redis calls).
+"""
+import contextvars
+import logging
+import random
+import time
+from typing import Optional
+
+import redis
+from django.conf import settings
+from django.db import connections, transaction
+
+from core.db import db_sync_to_async
+from .redis_clients import get_aredis, get_redis
+
+log = logging.getLogger(__name__)
+
+KEY_PIN = "dbpin:{}"  # user id -> pinned to the primary while the key lives
+
+# alias reads go to in this context (None: "default")
+_read_alias: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("chat_read_alias", default=None)
+
+_PG_LAG_SQL = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+_lag_checked = {}  # alias -> (monotonic time checked, healthy)
+
+
+def replicas():
+    return settings.DATABASE_REPLICAS
+
+
+def pin_primary(*user_ids: int) -> None:
+    """Send these users' reads to the primary for a while, once the current transaction commits."""
+    if not replicas() or not user_ids:
+        return
+    transaction.on_commit(lambda: _pin(user_ids))
+
+
+def _pin(user_ids) -> None:
+    ttl_ms = int(settings.CHAT_DB_PIN_SEC * 1000)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for uid in set(user_ids):
+            pipe.set(KEY_PIN.format(uid), 1, px=ttl_ms)
+        pipe.execute()
+    except redis.RedisError:
+        log.warning("could not pin users %s to the primary", user_ids, exc_info=True)
+
+
+def is_pinned(user_id: int) -> bool:
+    try:
+        return bool(get_redis().exists(KEY_PIN.format(user_id)))
+    except redis.RedisError:
+        return True  # can't tell: the primary is always safe
+
+
+def _replica_lag(alias: str) -> float:
+    conn = connections[alias]
+    if conn.vendor != "postgresql":
+        return 0.0
+    with conn.cursor() as cur:
+        cur.execute(_PG_LAG_SQL)
+        return float(cur.fetchone()[0])
+
+
+def _healthy(alias: str) -> bool:
+    now = time.monotonic()
+    checked = _lag_checked.get(alias)
+    if checked is not None and now - checked[0] < settings.CHAT_DB_LAG_CHECK_SEC:
+        return checked[1]
+    try:
+        lag = _replica_lag(alias)
+        ok = lag <= settings.CHAT_DB_REPLICA_MAX_LAG_SEC
+        if not ok:
+            log.warning("replica %s is %.1fs behind; reading from the primary", alias, lag)
+    except Exception:
+        log.warning("replica %s lag check failed", alias, exc_info=True)
+        ok = False
+    _lag_checked[alias] = (now, ok)
+    return ok
+
+
+def read_alias_for(user_id: Optional[int]) -> Optional[str]:
+    """Replica alias this user may read from right now (None: the primary)."""
+    if not replicas() or (user_id is not None and is_pinned(user_id)):
+        return None
+    healthy = [alias for alias in replicas() if _healthy(alias)]
+    return random.choice(healthy) if healthy else None
+
+
+async def aread_alias_for(user_id: Optional[int]) -> Optional[str]:
+    """read_alias_for for async views: the pin check uses the async client, lag checks hop to a DB thread."""
+    if not replicas():
+        return None
+    if user_id is not None:
+        try:
+            if await get_aredis().exists(KEY_PIN.format(user_id)):
+                return None
+        except redis.RedisError:
+            return None
+    healthy = []
+    for alias in replicas():
+        checked = _lag_checked.get(alias)
+        if checked is not None and time.monotonic() - checked[0] < settings.CHAT_DB_LAG_CHECK_SEC:
+            ok = checked[1]
+        else:
+            ok = await db_sync_to_async(_healthy)(alias)
+        if ok:
+            healthy.append(alias)
+    return random.choice(healthy) if healthy else None
+
+
+class ReplicaRouter:
+    """DATABASE_ROUTERS entry: replica reads only where ReplicaReadMixin asked for them."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        if _read_alias.get() is not None:
+            _read_alias.set(None)  # read what we just wrote; ReplicaReadMixin resets it
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # replicas hold the same data as the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
+
+
+class ReplicaReadMixin:
+    """
+    APIView mixin for read-only views: the handler's queries go to a replica
+    (see read_alias_for). Authentication and throttling run on the primary.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._read_token = _read_alias.set(read_alias_for(getattr(request.user, "id", None)))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "_read_token", None)
+        if token is not None:
+            _read_alias.reset(token)
+            self._read_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -2,8 +2,10 @@
 from django.urls import path
 from .consumers import ChatConsumer
 from .consumers_inbox import InboxConsumer, PresenceConsumer
+from .consumers_session import SessionConsumer
 
 websocket_urlpatterns = [
+    path("ws/session/", SessionConsumer.as_asgi()),  # everything below over one socket
     path("ws/chat/<str:username>/", ChatConsumer.as_asgi()),
     path("ws/presence/", PresenceConsumer.as_asgi()),
     path("ws/inbox/", InboxConsumer.as_asgi()),
@@ -0,0 +1,226 @@
+# chat/search.py
+"""
+Full-text search over the caller's messages.
+
+- Postgres: `to_tsvector('simple', text) @@ websearch_to_tsquery(...)`,
+  served by the GIN expression index from migration 0009, ranked with
+  ts_rank, snippets from ts_headline.
+- SQLite: the FTS5 table from migration 0009 (triggers keep it in step with
+  chat_message), ranked with bm25, snippets from snippet().
+- Anything else: an icontains scan, newest first.
+
+Results are ordered by (score desc, id desc) and paged with a keyset cursor
+on that pair. Snippets are only computed for the page being returned.
+"""
+import base64
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from django.db import connections, router
+from django.db.models import Q
+from django.utils.html import escape
+
+from .models import Message
+from .pagination import InvalidCursor
+
+MAX_QUERY_LEN = 200
+_MARK_OPEN, _MARK_CLOSE = "\x02", "\x03"  # swapped for <mark> after HTML-escaping
+
+_PG_CFG = "'simple'::regconfig"  # must match the index expression
+
+SearchCursor = Tuple[float, int]  # (score, id)
+
+
+def encode_search_cursor(score: float, pk: int) -> str:
+    return base64.urlsafe_b64encode(f"{score!r}|{pk}".encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(value: str) -> SearchCursor:
+    try:
+        padded = value + "=" * (-len(value) % 4)
+        score, pk = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return float(score), int(pk)
+    except Exception as exc:
+        raise InvalidCursor(value) from exc
+
+
+def _db():
+    """Connection the router reads Message rows from (a replica inside ReplicaReadMixin views)."""
+    return connections[router.db_for_read(Message)]
+
+
+def _highlight(raw: str) -> str:
+    return escape(raw).replace(_MARK_OPEN, "<mark>").replace(_MARK_CLOSE, "</mark>")
+
+
+def _scope(me_id: int, peer_id: Optional[int], since: Optional[datetime], until: Optional[datetime]):
+    """SQL fragment + params limiting matches to my conversations (and the filters)."""
+    if peer_id is not None:
+        sql = ["((m.sender_id = %s AND m.receiver_id = %s) OR (m.sender_id = %s AND m.receiver_id = %s))"]
+        params = [me_id, peer_id, peer_id, me_id]
+    else:
+        sql = ["(m.sender_id = %s OR m.receiver_id = %s)"]
+        params = [me_id, me_id]
+    if since is not None:
+        sql.append("m.created_at >= %s")
+        params.append(_db().ops.adapt_datetimefield_value(since))
+    if until is not None:
+        sql.append("m.created_at < %s")
+        params.append(_db().ops.adapt_datetimefield_value(until))
+    return " AND ".join(sql), params
+
+
+def _after(cursor: Optional[SearchCursor]):
+    if cursor is None:
+        return "1 = 1", []
+    score, pk = cursor
+    # the plain bound first, so earlier hits are cut before the tie-break OR
+    return "score <= %s AND (score < %s OR (score = %s AND id < %s))", [score, score, score, pk]
+
+
+def _fetch(sql: str, params) -> List[tuple]:
+    with _db().cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+
+# ---------- postgres ----------
+
+def _pg_page(q, scope, scope_params, cursor, limit):
+    after, after_params = _after(cursor)
+    return _fetch(
+        f"SELECT id, score FROM ("
+        f" SELECT m.id, ts_rank(to_tsvector({_PG_CFG}, m.text), query)::float8 AS score"
+        f" FROM chat_message m, websearch_to_tsquery({_PG_CFG}, %s) query"
+        f" WHERE to_tsvector({_PG_CFG}, m.text) @@ query AND {scope}"
+        f") s WHERE {after} ORDER BY score DESC, id DESC LIMIT %s",
+        [q, *scope_params, *after_params, limit],
+    )
+
+
+def _pg_snippets(q, ids) -> Dict[int, str]:
+    opts = f"StartSel={_MARK_OPEN}, StopSel={_MARK_CLOSE}, MaxWords=20, MinWords=6, MaxFragments=2"
+    rows = _fetch(
+        f"SELECT m.id, ts_headline({_PG_CFG}, m.text, websearch_to_tsquery({_PG_CFG}, %s), %s)"
+        f" FROM chat_message m WHERE m.id = ANY(%s)",
+        [q, opts, list(ids)],
+    )
+    return dict(rows)
+
+
+# ---------- sqlite ----------
+
+_has_fts = None
+
+
+def _sqlite_fts() -> bool:
+    global _has_fts
+    if _has_fts is None:
+        _has_fts = bool(_fetch("SELECT 1 FROM sqlite_master WHERE name = 'chat_message_fts'", []))
+    return _has_fts
+
+
+def _fts_query(q: str) -> str:
+    """Words ANDed, each quoted (no FTS syntax from users), last one as a prefix."""
+    words = [w.replace('"', '""') for w in q.split()]
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _sqlite_page(q, scope, scope_params, cursor, limit):
+    after, after_params = _after(cursor)
+    return _fetch(
+        f"SELECT id, score FROM ("
+        f" SELECT m.id AS id, -bm25(chat_message_fts) AS score"
+        f" FROM chat_message_fts JOIN chat_message m ON m.id = chat_message_fts.rowid"
+        f" WHERE chat_message_fts MATCH %s AND {scope}"
+        f") WHERE {after} ORDER BY score DESC, id DESC LIMIT %s",
+        [_fts_query(q), *scope_params, *after_params, limit],
+    )
+
+
+def _sqlite_snippets(q, ids) -> Dict[int, str]:
+    ids = list(ids)
+    marks = ", ".join(["%s"] * len(ids))
+    rows = _fetch(
+        f"SELECT rowid, snippet(chat_message_fts, 0, %s, %s, '…', 16) FROM chat_message_fts"
+        f" WHERE chat_message_fts MATCH %s AND rowid IN ({marks})",
+        [_MARK_OPEN, _MARK_CLOSE, _fts_query(q), *ids],
+    )
+    return dict(rows)
+
+
+# ---------- fallback ----------
+
+def _scan_page(q, me_id, peer_id, since, until, cursor, limit):
+    qs = Message.objects.filter(text__icontains=q)
+    if peer_id is not None:
+        qs = qs.filter(Q(sender_id=me_id, receiver_id=peer_id) | Q(sender_id=peer_id, receiver_id=me_id))
+    else:
+        qs = qs.filter(Q(sender_id=me_id) | Q(receiver_id=me_id))
+    if since is not None:
+        qs = qs.filter(created_at__gte=since)
+    if until is not None:
+        qs = qs.filter(created_at__lt=until)
+    if cursor is not None:
+        qs = qs.filter(id__lt=cursor[1])
+    return [(pk, 0.0) for pk in qs.order_by("-id").values_list("id", flat=True)[:limit]]
+
+
+def _scan_snippet(text: str, q: str, width: int = 60) -> str:
+    i = text.lower().find(q.lower())
+    if i < 0:
+        return text[:width * 2]
+    start = max(0, i - width)
+    return (
+        ("…" if start else "") + text[start:i] + _MARK_OPEN + text[i:i + len(q)] + _MARK_CLOSE
+        + text[i + len(q):i + len(q) + width] + ("…" if i + len(q) + width < len(text) else "")
+    )
+
+
+# ---------- entry point ----------
+
+def search_messages(me_id: int, q: str, *, peer_id: Optional[int] = None, since: Optional[datetime] = None,
+                    until: Optional[datetime] = None, cursor: Optional[SearchCursor] = None,
+                    page_size: int = 20) -> dict:
+    """
+    Returns {"results": [(Message, score, snippet_html)], "next": cursor | None}.
+    Snippets are HTML-escaped with matches wrapped in <mark>.
+    """
+    q = re.sub(r"\s+", " ", q).strip()[:MAX_QUERY_LEN]
+    if not q:
+        return {"results": [], "next": None}
+
+    limit = page_size + 1
+    snippets: Dict[int, str] = {}
+    if _db().vendor == "postgresql":
+        scope, params = _scope(me_id, peer_id, since, until)
+        rows = _pg_page(q, scope, params, cursor, limit)
+        page = rows[:page_size]
+        if page:
+            snippets = _pg_snippets(q, [r[0] for r in page])
+    elif _db().vendor == "sqlite" and _sqlite_fts():
+        scope, params = _scope(me_id, peer_id, since, until)
+        rows = _sqlite_page(q, scope, params, cursor, limit)
+        page = rows[:page_size]
+        if page:
+            snippets = _sqlite_snippets(q, [r[0] for r in page])
+    else:
+        rows = _scan_page(q, me_id, peer_id, since, until, cursor, limit)
+        page = rows[:page_size]
+
+    msgs = Message.objects.select_related("sender", "receiver").in_bulk([r[0] for r in page])
+    results = []
+    for pk, score in page:
+        m = msgs.get(pk)
+        if m is None:
+            continue
+        raw = snippets.get(pk) or _scan_snippet(m.text, q)
+        results.append((m, score, _highlight(raw)))
+    nxt = None
+    if len(rows) > page_size:
+        last_pk, last_score = page[-1]
+        nxt = encode_search_cursor(last_score, last_pk)
+    return {"results": results, "next": nxt}
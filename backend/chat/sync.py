@@ -0,0 +1,137 @@
+# chat/sync.py
+"""
+Delta sync for reconnecting clients.
+
+Every write that changes a Message (create, delivered, seen) stamps it with
+a version, so "what changed since X" is a keyset walk over (version, id) on
+the (sender, version, id) / (receiver, version, id) indexes: the cost follows
+the number of changes, not the history size.
+
+Versions come from per-user clocks (UserClock). `next_version(*user_ids)`
+locks the clocks of every user the write touches (in user id order, so two
+writers can't deadlock), takes one more than the highest of them and moves
+them all there. The rows stay locked until the writer commits, so each
+user's versions become visible in commit order and a reader can never skip
+past a change that commits later. Writes that share no user don't wait on
+each other. Writers take it as late as possible (after the UPDATE that found
+rows to change) to keep the locks short; batched writers take one version
+per batch.
+"""
+import base64
+import heapq
+from typing import Iterable, Optional, Tuple
+
+from django.db.models import Q
+
+from .models import Message, ThreadParticipant, UserClock
+from .threads import participant_summary
+
+DEFAULT_SYNC_LIMIT = 200
+MAX_SYNC_LIMIT = 1000
+
+_END = 2 ** 63 - 1  # id component of a cursor that means "after every row at this version"
+
+SyncCursor = Tuple[int, int]  # (version, id)
+
+
+class InvalidSyncCursor(ValueError):
+    pass
+
+
+def encode_sync_cursor(version: int, pk: int) -> str:
+    return base64.urlsafe_b64encode(f"{version}.{pk}".encode()).decode().rstrip("=")
+
+
+def decode_sync_cursor(value: str) -> SyncCursor:
+    try:
+        padded = value + "=" * (-len(value) % 4)
+        version, pk = base64.urlsafe_b64decode(padded.encode()).decode().split(".", 1)
+        return int(version), int(pk)
+    except Exception as exc:
+        raise InvalidSyncCursor(value) from exc
+
+
+def parse_sync_limit(value: Optional[str]) -> int:
+    try:
+        size = int(value) if value else DEFAULT_SYNC_LIMIT
+    except (TypeError, ValueError):
+        size = DEFAULT_SYNC_LIMIT
+    return max(1, min(size, MAX_SYNC_LIMIT))
+
+
+# ---------- write side ----------
+
+def next_version(*user_ids: int) -> int:
+    """
+    Allocate a version for a change seen by `user_ids`; call inside the
+    transaction whose changes it stamps.
+    """
+    users = sorted(set(user_ids))
+    clocks = UserClock.objects.select_for_update().filter(user_id__in=users).order_by("user_id")
+    values = list(clocks.values_list("value", flat=True))
+    if len(values) < len(users):  # first change for some of them
+        UserClock.objects.bulk_create([UserClock(user_id=u) for u in users], ignore_conflicts=True)
+        values = list(clocks.values_list("value", flat=True))
+    version = max(values) + 1
+    UserClock.objects.filter(user_id__in=users).update(value=version)
+    return version
+
+
+def stamp(ids: Iterable[int], *user_ids: int) -> Optional[int]:
+    """
+    Give already-changed rows a fresh version; `user_ids` are everyone they
+    belong to (no-op, and no clock lock, when `ids` is empty).
+    """
+    ids = list(ids)
+    if not ids:
+        return None
+    version = next_version(*user_ids)
+    Message.objects.filter(id__in=ids).update(version=version)
+    return version
+
+
+def head_cursor(me_id: int) -> str:
+    """Cursor for "now": a client that has just loaded everything starts from here."""
+    version = UserClock.objects.filter(user_id=me_id).values_list("value", flat=True).first() or 0
+    return encode_sync_cursor(version, _END)
+
+
+# ---------- read side ----------
+
+def _side(field: str, me_id: int, since: SyncCursor, limit: int):
+    version, pk = since
+    return list(
+        Message.objects.select_related("sender", "receiver")
+        .filter(**{field: me_id}, version__gte=version)  # range start for the index; the OR only breaks ties
+        .filter(Q(version__gt=version) | Q(version=version, id__gt=pk))
+        .order_by("version", "id")[:limit]
+    )
+
+
+def changes_since(me_id: int, since: SyncCursor, limit: int = DEFAULT_SYNC_LIMIT) -> dict:
+    """
+    Messages to or from me_id created or re-stamped after `since`, oldest
+    change first, at most `limit` of them. Returns
+    {"messages": [Message], "threads": [summary dict], "cursor": str, "has_more": bool};
+    `threads` are the current summaries of the conversations those messages
+    belong to. Feed `cursor` back as `since` until has_more is false.
+    """
+    key = lambda m: (m.version, m.id)
+    rows = list(heapq.merge(
+        _side("sender_id", me_id, since, limit + 1),
+        _side("receiver_id", me_id, since, limit + 1),
+        key=key,
+    ))[:limit + 1]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    cursor = encode_sync_cursor(*key(rows[-1])) if rows else encode_sync_cursor(*since)
+
+    peers = {m.receiver_id if m.sender_id == me_id else m.sender_id for m in rows}
+    threads = []
+    if peers:
+        for p in ThreadParticipant.objects.filter(user_id=me_id, peer_id__in=peers).select_related(
+            "peer", "thread__last_message__sender", "thread__last_message__receiver"
+        ):
+            threads.append(participant_summary(p, me_id, p.peer))
+    return {"messages": rows, "threads": threads, "cursor": cursor, "has_more": has_more}
@@ -0,0 +1,39 @@
+from celery import shared_task
+from django.contrib.auth.models import User
+
+from . import export, ingest
+from .replicas import read_alias_for
+from .threads import reconcile_unread
+
+
+@shared_task(ignore_result=True)
+def drain_message_stream():
+    """Persist write-behind messages (see chat.ingest); scheduled by celery beat."""
+    return ingest.drain()
+
+
+@shared_task(ignore_result=True)
+def reconcile_unread_counts():
+    """Repair drifted ThreadParticipant.unread_count values; scheduled by celery beat."""
+    return reconcile_unread()
+
+
+@shared_task(ignore_result=True)
+def export_conversation(export_id):
+    """Write the queued export `export_id` (see chat.export) and mark its record ready or failed."""
+    record = export.get_record(export_id)
+    if record is None:
+        return  # expired before a worker got to it
+    try:
+        me, other = User.objects.get(id=record["owner"]), User.objects.get(id=record["peer"])
+        count = export.write_export(me, other, record["format"], record["file"], using=read_alias_for(me.id))
+    except Exception:
+        export.update_record(record, status=export.STATUS_FAILED)
+        raise
+    export.update_record(record, status=export.STATUS_READY, messages=count)
+
+
+@shared_task(ignore_result=True)
+def expire_exports():
+    """Delete export files past CHAT_EXPORT_TTL_SEC; scheduled by celery beat."""
+    return export.expire_files()
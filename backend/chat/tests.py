@@ -1,3 +1,722 @@
-from django.test import TestCase
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from importlib.util import find_spec
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import redis
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.usercache import user_cache
+from core import metrics
+from . import ingest, presence, ratelimit, receipts, redis_clients, replicas, wire
+from .consumers import ChatRoom
+from .consumers_inbox import _deliver_all_pending
+from .encoders import message_dict, msgpack
+from .fanout import room_group
+from .models import Message, ThreadParticipant, UserClock
+from .pagination import (
+    MAX_PAGE_SIZE, InvalidCursor, aconversation_page, decode_cursor, encode_cursor, parse_page_size,
+)
+from .receipts import deliver_all_pending, mark_all_seen
+from .sync import changes_since, decode_sync_cursor, head_cursor, next_version
+from .threads import record_message, record_seen
+from .versions import touch
+
+try:
+    import fakeredis
+except ImportError:  # optional: the tests that need Redis are skipped without it
+    fakeredis = None
+
+
+def make_messages(a, b, n, start=None, step=timedelta(seconds=1)):
+    """n messages alternating a -> b / b -> a, `step` apart, oldest first."""
+    start = start or timezone.now() - timedelta(days=1)
+    return [
+        Message.objects.create(sender=a if i % 2 else b, receiver=b if i % 2 else a, text=f"m{i}",
+                               created_at=start + step * i)
+        for i in range(n)
+    ]
+
+
+class UsersMixin:
+    def setUp(self):
+        user_cache.clear()  # ids are reused after each test's rollback
+        self.a = User.objects.create(username="alice")
+        self.b = User.objects.create(username="bob")
+        self.c = User.objects.create(username="carol")
+
+    def auth(self, user):
+        return {"Authorization": f"Bearer {AccessToken.for_user(user)}"}
+
+
+class _FakeAsyncClients:
+    """Stands in for redis_clients._async_clients: a fakeredis client on the shared server for any loop."""
+
+    def __init__(self, server):
+        self.server = server
+
+    def get(self, loop):
+        return fakeredis.FakeAsyncRedis(server=self.server, decode_responses=True)
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class FakeRedisMixin:
+    """Points chat.redis_clients at a fresh in-memory Redis for each test."""
+
+    def setUp(self):
+        super().setUp()
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeStrictRedis(server=server, decode_responses=True)
+        for patcher in (
+            mock.patch.multiple(redis_clients, _sync_client=self.redis, _async_clients=_FakeAsyncClients(server)),
+            mock.patch.multiple(ratelimit, _sync_script=None, _async_script=None),  # registered on the previous client
+            mock.patch.object(presence, "_r", self.redis),  # bound at import
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class ChatTestCase(UsersMixin, TestCase):
+    pass
+
+
+class ChatViewTestCase(UsersMixin, TransactionTestCase):
+    """For the async views: they query from the DB thread pool (core.db), outside the test's transaction."""
+
+
+class CursorTests(TestCase):
+    def test_round_trip(self):
+        at = datetime(2025, 1, 2, 3, 4, 5, 678901, tzinfo=dt_timezone.utc)
+        self.assertEqual(decode_cursor(encode_cursor(at, 42)), (at, 42))
+
+    def test_invalid(self):
+        for value in ["!!", "bm90IGEgY3Vyc29y", encode_cursor(timezone.now(), 1).swapcase()]:
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(value)
+
+    def test_page_size_is_clamped(self):
+        self.assertEqual(parse_page_size("10"), 10)
+        self.assertEqual(parse_page_size("0"), 1)
+        self.assertEqual(parse_page_size(str(MAX_PAGE_SIZE + 1)), MAX_PAGE_SIZE)
+        self.assertEqual(parse_page_size("x"), parse_page_size(None))
+
+
+class ConversationPageTests(ChatTestCase):
+    def page(self, **kwargs):
+        return async_to_sync(aconversation_page)(self.a.id, self.b.id, **kwargs)
+
+    def test_walk_back_and_forth(self):
+        msgs = make_messages(self.a, self.b, 7)
+        # same timestamp as its neighbour: (created_at, id) still orders them
+        Message.objects.filter(id=msgs[3].id).update(created_at=msgs[2].created_at)
+        make_messages(self.a, self.c, 3)
+        ids = [m.id for m in msgs]
+
+        newest = self.page(page_size=3)
+        self.assertEqual([m.id for m in newest["results"]], ids[-3:])
+        self.assertIsNone(newest["after"])
+
+        seen, page = [], newest
+        while True:
+            seen[:0] = [m.id for m in page["results"]]
+            if page["before"] is None:
+                break
+            page = self.page(page_size=3, before=decode_cursor(page["before"]))
+        self.assertEqual(seen, ids)
+        self.assertEqual(len(page["results"]), 1)  # 7 = 3 + 3 + 1
+
+        seen = [m.id for m in page["results"]]
+        while page["after"] is not None:
+            page = self.page(page_size=3, after=decode_cursor(page["after"]))
+            seen += [m.id for m in page["results"]]
+        self.assertEqual(seen, ids)
+
+    def test_exact_multiple_has_no_extra_page(self):
+        make_messages(self.a, self.b, 4)
+        first = self.page(page_size=2)
+        second = self.page(page_size=2, before=decode_cursor(first["before"]))
+        self.assertEqual(len(second["results"]), 2)
+        self.assertIsNone(second["before"])
+        self.assertIsNotNone(second["after"])
+
+    def test_empty(self):
+        self.assertEqual(self.page(), {"results": [], "before": None, "after": None})
+
+
+@override_settings(CHAT_RATE_LIMIT_ENABLED=False)
+class ConversationViewTests(ChatViewTestCase):
+    async def test_before_and_after_together_is_rejected(self):
+        cursor = encode_cursor(timezone.now(), 1)
+        response = await AsyncClient().get(f"/api/chat/history/{self.b.username}/",
+                                           {"before": cursor, "after": cursor}, headers=self.auth(self.a))
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(find_spec("lupa"), "fakeredis needs lupa to run Lua scripts")
+@override_settings(CHAT_RATE_LIMIT_ENABLED=True, CHAT_RATE_LIMITS={"rest": (100, 3)}, CHAT_RATE_LIMIT_OVERRIDES={})
+class TokenBucketTests(FakeRedisMixin, ChatTestCase):
+    def test_burst_then_refill(self):
+        self.assertEqual([ratelimit.allow(self.a, "rest")[0] for _ in range(3)], [True] * 3)
+        ok, wait = ratelimit.allow(self.a, "rest")
+        self.assertFalse(ok)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.01)  # one token at 100/s
+        time.sleep(wait + 0.02)
+        self.assertTrue(ratelimit.allow(self.a, "rest")[0])
+
+    def test_buckets_are_per_user_and_per_bucket(self):
+        for _ in range(3):
+            ratelimit.allow(self.a, "rest")
+        self.assertFalse(ratelimit.allow(self.a, "rest")[0])
+        self.assertTrue(ratelimit.allow(self.b, "rest")[0])
+        self.assertTrue(ratelimit.allow(self.a, "unlimited")[0])
+
+    def test_cost(self):
+        self.assertTrue(ratelimit.allow(self.a, "rest", cost=3)[0])
+        self.assertFalse(ratelimit.allow(self.a, "rest")[0])
+        self.assertFalse(ratelimit.allow(self.b, "rest", cost=4)[0])  # more than the burst never fits
+
+    def test_sync_and_async_share_the_bucket(self):
+        ratelimit.allow(self.a, "rest", cost=2)
+        self.assertTrue(async_to_sync(ratelimit.aallow)(self.a, "rest")[0])
+        self.assertFalse(async_to_sync(ratelimit.aallow)(self.a, "rest")[0])
+
+    def test_async_script_is_registered_once(self):
+        async_to_sync(ratelimit.aallow)(self.a, "rest")
+        script = ratelimit._async_script
+        self.assertIsNotNone(script)
+        self.assertFalse(async_to_sync(ratelimit.aallow)(self.a, "rest", cost=3)[0])  # on another loop's client
+        self.assertIs(ratelimit._async_script, script)
+
+    def test_per_user_override(self):
+        with self.settings(CHAT_RATE_LIMIT_OVERRIDES={self.a.username: {"rest": (100, 5)}}):
+            self.assertEqual(sum(ratelimit.allow(self.a, "rest")[0] for _ in range(6)), 5)
+
+    def test_bucket_expires_once_full(self):
+        ratelimit.allow(self.a, "rest")
+        ttl = self.redis.pttl(ratelimit.KEY_BUCKET.format("rest", self.a.id))
+        self.assertGreater(ttl, 0)
+        self.assertLessEqual(ttl, 3 * 1000 // 100 + 1000)
+
+    @override_settings(CHAT_RATE_LIMIT_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual([ratelimit.allow(self.a, "rest")[0] for _ in range(10)], [True] * 10)
+        self.assertEqual(self.redis.keys("ratelimit:*"), [])
+
+    def test_fails_open_without_redis(self):
+        with mock.patch.object(ratelimit, "_sync_script", side_effect=redis.ConnectionError("down")), \
+                self.assertLogs("chat.ratelimit", "WARNING"):
+            self.assertEqual(ratelimit.allow(self.a, "rest"), (True, 0.0))
+
+
+class SyncTests(ChatTestCase):
+    def send(self, sender, receiver, text="hi"):
+        with transaction.atomic():
+            m = Message.objects.create(sender=sender, receiver=receiver, text=text,
+                                       version=next_version(sender.id, receiver.id))
+            record_message(m)
+        return m
+
+    def changes(self, user, cursor, limit=100):
+        page = changes_since(user.id, decode_sync_cursor(cursor), limit)
+        return page, [(m.id, m.status) for m in page["messages"]]
+
+    def test_new_messages_and_receipts_since_cursor(self):
+        before = self.send(self.b, self.a)
+        cursor = head_cursor(self.a.id)
+        m1 = self.send(self.b, self.a)
+        m2 = self.send(self.a, self.b)
+        self.send(self.b, self.c)  # not mine
+
+        page, changes = self.changes(self.a, cursor)
+        self.assertEqual(changes, [(m1.id, "sent"), (m2.id, "sent")])
+        self.assertFalse(page["has_more"])
+        self.assertEqual({t["user"]["username"] for t in page["threads"]}, {"bob"})
+        cursor = page["cursor"]
+
+        with transaction.atomic():
+            mark_all_seen(self.a.id, self.b.id)
+        page, changes = self.changes(self.a, cursor)
+        self.assertEqual(changes, [(before.id, "seen"), (m1.id, "seen")])  # re-stamped, oldest first
+
+        cursor = page["cursor"]
+        page, changes = self.changes(self.a, cursor)
+        self.assertEqual(changes, [])
+        self.assertEqual(page["cursor"], cursor)
+
+    def test_limit_pages_without_gaps_or_repeats(self):
+        cursor = head_cursor(self.a.id)
+        sent = [self.send(self.b, self.a, f"m{i}").id for i in range(3)]
+        with transaction.atomic():
+            # one version for several rows: the id part of the cursor splits them
+            deliver_all_pending(self.a.id)
+        sent += [self.send(self.c, self.a).id]
+
+        seen = []
+        while True:
+            page, changes = self.changes(self.a, cursor, limit=2)
+            seen += [mid for mid, _ in changes]
+            cursor = page["cursor"]
+            if not page["has_more"]:
+                break
+        self.assertEqual(seen, sent)
+
+    def test_clocks_are_per_user(self):
+        self.send(self.a, self.b)
+        a_head = head_cursor(self.a.id)
+        m = self.send(self.b, self.c)
+        self.assertEqual(head_cursor(self.a.id), a_head)  # a write between b and c leaves a's clock alone
+        clocks = dict(UserClock.objects.values_list("user_id", "value"))
+        self.assertEqual(clocks[self.b.id], m.version)
+        self.assertEqual(clocks[self.c.id], m.version)
+        self.assertGreater(m.version, clocks[self.a.id])  # above every clock it touched, b's included
+
+    @override_settings(CHAT_RATE_LIMIT_ENABLED=False)
+    def test_view(self):
+        client = APIClient()
+        client.force_authenticate(self.a)
+        cursor = client.get("/api/chat/sync/").json()["cursor"]
+        m = self.send(self.b, self.a)
+        data = client.get("/api/chat/sync/", {"since": cursor}).json()
+        self.assertEqual([msg["id"] for msg in data["messages"]], [m.id])
+        self.assertEqual(client.get("/api/chat/sync/", {"since": "!"}).status_code, 400)
+
+
+@override_settings(CHAT_RATE_LIMIT_ENABLED=False, METRICS_TOKEN="", METRICS_REQUIRE_TOKEN=False)
+class MetricsTests(ChatTestCase):
+    def scrape(self, **headers):
+        return self.client.get("/metrics", headers=headers)
+
+    def test_request_is_counted(self):
+        key = ("SyncView", "GET", 200)
+        before = metrics.http_view_seconds._values.get(key, [None, 0, 0])[2]
+        client = APIClient()
+        client.force_authenticate(self.a)
+        client.get("/api/chat/sync/")
+        self.assertEqual(metrics.http_view_seconds._values[key][2], before + 1)
+
+        body = self.scrape().content.decode()
+        self.assertIn(f'chat_http_view_seconds_count{{view="SyncView",method="GET",status="200"}} {before + 1}\n', body)
+
+    def test_token(self):
+        self.assertEqual(self.scrape().status_code, 200)
+        with self.settings(METRICS_TOKEN="s3cret"):
+            self.assertEqual(self.scrape().status_code, 403)
+            self.assertEqual(self.scrape(Authorization="Bearer wrong").status_code, 403)
+            self.assertEqual(self.scrape(Authorization="Bearer s3cret").status_code, 200)
+
+    def test_required_token_missing(self):
+        with self.settings(METRICS_REQUIRE_TOKEN=True):
+            self.assertEqual(self.scrape().status_code, 403)
+            self.assertEqual(self.scrape(Authorization="Bearer ").status_code, 403)
+            with self.settings(METRICS_TOKEN="s3cret"):
+                self.assertEqual(self.scrape(Authorization="Bearer s3cret").status_code, 200)
+
+
+class ReceiptTests(FakeRedisMixin, ChatViewTestCase):
+    """Each helper runs on UPDATE ... RETURNING and on the select-then-update fallback."""
+
+    def paths(self):
+        for returning in (True, False):
+            if returning and not receipts._can_return():
+                continue
+            with self.subTest(returning=returning), mock.patch.object(receipts, "_can_return", lambda: returning):
+                Message.objects.all().delete()
+                yield
+
+    def send(self, sender, receiver, status=Message.STATUS_SENT, **fields):
+        with transaction.atomic():
+            m = Message.objects.create(sender=sender, receiver=receiver, text="hi", status=status,
+                                       version=next_version(sender.id, receiver.id), **fields)
+            record_message(m)
+        return m
+
+    def test_seen_returns_only_changed_rows(self):
+        for _ in self.paths():
+            before = timezone.now() - timedelta(hours=1)
+            sent = self.send(self.b, self.a)
+            delivered = self.send(self.b, self.a, Message.STATUS_DELIVERED, delivered_at=before)
+            seen = self.send(self.b, self.a, Message.STATUS_SEEN, delivered_at=before, seen_at=before, is_read=True)
+            other = self.send(self.a, self.b)  # the other direction
+            versions = dict(Message.objects.values_list("id", "version"))
+
+            changed = mark_all_seen(self.a.id, self.b.id)
+            self.assertEqual([i["id"] for i in changed], [sent.id, delivered.id])
+            rows = {m.id: m for m in Message.objects.all()}
+            self.assertEqual(rows[delivered.id].delivered_at, before)  # kept
+            self.assertEqual(rows[sent.id].delivered_at, rows[sent.id].seen_at)
+            self.assertTrue(rows[sent.id].is_read)
+            self.assertEqual({i for i, m in rows.items() if m.version != versions[i]}, {sent.id, delivered.id})
+            self.assertEqual(rows[other.id].status, Message.STATUS_SENT)
+
+            head = head_cursor(self.a.id)
+            self.assertEqual(mark_all_seen(self.a.id, self.b.id), [])
+            self.assertEqual(head_cursor(self.a.id), head)  # a no-op takes no version
+            self.assertEqual(rows[seen.id].seen_at, before)
+
+    def test_delivered_returns_only_changed_rows(self):
+        for _ in self.paths():
+            from_b = [self.send(self.b, self.a).id for _ in range(2)]
+            from_c = self.send(self.c, self.a).id
+            self.send(self.b, self.a, Message.STATUS_DELIVERED, delivered_at=timezone.now())
+            self.send(self.a, self.b)
+
+            ts, by_sender = deliver_all_pending(self.a.id)
+            self.assertEqual(by_sender, {self.b.id: from_b, self.c.id: [from_c]})
+            self.assertEqual(set(Message.objects.filter(id__in=from_b + [from_c]).values_list("status", flat=True)),
+                             {Message.STATUS_DELIVERED})
+
+            head = head_cursor(self.a.id)
+            self.assertEqual(deliver_all_pending(self.a.id)[1], {})
+            self.assertEqual(head_cursor(self.a.id), head)
+
+    def test_consumers_broadcast_only_changes(self):
+        pending = [self.send(self.b, self.a).id for _ in range(2)]
+        delivered = self.send(self.b, self.a, Message.STATUS_DELIVERED, delivered_at=timezone.now()).id
+
+        items = async_to_sync(_deliver_all_pending)(self.a.id)
+        self.assertEqual([(name, ids) for name, ids, _ in items], [("bob", pending)])
+        self.assertEqual(async_to_sync(_deliver_all_pending)(self.a.id), [])
+
+        room = SimpleNamespace(me=self.a)
+        self.assertEqual(ThreadParticipant.objects.get(user=self.a, peer=self.b).unread_count, 3)
+        seen = async_to_sync(ChatRoom._mark_all_seen)(room, "alice", "bob")
+        self.assertEqual([i["id"] for i in seen], pending + [delivered])
+        self.assertEqual(async_to_sync(ChatRoom._mark_all_seen)(room, "alice", "bob"), [])
+        self.assertEqual(ThreadParticipant.objects.get(user=self.a, peer=self.b).unread_count, 0)
+
+
+class _AliasView(replicas.ReplicaReadMixin, APIView):
+    """Reports where its reads go: before and after a write, when ?write= is passed."""
+
+    def get(self, request):
+        before = Message.objects.all().db
+        if request.GET.get("write"):
+            Message.objects.filter(id=0).update(text="")
+        return Response({"before": before, "after": Message.objects.all().db})
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class ReplicaRoutingTests(FakeRedisMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+            mock.patch.object(replicas, "_replica_lag", return_value=0.0),  # no replica connection in tests
+            mock.patch.object(replicas, "_lag_checked", {}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def read(self, user, write=False):
+        request = APIRequestFactory().get("/", {"write": 1} if write else {})
+        force_authenticate(request, user)
+        return _AliasView.as_view()(request).data
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.read(self.a), {"before": "replica1", "after": "replica1"})
+        self.assertEqual(Message.objects.all().db, "default")  # outside the view
+        self.assertEqual(async_to_sync(replicas.aread_alias_for)(self.a.id), "replica1")
+
+    def test_write_in_the_same_request_pins_later_reads(self):
+        self.assertEqual(self.read(self.a, write=True), {"before": "replica1", "after": "default"})
+        self.assertEqual(Message.objects.all().db, "default")
+        self.assertEqual(self.read(self.a)["before"], "replica1")  # pins only that request
+
+    def test_writer_reads_from_the_primary_until_the_pin_expires(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            touch((self.a.id, self.b.id))
+        self.assertEqual(self.read(self.a)["before"], "default")
+        self.assertEqual(self.read(self.b)["before"], "default")
+        self.assertEqual(self.read(self.c)["before"], "replica1")
+        self.assertIsNone(async_to_sync(replicas.aread_alias_for)(self.a.id))
+        self.assertEqual(async_to_sync(replicas.aread_alias_for)(self.c.id), "replica1")
+        ttl = self.redis.pttl(replicas.KEY_PIN.format(self.a.id))
+        self.assertGreater(ttl, 0)
+        self.assertLessEqual(ttl, 5000)
+
+    def test_no_pin_before_commit(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            touch((self.a.id, self.b.id))  # rolled back
+        self.assertEqual(self.read(self.a)["before"], "replica1")
+
+    def test_lagging_replica_is_skipped(self):
+        replicas._replica_lag.return_value = 60.0
+        with self.assertLogs("chat.replicas", "WARNING"):
+            self.assertEqual(self.read(self.a)["before"], "default")
+
+    def test_primary_when_redis_is_down(self):
+        with mock.patch.object(self.redis, "exists", side_effect=redis.ConnectionError("down")):
+            self.assertEqual(self.read(self.a)["before"], "default")
+
+
+@override_settings(CHAT_RATE_LIMIT_ENABLED=False)
+class PresenceTests(FakeRedisMixin, ChatTestCase):
+    def test_online_and_offline(self):
+        presence.set_online("alice")
+        got = presence.get_presence_many(["alice", "bob", "alice"])
+        self.assertEqual(list(got), ["alice", "bob"])
+        self.assertTrue(got["alice"]["online"])
+        self.assertIsNotNone(got["alice"]["last_seen"])
+        self.assertEqual(got["bob"], {"online": False, "last_seen": None, "ttl": presence.PRESENCE_TTL_SEC})
+
+        presence.clear_online("alice")
+        gone = presence.get_presence("alice")
+        self.assertFalse(gone["online"])
+        self.assertGreaterEqual(gone["last_seen"], got["alice"]["last_seen"])
+        self.assertEqual(presence.get_presence_many([]), {})
+
+    def test_ttl_expiry(self):
+        key = presence.KEY_ONLINE.format("alice")
+        presence.set_online("alice")
+        self.assertGreater(self.redis.ttl(key), presence.PRESENCE_TTL_SEC - 5)
+
+        self.redis.pexpire(key, 1000)
+        presence.refresh_online("alice")  # a heartbeat extends it
+        self.assertGreater(self.redis.ttl(key), presence.PRESENCE_TTL_SEC - 5)
+
+        self.redis.pexpire(key, 1)  # no heartbeat: the key runs out
+        time.sleep(0.01)
+        self.assertFalse(presence.is_online("alice"))
+        self.assertIsNotNone(presence.get_presence("alice")["last_seen"])  # last seen outlives it
+
+    def test_one_round_trip(self):
+        presence.set_online("bob")
+        with mock.patch.object(self.redis, "pipeline", wraps=self.redis.pipeline) as pipeline:
+            got = presence.get_presence_many(["alice", "bob", "carol"])
+        pipeline.assert_called_once_with(transaction=False)
+        self.assertEqual({u: p["online"] for u, p in got.items()}, {"alice": False, "bob": True, "carol": False})
+
+    def test_async_api_shares_the_keys(self):
+        async_to_sync(presence.aset_online)("carol")
+        self.assertTrue(presence.is_online("carol"))
+        self.assertTrue(async_to_sync(presence.ais_online)("carol"))
+        self.assertEqual(async_to_sync(presence.aget_presence_many)(["carol", "bob"]),
+                         presence.get_presence_many(["carol", "bob"]))
+
+    def test_bulk_view(self):
+        presence.set_online("alice")
+        client = APIClient()
+        self.assertIn(client.get("/api/chat/presence/", {"usernames": "alice"}).status_code, (401, 403))
+
+        client.force_authenticate(self.b)
+        data = client.get("/api/chat/presence/", {"usernames": "alice, bob,,alice"}).json()
+        self.assertEqual({u: p["online"] for u, p in data.items()}, {"alice": True, "bob": False})
+        self.assertEqual(client.get("/api/chat/presence/").json(), {})
+        too_many = ",".join(f"u{i}" for i in range(501))
+        self.assertEqual(client.get("/api/chat/presence/", {"usernames": too_many}).status_code, 400)
+
+
+@skipUnless(msgpack, "msgpack is not installed")
+class WireTests(ChatTestCase):
+    def frame(self, text="hi ✓"):
+        m = Message(id=7, sender=self.a, receiver=self.b, text=text, created_at=timezone.now(),
+                    status=Message.STATUS_SEEN, delivered_at=timezone.now(), seen_at=timezone.now())
+        return {"type": "message.new", "message": message_dict(m), "with": "bob"}
+
+    def test_round_trip(self):
+        for frame in (
+            self.frame(),
+            {"type": "receipt.bulk_seen", "items": [{"id": i, "ts": "2025-01-01T00:00:00Z"} for i in range(300)]},
+            {"type": "typing.start"},
+            {"type": "ping", "nonce": None, "nested": {"list": [1, 2.5, True, "x"]}},
+        ):
+            for compress in (None, False, True):
+                self.assertEqual(wire.unpack(wire.pack(frame, compress=compress)), frame)
+
+    @override_settings(CHAT_WS_COMPRESS_MIN_BYTES=512)
+    def test_compressed_from_threshold(self):
+        self.assertEqual(wire.pack(self.frame())[0], wire.RAW)
+        self.assertEqual(wire.pack(self.frame("x" * 1000))[0], wire.DEFLATE)
+        self.assertEqual(wire.pack(self.frame(), compress=True)[0], wire.DEFLATE)
+
+    def test_known_keys_and_types_are_sent_as_ints(self):
+        body = msgpack.unpackb(wire.pack({"type": "typing", "from": "alice", "custom": 1}, compress=False)[1:],
+                               strict_map_key=False)
+        self.assertEqual(body, {0: wire.TYPES.index("typing"), wire.KEYS.index("from"): "alice", "custom": 1})
+
+    def test_unknown_ids_from_newer_clients(self):
+        raw = bytes((wire.RAW,)) + msgpack.packb({0: 10_000, 10_000: "x", wire.KEYS.index("text"): "hi"})
+        self.assertEqual(wire.unpack(raw), {"type": None, "text": "hi"})
+
+    def test_rejects_bad_frames(self):
+        with self.assertRaises(ValueError):
+            wire.unpack(b"\x07" + msgpack.packb({}))
+        with self.settings(CHAT_WS_MAX_FRAME_BYTES=1024):
+            with self.assertRaises(ValueError):  # inflates past the limit: cut off, not decoded
+                wire.unpack(wire.pack(self.frame("x" * 5000), compress=True))
+
+    def test_subprotocol_negotiation(self):
+        self.assertEqual(wire.choose_subprotocol(["chat.msgpack.v1", "chat.json"]), wire.SUBPROTOCOL_MSGPACK)
+        self.assertEqual(wire.choose_subprotocol(["other", "chat.json"]), wire.SUBPROTOCOL_JSON)
+        self.assertIsNone(wire.choose_subprotocol(["other"]))
+        self.assertIsNone(wire.choose_subprotocol(None))
+
+
+@override_settings(CHAT_RATE_LIMIT_ENABLED=False)
+class ETagTests(FakeRedisMixin, ChatViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.send(self.b, self.a)
+        self.send(self.a, self.b)
+
+    def send(self, sender, receiver):
+        with transaction.atomic():  # tokens are bumped on commit
+            record_message(Message.objects.create(sender=sender, receiver=receiver, text="hi"))
+
+    def get(self, path, etag=None, **headers):
+        if etag:
+            headers["If-None-Match"] = etag
+        queries = metrics.db_queries_total._values.get((), 0)
+        response = async_to_sync(AsyncClient().get)(path, headers={**self.auth(self.a), **headers})
+        response.queries = metrics.db_queries_total._values.get((), 0) - queries
+        return response
+
+    def test_history_not_modified_without_queries(self):
+        first = self.get("/api/chat/history/bob/")
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first["ETag"].startswith('W/"'))
+        self.assertEqual(first["Cache-Control"], "private, no-cache")
+        self.assertGreater(first.queries, 0)  # the counter sees the view's DB thread
+
+        again = self.get("/api/chat/history/bob/", first["ETag"])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], first["ETag"])
+        self.assertEqual(again.queries, 0)
+        self.assertEqual(self.get("/api/chat/history/bob/", "*").status_code, 304)
+        self.assertEqual(self.get("/api/chat/history/bob/", f'"stale", {first["ETag"]}').status_code, 304)
+
+    def test_history_changes_invalidate(self):
+        etag = self.get("/api/chat/history/bob/")["ETag"]
+        self.send(self.b, self.c)  # another conversation
+        self.assertEqual(self.get("/api/chat/history/bob/", etag).status_code, 304)
+
+        self.send(self.b, self.a)
+        changed = self.get("/api/chat/history/bob/", etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], etag)
+
+        with transaction.atomic():
+            record_seen(self.a.id, self.b.id, len(mark_all_seen(self.a.id, self.b.id)))
+        self.assertEqual(self.get("/api/chat/history/bob/", changed["ETag"]).status_code, 200)
+
+    def test_representation_and_page_are_part_of_the_tag(self):
+        etag = self.get("/api/chat/history/bob/")["ETag"]
+        self.assertEqual(self.get("/api/chat/history/bob/?page_size=1", etag).status_code, 200)
+        if msgpack is not None:
+            self.assertEqual(self.get("/api/chat/history/bob/", etag, Accept="application/msgpack").status_code, 200)
+
+    def test_inbox(self):
+        etag = self.get("/api/chat/users/")["ETag"]
+        again = self.get("/api/chat/users/", etag)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.queries, 0)
+
+        presence.set_online(self.b.username)  # a peer's presence is part of the page
+        online = self.get("/api/chat/users/", etag)
+        self.assertEqual(online.status_code, 200)
+        self.assertEqual(self.get("/api/chat/users/", online["ETag"]).status_code, 304)
+
+        self.send(self.c, self.a)
+        self.assertEqual(self.get("/api/chat/users/", online["ETag"]).status_code, 200)
+
+
+@override_settings(CHAT_INGEST_MODE="stream", CHAT_RATE_LIMIT_ENABLED=False,
+                   CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class IngestTests(FakeRedisMixin, ChatViewTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(ingest, "_db_floor", None)  # ids restart with the flushed table
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def enqueue(self, sender, receiver, text="hi"):
+        return async_to_sync(ingest.enqueue)(sender, receiver, text)["id"]
+
+    def seen_all(self, me, peer):
+        ingest.enqueue_receipt("seen_all", me.id, timezone.now(), peer=peer.id)
+
+    def drain(self, room=None):
+        """(messages inserted, events sent to `room` meanwhile)."""
+        async def run():
+            layer = get_channel_layer()
+            channel = await layer.new_channel()
+            if room:
+                await layer.group_add(room, channel)
+            inserted = await sync_to_async(ingest.drain)()
+            events = []
+            while True:
+                try:
+                    events.append(await asyncio.wait_for(layer.receive(channel), 0.05))
+                except asyncio.TimeoutError:
+                    return inserted, events
+        return async_to_sync(run)()
+
+    def unread(self, me, peer):
+        return ThreadParticipant.objects.get(user=me, peer=peer).unread_count
+
+    def statuses(self):
+        return list(Message.objects.order_by("id").values_list("text", "status"))
+
+    def test_message_and_receipt_in_one_batch(self):
+        ids = [self.enqueue(self.a, self.b, f"m{i}") for i in range(2)]
+        self.seen_all(self.b, self.a)
+        self.enqueue(self.a, self.b, "later")
+
+        inserted, events = self.drain(room_group("alice", "bob"))
+        self.assertEqual(inserted, 3)
+        self.assertEqual(self.statuses(), [("m0", "seen"), ("m1", "seen"), ("later", "sent")])
+        self.assertEqual(self.unread(self.b, self.a), 1)
+        self.assertEqual([(e["type"], [i["id"] for i in e["items"]]) for e in events],
+                         [("chat.receipt_bulk_seen", ids)])
+        self.assertEqual(self.redis.xlen(ingest.stream_key()), 0)
+        self.assertEqual(self.redis.xlen(ingest.dead_letter_key()), 0)
+
+    def test_receipt_for_a_message_not_stored_yet(self):
+        mid = self.enqueue(self.a, self.b)
+        upd = async_to_sync(ChatRoom._mark_delivered)(SimpleNamespace(me=self.b), mid)
+        self.assertIsNotNone(upd["ts"])  # acked to the client already
+        self.assertFalse(Message.objects.exists())
+
+        self.drain()
+        m = Message.objects.get(id=mid)
+        self.assertEqual(m.status, Message.STATUS_DELIVERED)
+        self.assertIsNotNone(m.delivered_at)
+
+    def test_unacked_entries_are_replayed_once(self):
+        self.enqueue(self.a, self.b, "m0")
+        self.seen_all(self.b, self.a)
+        self.enqueue(self.a, self.b, "m1")
+        # a drain that stored the batch and died before acking it
+        ingest._ensure_group(self.redis)
+        resp = self.redis.xreadgroup(ingest.GROUP, ingest._consumer_name(), {ingest.stream_key(): ">"})
+        ingest.persist(resp[0][1])
+        stored = self.statuses()
+
+        inserted, _ = self.drain()
+        self.assertEqual(inserted, 0)
+        self.assertEqual(self.statuses(), stored)
+        self.assertEqual(stored, [("m0", "seen"), ("m1", "sent")])
+        self.assertEqual(self.unread(self.b, self.a), 1)  # not counted, or marked seen, twice
+        self.assertEqual(self.redis.xpending(ingest.stream_key(), ingest.GROUP)["pending"], 0)
+        self.assertEqual(self.redis.xlen(ingest.dead_letter_key()), 0)
+
+    def test_one_drain_at_a_time(self):
+        self.enqueue(self.a, self.b)
+        lock = self.redis.lock(ingest.drain_lock_key(), timeout=60)
+        self.assertTrue(lock.acquire(blocking=False))
+        self.assertEqual(self.drain(), (0, []))
+        self.assertEqual(self.redis.xlen(ingest.stream_key()), 1)
+
+        lock.release()
+        self.assertEqual(self.drain()[0], 1)
@@ -0,0 +1,193 @@
+# chat/threads.py
+"""
+Write-side maintenance and read helpers for the denormalized Thread /
+ThreadParticipant tables. Writers call these inside the same transaction
+as the Message change they describe.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+
+from accounts.usercache import user_cache
+
+from .models import Message, Thread, ThreadParticipant
+from .encoders import thread_summary_dict
+from .pagination import encode_cursor
+from .versions import touch
+
+log = logging.getLogger(__name__)
+
+
+def _pair(a_id: int, b_id: int):
+    return (a_id, b_id) if a_id < b_id else (b_id, a_id)
+
+
+def get_or_create_thread(a_id: int, b_id: int) -> Thread:
+    lo, hi = _pair(a_id, b_id)
+    thread, created = Thread.objects.get_or_create(user_a_id=lo, user_b_id=hi)
+    if created:
+        ThreadParticipant.objects.bulk_create(
+            [
+                ThreadParticipant(thread=thread, user_id=lo, peer_id=hi),
+                ThreadParticipant(thread=thread, user_id=hi, peer_id=lo),
+            ],
+            ignore_conflicts=True,
+        )
+    return thread
+
+
+def record_message(msg: Message) -> None:
+    """New message: bump last_message/last_activity and the receiver's unread."""
+    record_messages([msg])
+
+
+def record_messages(msgs) -> None:
+    """Batch form of record_message: one update per touched thread, not per message."""
+    latest = {}  # pair -> newest message
+    unread = {}  # (receiver_id, sender_id) -> new unread messages
+    for m in msgs:
+        pair = _pair(m.sender_id, m.receiver_id)
+        cur = latest.get(pair)
+        if cur is None or (m.created_at, m.id) > (cur.created_at, cur.id):
+            latest[pair] = m
+        if not m.is_read:
+            key = (m.receiver_id, m.sender_id)
+            unread[key] = unread.get(key, 0) + 1
+
+    for (a, b), m in latest.items():
+        thread = get_or_create_thread(a, b)
+        newer = Q(last_activity__isnull=True) | Q(last_activity__lte=m.created_at)
+        Thread.objects.filter(pk=thread.pk).filter(newer).update(last_message=m, last_activity=m.created_at)
+        ThreadParticipant.objects.filter(thread=thread).filter(newer).update(last_activity=m.created_at)
+    for (receiver_id, sender_id), n in unread.items():
+        ThreadParticipant.objects.filter(user_id=receiver_id, peer_id=sender_id).update(
+            unread_count=F("unread_count") + n
+        )
+    touch(*latest)
+
+
+def record_seen(me_id: int, peer_id: int, count: int) -> None:
+    """
+    `count` peer -> me messages just became seen (the rows mark_all_seen
+    changed). A decrement rather than a reset to 0, so a message committed
+    meanwhile stays counted.
+    """
+    ThreadParticipant.objects.filter(user_id=me_id, peer_id=peer_id).update(
+        unread_count=Greatest(F("unread_count") - count, 0)
+    )
+    touch((me_id, peer_id))
+
+
+def reconcile_unread() -> int:
+    """
+    Safety net for ThreadParticipant.unread_count: recount unread messages per
+    (receiver, sender) and repair counters that drifted, creating missing
+    Thread/participant rows on the way. Returns the number of rows repaired.
+
+    Candidates come from one grouped scan of unread messages (the
+    (receiver, is_read) index); each one is then recounted with its
+    participant row locked, so a message committed meanwhile is neither
+    lost nor counted twice.
+    """
+    expected = {
+        (row["receiver_id"], row["sender_id"]): row["n"]
+        for row in Message.objects.filter(is_read=False).values("receiver_id", "sender_id").annotate(n=Count("id"))
+    }
+    current = dict(
+        ((user_id, peer_id), n)
+        for user_id, peer_id, n in ThreadParticipant.objects.filter(
+            Q(unread_count__gt=0) | Q(user_id__in={k[0] for k in expected})
+        ).values_list("user_id", "peer_id", "unread_count")
+    )
+    suspects = {k for k, n in expected.items() if current.get(k) != n}
+    suspects |= {k for k, n in current.items() if n and k not in expected}
+
+    repaired = 0
+    for user_id, peer_id in suspects:
+        with transaction.atomic():
+            if (user_id, peer_id) not in current:
+                thread = get_or_create_thread(user_id, peer_id)
+                if thread.last_message_id is None:
+                    last = (
+                        Message.objects
+                        .filter(Q(sender_id=user_id, receiver_id=peer_id) | Q(sender_id=peer_id, receiver_id=user_id))
+                        .order_by("-created_at", "-id")
+                        .first()
+                    )
+                    Thread.objects.filter(pk=thread.pk).update(last_message=last, last_activity=last.created_at)
+                    ThreadParticipant.objects.filter(thread=thread).update(last_activity=last.created_at)
+                _ensure_participants(thread.pk, user_id, peer_id)
+            p = ThreadParticipant.objects.select_for_update().get(user_id=user_id, peer_id=peer_id)
+            n = Message.objects.filter(sender_id=peer_id, receiver_id=user_id, is_read=False).count()
+            if p.unread_count != n:
+                ThreadParticipant.objects.filter(pk=p.pk).update(unread_count=n)
+                repaired += 1
+    if repaired:
+        log.warning("reconciled %d unread counters", repaired)
+    return repaired
+
+
+def _ensure_participants(thread_id: int, a_id: int, b_id: int) -> None:
+    """Both participant rows of an existing thread (get_or_create_thread only makes them with the thread)."""
+    last_activity = Thread.objects.filter(pk=thread_id).values_list("last_activity", flat=True).get()
+    ThreadParticipant.objects.bulk_create(
+        [
+            ThreadParticipant(thread_id=thread_id, user_id=a_id, peer_id=b_id, last_activity=last_activity),
+            ThreadParticipant(thread_id=thread_id, user_id=b_id, peer_id=a_id, last_activity=last_activity),
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def participant_summary(participant, owner_id: int, other) -> dict:
+    """`other` may be a User or an accounts.usercache.CachedUser."""
+    if participant is None:
+        return thread_summary_dict(other, 0, None, owner_id)
+    return thread_summary_dict(other, participant.unread_count, participant.thread.last_message, owner_id)
+
+
+def participants_for(owner_id: int):
+    return ThreadParticipant.objects.filter(user_id=owner_id).select_related(
+        "peer", "thread__last_message__sender", "thread__last_message__receiver"
+    )
+
+
+async def ainbox_page(owner_id: int, *, before=None, page_size: int, using=None):
+    """
+    Keyset page of owner's conversations, most recently active first, walked
+    along the (user, -last_activity, -id) index. `before` is a
+    pagination cursor (last_activity, participant id); `using` the alias to
+    read from (None: the router's choice). Returns
+    {"results": [ThreadParticipant], "before": cursor | None}.
+    """
+    qs = participants_for(owner_id).using(using).filter(last_activity__isnull=False)
+    if before:
+        ts, pk = before
+        # the redundant bound lets the index scan start at the cursor; the OR only breaks ties
+        qs = qs.filter(last_activity__lte=ts).filter(Q(last_activity__lt=ts) | Q(last_activity=ts, id__lt=pk))
+    rows = [p async for p in qs.order_by("-last_activity", "-id")[:page_size + 1]]
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    cursor = encode_cursor(rows[-1].last_activity, rows[-1].id) if more else None
+    return {"results": rows, "before": cursor}
+
+
+def thread_summary(owner_username: str, other_username: str) -> dict:
+    """
+    Dict shaped for InboxConsumer.thread_update:
+     { "user": {...}, "unread_count": int, "last_message": {... or None} }
+    where 'last_message.from_me' is relative to the owner.
+    """
+    owner = user_cache.get(username=owner_username)
+    other = user_cache.get(username=other_username)
+    if not owner or not other:
+        return {"user": None, "unread_count": 0, "last_message": None}
+    p = (
+        ThreadParticipant.objects
+        .filter(user_id=owner.id, peer_id=other.id)
+        .select_related("thread__last_message__sender", "thread__last_message__receiver")
+        .first()
+    )
+    return participant_summary(p, owner.id, other)
@@ -1,8 +1,22 @@
 from django.urls import path
+from django.views.decorators.gzip import gzip_page
+
 from .views import *
+from .views_async import (
+    ConversationExportView, ConversationView, ExportDownloadView, ExportStatusView, UserPresenceView, UsersListView,
+)
 
+# gzip only on the chat read endpoints: never on responses carrying tokens (BREACH)
 urlpatterns = [
-    path("users/", UsersListView.as_view()),
-    path("history/<str:username>/", ConversationView.as_view()),
+    path("users/", gzip_page(UsersListView.as_view())),
+    path("users/search/", UserSearchView.as_view()),
+    path("discover/", DiscoverUsersView.as_view()),
+    path("history/<str:username>/", gzip_page(ConversationView.as_view())),
+    path("history/<str:username>/export/", gzip_page(ConversationExportView.as_view())),
+    path("exports/<str:export_id>/", ExportStatusView.as_view()),
+    path("exports/<str:export_id>/download/", ExportDownloadView.as_view()),
+    path("messages/search/", gzip_page(MessageSearchView.as_view())),
+    path("sync/", gzip_page(SyncView.as_view())),
+    path("presence/", BulkPresenceView.as_view()),
     path("presence/<str:username>/", UserPresenceView.as_view()),
 ]
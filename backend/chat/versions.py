@@ -0,0 +1,110 @@
+# chat/versions.py
+"""
+Validators for conditional GETs (ETag / If-None-Match) on the inbox and
+history views.
+
+Every user's inbox and every conversation has a version token in Redis.
+Writers call `touch(pairs)` inside the transaction of any change that shows
+up there (new message, unread reset, receipt); on commit the tokens of both
+inboxes and the conversation are replaced by fresh ones. Views read the
+token *before* their queries, so a response is never tagged newer than the
+data in it, and an unchanged token means an unchanged page: 304 without a
+query.
+
+- Tokens are random, not counters: if a key is evicted, the next reader
+  creates a new token and no ETag handed out earlier can match it.
+- `touch` pins the users to the primary first (chat.replicas), so whoever
+  sees a new token also reads the rows behind it.
+- Inbox pages also carry the peers' presence, which lives in Redis anyway:
+  the peers of every tagged page are remembered (KEY_INBOX_PAGE) so a
+  revalidation can check their presence without reading the page.
+"""
+import logging
+from secrets import token_hex
+from typing import List, Optional, Tuple
+
+import redis
+from django.db import transaction
+
+from .encoders import dumps, loads
+from .redis_clients import get_aredis, get_redis
+from .replicas import pin_primary
+
+log = logging.getLogger(__name__)
+
+KEY_INBOX = "ver:inbox:{}"        # user id
+KEY_THREAD = "ver:thread:{}:{}"   # lower user id, higher user id
+KEY_INBOX_PAGE = "ver:inboxpage:{}:{}"  # user id, ETag -> {"v": inbox token, "peers": [username]}
+VERSION_TTL_SEC = 24 * 3600       # idle tokens expire; the next reader starts a new one
+INBOX_PAGE_TTL_SEC = 3600
+
+
+def inbox_key(user_id: int) -> str:
+    return KEY_INBOX.format(user_id)
+
+
+def thread_key(a_id: int, b_id: int) -> str:
+    return KEY_THREAD.format(min(a_id, b_id), max(a_id, b_id))
+
+
+def touch(*pairs) -> None:
+    """These conversations changed: new tokens for them and both users' inboxes once the transaction commits."""
+    if not pairs:
+        return
+    users = {uid for pair in pairs for uid in pair}
+    pin_primary(*users)
+    keys = {inbox_key(uid) for uid in users} | {thread_key(a, b) for a, b in pairs}
+    transaction.on_commit(lambda: _bump(keys))
+
+
+def _bump(keys) -> None:
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for key in keys:
+            pipe.set(key, token_hex(8), ex=VERSION_TTL_SEC)
+        pipe.execute()
+    except redis.RedisError:
+        # readers may answer 304 for these until the tokens expire
+        log.error("could not bump versions %s", sorted(keys), exc_info=True)
+
+
+async def aversions(*keys: str) -> Optional[List[str]]:
+    """Current tokens for `keys` (started if missing), or None if Redis can't be reached."""
+    try:
+        pipe = get_aredis().pipeline(transaction=False)
+        for key in keys:
+            pipe.set(key, token_hex(8), nx=True, ex=VERSION_TTL_SEC)
+            pipe.get(key)
+        return (await pipe.execute())[1::2]
+    except redis.RedisError:
+        log.warning("could not read versions %s", keys, exc_info=True)
+        return None
+
+
+async def ainbox_version(user_id: int, etag: Optional[str] = None) -> Tuple[Optional[str], Optional[List[str]]]:
+    """
+    (inbox token, peers of the page `etag` was issued for) in one round
+    trip. The peers are None unless that page was tagged at the current
+    token; the token is None if Redis can't be reached.
+    """
+    key = inbox_key(user_id)
+    try:
+        pipe = get_aredis().pipeline(transaction=False)
+        pipe.set(key, token_hex(8), nx=True, ex=VERSION_TTL_SEC)
+        pipe.get(key)
+        if etag:
+            pipe.get(KEY_INBOX_PAGE.format(user_id, etag))
+        _, token, *page = await pipe.execute()
+    except redis.RedisError:
+        log.warning("could not read the inbox version of %s", user_id, exc_info=True)
+        return None, None
+    page = loads(page[0]) if page and page[0] else None
+    return token, page["peers"] if page and page["v"] == token else None
+
+
+async def aremember_inbox_page(user_id: int, etag: str, token: str, peers: List[str]) -> None:
+    try:
+        await get_aredis().set(KEY_INBOX_PAGE.format(user_id, etag), dumps({"v": token, "peers": peers}),
+                               ex=INBOX_PAGE_TTL_SEC)
+    except redis.RedisError:
+        log.warning("could not remember inbox page %s of %s", etag, user_id, exc_info=True)
@@ -1,88 +1,174 @@
+from datetime import datetime, time
+
 from django.contrib.auth.models import User
-from django.db.models import Q, Count, OuterRef, Subquery, DateTimeField
-from django.db.models.functions import Coalesce
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 
-from .models import Message
-from .presence import get_presence
-from .serializers import MessageSerializer, UserPublicSerializer
+from accounts.search import MAX_OFFSET, search_users
+from accounts.usercache import user_cache
+from core.metrics import TimedViewMixin
+from .models import ThreadParticipant
+from .pagination import InvalidCursor, parse_page_size
+from .presence import get_presence_many
+from .ratelimit import ChatRateThrottle
+from .replicas import ReplicaReadMixin
+from .search import decode_search_cursor, search_messages
+from .sync import InvalidSyncCursor, changes_since, decode_sync_cursor, head_cursor, parse_sync_limit
+from .encoders import CHAT_RENDERERS, message_list, user_public
 
 
-class UsersListView(APIView):
+class DiscoverUsersView(TimedViewMixin, ReplicaReadMixin, APIView):
     """
-    Returns threads with last message + unread count.
+    People I haven't talked to yet, by username.
+    ?page_size=N  ?after=<username>  -> {"results": [user], "after": username | None}
     """
     permission_classes = [IsAuthenticated]
+    throttle_classes = [ChatRateThrottle]
+    renderer_classes = CHAT_RENDERERS
 
     def get(self, request):
         me = request.user
-
-        # last message id and created_at for each counterpart
-        last_msg_id_sq = (
-            Message.objects
-            .filter(Q(sender=me, receiver=OuterRef('pk')) | Q(sender=OuterRef('pk'), receiver=me))
-            .order_by('-created_at')
-            .values('id')[:1]
-        )
-        last_msg_time_sq = (
-            Message.objects
-            .filter(Q(sender=me, receiver=OuterRef('pk')) | Q(sender=OuterRef('pk'), receiver=me))
-            .order_by('-created_at')
-            .values('created_at')[:1]
-        )
-
-        users_qs = (
+        size = parse_page_size(request.query_params.get("page_size"))
+        contacts = ThreadParticipant.objects.filter(user_id=me.id, peer_id=OuterRef("pk"))
+        qs = (
             User.objects
+            .filter(is_active=True)
             .exclude(id=me.id)
-            .annotate(
-                last_message_id=Subquery(last_msg_id_sq),
-                last_message_created_at=Subquery(last_msg_time_sq, output_field=DateTimeField()),
-                unread_count=Count('sent', filter=Q(sent__receiver=me, sent__is_read=False)),
-            )
-            # Fallback to date_joined when no messages exist
-            .annotate(last_activity=Coalesce('last_message_created_at', 'date_joined'))
-            .order_by('-last_activity', 'username')
+            .exclude(Exists(contacts))
+            .only("id", "username", "first_name", "last_name")
+            .order_by("username")
         )
+        if request.query_params.get("after"):
+            qs = qs.filter(username__gt=request.query_params["after"])
+        rows = list(qs[:size + 1])
+        more = len(rows) > size
+        rows = rows[:size]
+        return Response({"results": [user_public(u) for u in rows], "after": rows[-1].username if more else None})
+
 
-        # preload last messages
-        last_ids = [u.last_message_id for u in users_qs if u.last_message_id]
-        last_map = {}
-        if last_ids:
-            for m in Message.objects.filter(id__in=last_ids).select_related('sender', 'receiver'):
-                last_map[m.id] = m
-
-        data = []
-        for u in users_qs:
-            item = {
-                "user": UserPublicSerializer(u).data,
-                "unread_count": int(u.unread_count or 0),
-                "last_message": None,
-            }
-            if u.last_message_id and u.last_message_id in last_map:
-                lm = last_map[u.last_message_id]
-                payload = MessageSerializer(lm).data
-                payload["from_me"] = (lm.sender_id == me.id)
-                item["last_message"] = payload
-            data.append(item)
-
-        return Response(data)
-class ConversationView(APIView):
+class UserSearchView(TimedViewMixin, ReplicaReadMixin, APIView):
+    """
+    Ranked user search by username / name (prefix first, then fuzzy).
+    ?q=...  ?page_size=N  ?offset=N  -> {"results": [user], "next": offset | None}
+    """
     permission_classes = [IsAuthenticated]
-    def get(self, request, username):
+    throttle_classes = [ChatRateThrottle]
+    throttle_scope = "search"
+    renderer_classes = CHAT_RENDERERS
+
+    def get(self, request):
+        size = parse_page_size(request.query_params.get("page_size"))
         try:
-            other = User.objects.get(username=username)
-        except User.DoesNotExist:
-            return Response({"detail": "User not found"}, status=status.HTTP_404_NOT_FOUND)
-        qs = Message.objects.filter(
-            Q(sender=request.user, receiver=other) | Q(sender=other, receiver=request.user)
-        ).order_by("created_at")
-        return Response(MessageSerializer(qs, many=True).data)
+            offset = max(0, int(request.query_params.get("offset") or 0))
+        except ValueError:
+            return Response({"detail": "Invalid offset"}, status=status.HTTP_400_BAD_REQUEST)
+        rows = search_users(request.query_params.get("q", ""), request.user.id, limit=size + 1, offset=offset)
+        more = len(rows) > size and offset + size < MAX_OFFSET
+        results = [
+            {"id": i, "username": username, "first_name": first, "last_name": last}
+            for i, username, first, last in rows[:size]
+        ]
+        return Response({"results": results, "next": offset + size if more else None})
 
 
-class UserPresenceView(APIView):
+class SyncView(TimedViewMixin, APIView):
+    """
+    Everything that changed in my conversations since a cursor (new messages
+    and receipt changes, as current message rows), oldest first.
+    ?since=<cursor>  ?limit=N  -> {messages, threads, cursor, has_more}
+    Without `since` only the current cursor is returned: fetch it before the
+    initial load, then keep calling with the returned cursor.
+    """
     permission_classes = [IsAuthenticated]
-    def get(self, request, username):
-        return Response(get_presence(username))
\ No newline at end of file
+    throttle_classes = [ChatRateThrottle]
+    renderer_classes = CHAT_RENDERERS
+
+    def get(self, request):
+        raw = request.query_params.get("since")
+        if not raw:
+            return Response({"messages": [], "threads": [], "cursor": head_cursor(request.user.id), "has_more": False})
+        try:
+            since = decode_sync_cursor(raw)
+        except InvalidSyncCursor:
+            return Response({"detail": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+        page = changes_since(request.user.id, since, parse_sync_limit(request.query_params.get("limit")))
+        page["messages"] = message_list(page["messages"])
+        return Response(page)
+
+
+def _parse_when(value):
+    """ISO datetime or date (midnight, current timezone) -> aware datetime; raises ValueError."""
+    dt = parse_datetime(value)
+    if dt is None:
+        d = parse_date(value)
+        if d is None:
+            raise ValueError(value)
+        dt = datetime.combine(d, time.min)
+    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+
+
+class MessageSearchView(TimedViewMixin, ReplicaReadMixin, APIView):
+    """
+    Full-text search over my messages, best match first.
+    ?q=...  ?with=<username>  ?since=<iso>  ?until=<iso>  ?page_size=N  ?cursor=<cursor>
+    -> {"results": [{message, score, snippet}], "next": cursor | None}
+    `snippet` is HTML-escaped text with the matches in <mark>.
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [ChatRateThrottle]
+    throttle_scope = "search"
+    renderer_classes = CHAT_RENDERERS
+
+    def get(self, request):
+        params = request.query_params
+        peer_id = None
+        if params.get("with"):
+            peer = user_cache.get(username=params["with"])
+            if peer is None:
+                return Response({"detail": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+            peer_id = peer.id
+        try:
+            since = _parse_when(params["since"]) if params.get("since") else None
+            until = _parse_when(params["until"]) if params.get("until") else None
+        except ValueError:
+            return Response({"detail": "Invalid date"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            cursor = decode_search_cursor(params["cursor"]) if params.get("cursor") else None
+        except InvalidCursor:
+            return Response({"detail": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+        page = search_messages(
+            request.user.id, params.get("q", ""), peer_id=peer_id, since=since, until=until,
+            cursor=cursor, page_size=parse_page_size(params.get("page_size")),
+        )
+        msgs = message_list(m for m, _, _ in page["results"])
+        results = [
+            {"message": msg, "score": score, "snippet": snippet}
+            for msg, (_, score, snippet) in zip(msgs, page["results"])
+        ]
+        return Response({"results": results, "next": page["next"]})
+
+
+class BulkPresenceView(APIView):
+    """
+    Presence for many users in one request: ?usernames=a,b,c
+    Returns { username: {online, last_seen, ttl} }.
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [ChatRateThrottle]
+    MAX_USERNAMES = 500
+
+    def get(self, request):
+        raw = request.query_params.get("usernames", "")
+        names = [u for u in (x.strip() for x in raw.split(",")) if u]
+        if len(names) > self.MAX_USERNAMES:
+            return Response(
+                {"detail": f"At most {self.MAX_USERNAMES} usernames per request"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(get_presence_many(names))
@@ -0,0 +1,291 @@
+# chat/views_async.py
+"""
+Native async versions of the hot read endpoints: inbox, history, presence.
+
+Nothing on the request path needs the sync threadpool: the JWT is checked
+in the event loop (accounts.jwt_ws.user_from_token), users come from
+user_cache, presence and rate limits from the async Redis client, and rows
+from the async ORM.
+
+Responses match the DRF views they replace (same JSON, `Accept:
+application/msgpack`, 401/404/400/429 bodies with "detail").
+ConversationExportView streams whole conversations (chat.export); queued
+exports are polled and downloaded through ExportStatusView /
+ExportDownloadView, by their owner only.
+
+Inbox and history pages carry a weak ETag built from chat.versions tokens;
+`If-None-Match` with the current one gets a 304 after a Redis round trip
+(two for the inbox, to re-check presence) and no query. Presence counts as
+changed when a peer goes on/offline or an offline peer's last_seen moves,
+not on every heartbeat of an online one.
+"""
+import hashlib
+import math
+import os
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from accounts.jwt_ws import user_from_token
+from accounts.usercache import user_cache
+from core.metrics import http_view_seconds
+from . import export
+from .encoders import dumps, message_list, msgpack
+from .pagination import InvalidCursor, aconversation_page, decode_cursor, parse_page_size
+from .presence import aget_presence_many
+from .ratelimit import aallow
+from .replicas import aread_alias_for
+from .tasks import export_conversation
+from .threads import ainbox_page, participant_summary
+from .versions import ainbox_version, aremember_inbox_page, aversions, thread_key
+
+def _wants_msgpack(request) -> bool:
+    return msgpack is not None and "application/msgpack" in request.headers.get("Accept", "")
+
+
+def respond(request, data, status: int = 200) -> HttpResponse:
+    if _wants_msgpack(request):
+        return HttpResponse(msgpack.packb(data, use_bin_type=True), status=status, content_type="application/msgpack")
+    return HttpResponse(dumps(data), status=status, content_type="application/json")
+
+
+def etag_for(request, *parts) -> str:
+    """Opaque tag for this URL + representation (JSON / msgpack) + `parts`."""
+    key = dumps([request.get_full_path(), _wants_msgpack(request), *parts])
+    return hashlib.blake2b(key, digest_size=12).hexdigest()
+
+
+def client_etags(request) -> list:
+    """If-None-Match tags, unquoted (compared weakly)."""
+    return [tag.removeprefix("W/").strip('"') for tag in parse_etags(request.headers.get("If-None-Match", ""))]
+
+
+def tagged(response, etag: str):
+    response["ETag"] = f'W/"{etag}"'
+    response["Cache-Control"] = "private, no-cache"
+    patch_vary_headers(response, ["Accept", "Authorization"])
+    return response
+
+
+class AsyncAPIView(View):
+    """
+    Async counterpart of the chat APIViews: bearer-JWT auth, the "rest" token
+    bucket (or `throttle_scope`) and chat_http_view_seconds. Handlers get the
+    authenticated user as `request.user`.
+    """
+    http_method_names = ["get", "head", "options"]
+    throttle_scope = "rest"
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))  # bearer tokens only, like the DRF views
+
+    async def dispatch(self, request, *args, **kwargs):
+        t0 = time.perf_counter()
+        response = await self._checked_dispatch(request, *args, **kwargs)
+        http_view_seconds.observe(time.perf_counter() - t0, type(self).__name__, request.method, response.status_code)
+        return response
+
+    async def _checked_dispatch(self, request, *args, **kwargs):
+        auth = request.headers.get("Authorization", "").split()
+        if len(auth) != 2 or auth[0].lower() != "bearer":
+            return self._unauthorized(request, "Authentication credentials were not provided.")
+        user = await user_from_token(auth[1])
+        if not user.is_authenticated:
+            return self._unauthorized(request, "Given token not valid for any token type")
+        request.user = user
+
+        ok, wait = await aallow(user, self.throttle_scope)
+        if not ok:
+            wait = math.ceil(wait) or 1
+            response = respond(request, {"detail": f"Request was throttled. Expected available in {wait} seconds."}, 429)
+            response["Retry-After"] = str(wait)
+            return response
+        return await super().dispatch(request, *args, **kwargs)
+
+    @staticmethod
+    def _unauthorized(request, detail):
+        response = respond(request, {"detail": detail}, 401)
+        response["WWW-Authenticate"] = 'Bearer realm="api"'
+        return response
+
+
+class UsersListView(AsyncAPIView):
+    """
+    Inbox: my conversations, most recently active first, with last message,
+    unread count and presence. Only actual conversation partners are listed;
+    see DiscoverUsersView for everyone else.
+    ?page_size=N  ?before=<cursor>  -> {"results": [...], "before": cursor | None}
+    """
+
+    async def get(self, request):
+        me = request.user
+        try:
+            before = decode_cursor(request.GET["before"]) if request.GET.get("before") else None
+        except InvalidCursor:
+            return respond(request, {"detail": "Invalid cursor"}, 400)
+        seen = client_etags(request)[:1]  # presence is re-checked for one remembered page at most
+        token, peers = await ainbox_version(me.id, *seen)
+        if peers is not None:
+            etag = _inbox_etag(request, token, peers, await aget_presence_many(peers))
+            if etag in seen:
+                return tagged(HttpResponseNotModified(), etag)
+
+        page = await ainbox_page(me.id, before=before, page_size=parse_page_size(request.GET.get("page_size")),
+                                 using=await aread_alias_for(me.id))
+        peers = [p.peer.username for p in page["results"]]
+        presence = await aget_presence_many(peers)
+        data = []
+        for p in page["results"]:
+            item = participant_summary(p, me.id, p.peer)
+            item["presence"] = presence[p.peer.username]
+            data.append(item)
+        response = respond(request, {"results": data, "before": page["before"]})
+        if token is not None:
+            etag = _inbox_etag(request, token, peers, presence)
+            await aremember_inbox_page(me.id, etag, token, peers)
+            tagged(response, etag)
+        return response
+
+
+def _inbox_etag(request, token, peers, presence) -> str:
+    status = [(p["online"], None if p["online"] else p["last_seen"]) for p in (presence[u] for u in peers)]
+    return etag_for(request, token, peers, status)
+
+
+class ConversationView(AsyncAPIView):
+    """
+    Keyset-paginated history, newest page first.
+    ?page_size=N  ?before=<cursor> (older) | ?after=<cursor> (newer), not both
+    """
+
+    async def get(self, request, username):
+        if request.GET.get("before") and request.GET.get("after"):
+            return respond(request, {"detail": "Pass either before or after, not both"}, 400)
+        other = await user_cache.aget(username=username)
+        if other is None:
+            return respond(request, {"detail": "User not found"}, 404)
+        try:
+            before = decode_cursor(request.GET["before"]) if request.GET.get("before") else None
+            after = decode_cursor(request.GET["after"]) if request.GET.get("after") else None
+        except InvalidCursor:
+            return respond(request, {"detail": "Invalid cursor"}, 400)
+        me = request.user
+        token = await aversions(thread_key(me.id, other.id))  # before any query: see chat.versions
+        etag = etag_for(request, token[0]) if token else None
+        if etag is not None and {etag, "*"} & set(client_etags(request)):
+            return tagged(HttpResponseNotModified(), etag)
+
+        page = await aconversation_page(
+            me.id, other.id, before=before, after=after,
+            page_size=parse_page_size(request.GET.get("page_size")), using=await aread_alias_for(me.id),
+        )
+        response = respond(request, {"results": message_list(page["results"]),
+                                     "before": page["before"], "after": page["after"]})
+        return tagged(response, etag) if etag is not None else response
+
+
+class UserPresenceView(AsyncAPIView):
+    async def get(self, request, username):
+        presence = await aget_presence_many([username])
+        return respond(request, presence[username])
+
+
+class ConversationExportView(AsyncAPIView):
+    """
+    The whole conversation with `username`, oldest first.
+    GET  ?format=ndjson|csv  -> streamed as an attachment (gzip if the client accepts it)
+    POST ?format=ndjson|csv  -> 202 {"id", "status", "url"}: a Celery worker writes
+         the export (gzipped) instead; poll `url` (ExportStatusView) until it is ready
+    """
+    http_method_names = ["get", "post", "head", "options"]
+    throttle_scope = "export"
+
+    async def _args(self, request, username):
+        fmt = request.GET.get("format", "ndjson")
+        if fmt not in export.FORMATS:
+            return None, None, respond(request, {"detail": f"format must be one of {', '.join(export.FORMATS)}"}, 400)
+        other = await user_cache.aget(username=username)
+        if other is None:
+            return None, None, respond(request, {"detail": "User not found"}, 404)
+        return fmt, other, None
+
+    async def get(self, request, username):
+        fmt, other, error = await self._args(request, username)
+        if error is not None:
+            return error
+        me = request.user
+        rows = export.export_rows(me.id, other.id).using(await aread_alias_for(me.id))
+        chunks = export.aiter_export(rows.aiterator(chunk_size=settings.CHAT_EXPORT_CHUNK), export.Encoder(fmt, me, other))
+        content_type, ext = export.FORMATS[fmt]
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="chat-{me.username}-{other.username}.{ext}"'
+        return response
+
+    async def post(self, request, username):
+        fmt, other, error = await self._args(request, username)
+        if error is not None:
+            return error
+        record = await export.acreate_record(request.user, other, fmt)
+        await sync_to_async(export_conversation.delay, thread_sensitive=False)(record["id"])
+        data = _export_status(record)
+        response = respond(request, data, 202)
+        response["Location"] = data["url"]
+        return response
+
+
+def _export_status(record) -> dict:
+    data = {key: record[key] for key in ("id", "status", "format", "messages", "expires_at")}
+    data["url"] = f"/api/chat/exports/{record['id']}/"
+    if record["status"] == export.STATUS_READY:
+        data["download"] = data["url"] + "download/"
+    return data
+
+
+class ExportStatusView(AsyncAPIView):
+    """
+    A queued export of mine:
+    {"id", "status": pending|ready|failed, "format", "messages", "expires_at", "url", "download" (once ready)}.
+    Exports of other users are 404, like expired ones.
+    """
+
+    async def get(self, request, export_id):
+        record = await export.aget_record(export_id, request.user.id)
+        if record is None:
+            return respond(request, {"detail": "Export not found"}, 404)
+        return respond(request, _export_status(record))
+
+
+class ExportDownloadView(AsyncAPIView):
+    """The gzipped file of a ready export of mine, streamed from disk."""
+
+    async def get(self, request, export_id):
+        record = await export.aget_record(export_id, request.user.id)
+        if record is None:
+            return respond(request, {"detail": "Export not found"}, 404)
+        if record["status"] != export.STATUS_READY:
+            return respond(request, {"detail": f"Export is {record['status']}"}, 409)
+        try:
+            f = await sync_to_async(open, thread_sensitive=False)(
+                os.path.join(settings.MEDIA_ROOT, record["file"]), "rb")
+        except FileNotFoundError:
+            return respond(request, {"detail": "Export not found"}, 404)
+        response = StreamingHttpResponse(_read_file(f), content_type="application/gzip")
+        response["Content-Disposition"] = f'attachment; filename="{os.path.basename(record["file"])}"'
+        return response
+
+
+async def _read_file(f):
+    """A file's bytes EXPORT_WRITE_BYTES at a time, read off the event loop."""
+    read = sync_to_async(f.read, thread_sensitive=False)
+    try:
+        while chunk := await read(export.EXPORT_WRITE_BYTES):
+            yield chunk
+    finally:
+        f.close()
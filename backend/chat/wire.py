@@ -0,0 +1,135 @@
+# chat/wire.py
+"""
+WebSocket frame encodings, negotiated per socket by subprotocol.
+
+- no subprotocol / "chat.json": JSON text frames (encoders.dumps), as before.
+- "chat.msgpack.v1" (needs the optional `msgpack` package): binary frames.
+  Every frame starts with one flag byte:
+    0x00  MessagePack follows
+    0x01  zlib-compressed MessagePack follows (frames over
+          CHAT_WS_COMPRESS_MIN_BYTES: bulk receipts, long texts, ...)
+  Map keys listed in KEYS are sent as their index, and the "type" value as
+  its index in TYPES; anything else is sent as is, so adding a field never
+  breaks old clients. Clients send frames the same way.
+
+`python manage.py bench_wire` compares bytes and encode cost with JSON, both
+uncompressed and zlib-compressed.
+"""
+import zlib
+from typing import Any, Optional
+
+from django.conf import settings
+
+from .encoders import dumps_text, loads, msgpack
+
+SUBPROTOCOL_JSON = "chat.json"
+SUBPROTOCOL_MSGPACK = "chat.msgpack.v1"
+
+RAW, DEFLATE = 0x00, 0x01
+
+# append only: the index is the wire id
+KEYS = (
+    "type", "message", "message_id", "status", "ts", "items", "from", "active",
+    "id", "sender", "receiver", "text", "created_at", "delivered_at", "seen_at",
+    "username", "first_name", "last_name", "user", "unread_count", "last_message", "from_me",
+    "with", "event", "retry_after", "error",
+)
+TYPES = (
+    # server -> client
+    "message.new", "receipt.update", "receipt.bulk_seen", "receipt.bulk_delivered", "typing",
+    "thread.update", "rate_limited", "subscribed", "unsubscribed", "error",
+    # client -> server
+    "message.send", "receipt.delivered", "receipt.seen_all", "typing.start", "typing.stop",
+    "ping", "subscribe", "unsubscribe",
+)
+_KEY_ID = {k: i for i, k in enumerate(KEYS)}
+_TYPE_ID = {t: i for i, t in enumerate(TYPES)}
+
+
+def _compact(obj):
+    if isinstance(obj, dict):
+        out = {}
+        for k, v in obj.items():
+            if k == "type" and v in _TYPE_ID:
+                out[0] = _TYPE_ID[v]
+            else:
+                out[_KEY_ID.get(k, k)] = _compact(v)
+        return out
+    if isinstance(obj, list):
+        return [_compact(v) for v in obj]
+    return obj
+
+
+def _expand(obj):
+    if isinstance(obj, dict):
+        out = {}
+        for k, v in obj.items():
+            if isinstance(k, int):
+                if not 0 <= k < len(KEYS):
+                    continue  # a newer client's field; ignore like an unknown string key
+                k = KEYS[k]
+            if k == "type" and isinstance(v, int):
+                out[k] = TYPES[v] if 0 <= v < len(TYPES) else None
+            else:
+                out[k] = _expand(v)
+        return out
+    if isinstance(obj, list):
+        return [_expand(v) for v in obj]
+    return obj
+
+
+def pack(frame: dict, compress: Optional[bool] = None) -> bytes:
+    """One binary frame; compressed when at least CHAT_WS_COMPRESS_MIN_BYTES unless `compress` says otherwise."""
+    body = msgpack.packb(_compact(frame), use_bin_type=True)
+    if compress is None:
+        compress = len(body) >= settings.CHAT_WS_COMPRESS_MIN_BYTES
+    if compress:
+        return bytes((DEFLATE,)) + zlib.compress(body, 6)
+    return bytes((RAW,)) + body
+
+
+def unpack(data: bytes) -> Any:
+    flag, body = data[0], data[1:]
+    if flag == DEFLATE:
+        body = zlib.decompressobj().decompress(body, settings.CHAT_WS_MAX_FRAME_BYTES)
+    elif flag != RAW:
+        raise ValueError(f"unknown frame flag {flag}")
+    return _expand(msgpack.unpackb(body, raw=False, strict_map_key=False))
+
+
+def choose_subprotocol(offered) -> Optional[str]:
+    """First subprotocol in the client's list we can speak (None: plain JSON)."""
+    for proto in offered or ():
+        if proto == SUBPROTOCOL_MSGPACK and msgpack is not None:
+            return proto
+        if proto == SUBPROTOCOL_JSON:
+            return proto
+    return None
+
+
+class WireProtocolMixin:
+    """
+    AsyncWebsocketConsumer mixin: negotiates the encoding on accept and gives
+    consumers `send_frame(dict)` / `decode_frame(text, bytes)` for it.
+    """
+    binary = False
+
+    async def accept(self, subprotocol=None, *args, **kwargs):
+        if subprotocol is None:
+            subprotocol = choose_subprotocol(self.scope.get("subprotocols"))
+        self.binary = subprotocol == SUBPROTOCOL_MSGPACK
+        await super().accept(subprotocol, *args, **kwargs)
+
+    async def send_frame(self, frame: dict, room=None) -> None:
+        if self.binary:
+            await self.send(bytes_data=pack(frame))
+        else:
+            await self.send(text_data=dumps_text(frame))
+
+    def decode_frame(self, text_data=None, bytes_data=None) -> Optional[dict]:
+        """The client frame as a dict, or None if it can't be parsed."""
+        try:
+            data = unpack(bytes_data) if bytes_data is not None and self.binary else loads(text_data or "{}")
+        except Exception:
+            return None
+        return data if isinstance(data, dict) else None
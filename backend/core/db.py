@@ -0,0 +1,82 @@
+# core/db.py
+"""
+Where async code runs its DB work, and pool metrics.
+
+channels' `database_sync_to_async` is thread-sensitive: outside an HTTP
+request that means one thread for the whole process, so every consumer's
+queries queue behind each other on one connection. `db_sync_to_async` runs
+them on a fixed pool of CHAT_DB_THREADS threads instead (still closing
+expired connections around each call). Prod sizes the Postgres connection
+pool from the same number, so a busy thread never waits for a connection.
+"""
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+_executor = ThreadPoolExecutor(max_workers=settings.CHAT_DB_THREADS, thread_name_prefix="chat-db")
+
+
+def _claim(pending: list):
+    """Submit time of a queued call, for whichever of the thread / the cancelled caller gets there first."""
+    try:
+        return pending.pop()
+    except IndexError:
+        return None
+
+
+def db_sync_to_async(func):
+    """database_sync_to_async on the shared DB thread pool (usable as a method decorator)."""
+
+    def run(pending, *args, **kwargs):
+        submitted = _claim(pending)
+        if submitted is not None:
+            metrics.db_executor_queued.dec()
+            metrics.db_executor_wait_seconds.observe(time.perf_counter() - submitted)
+        return func(*args, **kwargs)
+
+    run_async = DatabaseSyncToAsync(run, thread_sensitive=False, executor=_executor)
+
+    @functools.wraps(func)
+    async def call(*args, **kwargs):
+        pending = [time.perf_counter()]
+        metrics.db_executor_queued.inc()
+        try:
+            return await run_async(pending, *args, **kwargs)
+        finally:
+            if _claim(pending) is not None:  # cancelled before a thread picked it up
+                metrics.db_executor_queued.dec()
+
+    return call
+
+
+def _pools():
+    for alias in connections:
+        conn = connections[alias]
+        if conn.settings_dict.get("OPTIONS", {}).get("pool"):
+            yield alias, conn.pool
+
+
+def install_metrics() -> None:
+    @metrics.collector
+    def db_pool_metrics():
+        stats = {alias: pool.get_stats() for alias, pool in _pools()}
+        per_alias = lambda key, scale=1: {(a,): s.get(key, 0) * scale for a, s in stats.items()}
+        return {
+            "chat_db_executor_threads": ("gauge", "Threads running consumer DB work.", settings.CHAT_DB_THREADS),
+            "chat_db_pool_max": ("gauge", "Connection pool capacity.", per_alias("pool_max"), ["alias"]),
+            "chat_db_pool_size": ("gauge", "Connections open in the pool.", per_alias("pool_size"), ["alias"]),
+            "chat_db_pool_available": ("gauge", "Idle connections in the pool.", per_alias("pool_available"), ["alias"]),
+            "chat_db_pool_waiting": ("gauge", "Requests waiting for a connection.", per_alias("requests_waiting"), ["alias"]),
+            "chat_db_pool_queued_total": (
+                "counter", "Requests that had to wait for a connection.", per_alias("requests_queued"), ["alias"]),
+            "chat_db_pool_wait_seconds_total": (
+                "counter", "Time spent waiting for a connection.", per_alias("requests_wait_ms", 0.001), ["alias"]),
+            "chat_db_pool_errors_total": (
+                "counter", "Requests that got no connection (timeouts).", per_alias("requests_errors"), ["alias"]),
+        }
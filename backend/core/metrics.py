@@ -0,0 +1,273 @@
+# core/metrics.py
+"""
+In-process, Prometheus-style metrics.
+
+Everything is kept in memory and rendered on scrape by `metrics_view`
+(text exposition format 0.0.4), so recording a sample never costs a DB or
+Redis round trip. Each process exposes its own numbers; scrape every
+worker (or aggregate with the usual Prometheus rules).
+
+Per-event DB query / Redis call counts use a context variable: `ws_event()`
+puts a mutable tally in it, `database_sync_to_async` copies the context into
+the worker thread, and the connection hooks below add to whatever tally is
+current.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, Tuple
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _fmt_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[Tuple, object] = {}
+        _registry.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        for lv, v in sorted(self._values.items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labels, lv)} {v}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float) -> None:
+        with _lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect_left(self.buckets, value)
+        with _lock:
+            h = self._values.get(labels)
+            if h is None:
+                h = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def render(self):
+        lines = self._header()
+        for lv, (counts, total, n) in sorted(self._values.items()):
+            acc = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, lv, [('le', le)])} {acc}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labels, lv)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labels, lv)} {n}")
+        return lines
+
+
+class _Collector:
+    """
+    Values read from a callback at scrape time: fn() -> {name: (kind, help, value)},
+    or (kind, help, {label values: value}, label names) for labelled series.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        _registry.append(self)
+
+    def render(self):
+        lines = []
+        for name, (kind, help, value, *labels) in self.fn().items():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            if isinstance(value, dict):
+                lines += [f"{name}{_fmt_labels(labels[0], lv)} {v}" for lv, v in sorted(value.items())]
+            else:
+                lines.append(f"{name} {value}")
+        return lines
+
+
+def collector(fn):
+    _Collector(fn)
+    return fn
+
+
+# ---------- chat metrics ----------
+
+ws_event_seconds = Histogram(
+    "chat_ws_event_seconds", "WebSocket event handler latency.", ["consumer", "event"])
+ws_event_db_queries = Histogram(
+    "chat_ws_event_db_queries", "DB queries issued while handling one WebSocket event.",
+    ["consumer", "event"], buckets=COUNT_BUCKETS)
+ws_event_redis_calls = Histogram(
+    "chat_ws_event_redis_calls", "Redis round trips while handling one WebSocket event.",
+    ["consumer", "event"], buckets=COUNT_BUCKETS)
+ws_open_connections = Gauge(
+    "chat_ws_open_connections", "Accepted WebSocket connections currently open.", ["consumer"])
+group_send_total = Counter(
+    "chat_group_send_total", "channel_layer.group_send calls by event type.", ["event"])
+http_view_seconds = Histogram(
+    "chat_http_view_seconds", "HTTP view latency.", ["view", "method", "status"])
+db_queries_total = Counter("chat_db_queries_total", "DB queries executed by this process.")
+redis_calls_total = Counter("chat_redis_calls_total", "Redis round trips made by this process (app clients).")
+db_executor_wait_seconds = Histogram(
+    "chat_db_executor_wait_seconds", "Time a consumer DB call waited for a thread (core.db).")
+db_executor_queued = Gauge("chat_db_executor_queued", "DB calls waiting for a thread (core.db).")
+redis_pool_wait_seconds = Histogram(
+    "chat_redis_pool_wait_seconds", "Time spent waiting for a pooled Redis connection.", ["client"])
+redis_pool_timeouts_total = Counter(
+    "chat_redis_pool_timeouts_total", "Redis commands that found the pool exhausted for REDIS_POOL_TIMEOUT_SEC.",
+    ["client"])
+ingest_dead_letters_total = Counter(
+    "chat_ingest_dead_letters_total", "Write-behind messages moved to the dead-letter stream (chat.ingest).")
+
+
+class _Tally:
+    __slots__ = ("db", "redis")
+
+    def __init__(self):
+        self.db = 0
+        self.redis = 0
+
+
+_tally: contextvars.ContextVar = contextvars.ContextVar("metrics_tally", default=None)
+
+
+@contextmanager
+def ws_event(consumer: str, event: str):
+    tally = _Tally()
+    token = _tally.set(tally)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ws_event_seconds.observe(time.perf_counter() - t0, consumer, event)
+        ws_event_db_queries.observe(tally.db, consumer, event)
+        ws_event_redis_calls.observe(tally.redis, consumer, event)
+        _tally.reset(token)
+
+
+def note_redis_call() -> None:
+    redis_calls_total.inc()
+    tally = _tally.get()
+    if tally is not None:
+        tally.redis += 1
+
+
+def _count_query(execute, sql, params, many, context):
+    db_queries_total.inc()
+    tally = _tally.get()
+    if tally is not None:
+        tally.db += 1
+    return execute(sql, params, many, context)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def install() -> None:
+    """Hook DB connections (called from ChatConfig.ready)."""
+    from django.db import connections
+    from django.db.backends.signals import connection_created
+
+    connection_created.connect(_on_connection_created, dispatch_uid="core_metrics_db")
+    for conn in connections.all(initialized_only=True):
+        _on_connection_created(None, conn)
+
+
+class MeteredConsumerMixin:
+    """
+    AsyncWebsocketConsumer mixin: keeps chat_ws_open_connections current and
+    gives consumers a counted `group_send`.
+    """
+
+    async def accept(self, *args, **kwargs):
+        await super().accept(*args, **kwargs)
+        if not getattr(self, "_metered", False):
+            self._metered = True
+            ws_open_connections.inc(type(self).__name__)
+
+    async def websocket_disconnect(self, message):
+        if getattr(self, "_metered", False):
+            self._metered = False
+            ws_open_connections.dec(type(self).__name__)
+        await super().websocket_disconnect(message)
+
+    async def group_send(self, group: str, event: dict) -> None:
+        group_send_total.inc(event["type"])
+        await self.channel_layer.group_send(group, event)
+
+
+class TimedViewMixin:
+    """DRF APIView mixin: records chat_http_view_seconds."""
+
+    def dispatch(self, request, *args, **kwargs):
+        t0 = time.perf_counter()
+        response = super().dispatch(request, *args, **kwargs)
+        http_view_seconds.observe(
+            time.perf_counter() - t0, type(self).__name__, request.method, getattr(response, "status_code", 0))
+        return response
+
+
+# ---------- exposition ----------
+
+def render() -> str:
+    with _lock:
+        lines = []
+        for metric in _registry:
+            if not isinstance(metric, _Collector):
+                lines += metric.render()
+    for metric in _registry:
+        if isinstance(metric, _Collector):
+            lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token:
+        if request.headers.get("Authorization", "") != f"Bearer {token}":
+            return HttpResponseForbidden()
+    elif getattr(settings, "METRICS_REQUIRE_TOKEN", False):  # closed until a token is configured
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
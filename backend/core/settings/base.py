@@ -67,6 +67,9 @@ WSGI_APPLICATION = 'core.wsgi.application'
 ASGI_APPLICATION = 'core.asgi.application'
 
 # Database is defined in child files (dev/prod)
+# read replicas: aliases in DATABASES that chat.replicas may send reads to (prod fills this in)
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['chat.replicas.ReplicaRouter']
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -98,6 +101,24 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+CELERY_BEAT_SCHEDULE = {
+    # write-behind message ingestion (CHAT_INGEST_MODE=stream)
+    "chat-drain-message-stream": {
+        "task": "chat.tasks.drain_message_stream",
+        "schedule": float(os.environ.get('CHAT_INGEST_DRAIN_INTERVAL_SEC', 1.0)),
+    },
+    # unread counters are kept on write; this only repairs drift
+    "chat-reconcile-unread": {
+        "task": "chat.tasks.reconcile_unread_counts",
+        "schedule": float(os.environ.get('CHAT_UNREAD_RECONCILE_INTERVAL_SEC', 600)),
+    },
+    # queued conversation exports past CHAT_EXPORT_TTL_SEC
+    "chat-expire-exports": {
+        "task": "chat.tasks.expire_exports",
+        "schedule": float(os.environ.get('CHAT_EXPORT_CLEANUP_INTERVAL_SEC', 3600)),
+    },
+}
+
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
@@ -113,11 +134,83 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
 }
 
+# per-process cap on Redis connections: the app clients (chat.redis_clients) share one
+# blocking pool of this size, and the channel layer's pool gets the same cap
+REDIS_POOL_MAX_CONNECTIONS = int(os.environ.get('REDIS_POOL_MAX_CONNECTIONS', 50))
+REDIS_POOL_TIMEOUT_SEC = float(os.environ.get('REDIS_POOL_TIMEOUT_SEC', 5))
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")]
+            "hosts": [{
+                "address": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"),
+                "max_connections": REDIS_POOL_MAX_CONNECTIONS,
+            }]
         },
     }
-}
\ No newline at end of file
+}
+
+# threads running the consumers' DB work (core.db); prod sizes the Postgres pool from it
+CHAT_DB_THREADS = int(os.environ.get('CHAT_DB_THREADS', 8))
+
+# C H A T
+# thread.update events for the same (owner, peer) inside this window collapse into one
+CHAT_INBOX_COALESCE_MS = int(os.environ.get('CHAT_INBOX_COALESCE_MS', 100))
+
+# typing indicators: at most one start/stop transition per interval per socket,
+# and an automatic stop after the timeout with no typing.start
+CHAT_TYPING_MIN_INTERVAL_MS = int(os.environ.get('CHAT_TYPING_MIN_INTERVAL_MS', 1000))
+CHAT_TYPING_TIMEOUT_MS = int(os.environ.get('CHAT_TYPING_TIMEOUT_MS', 5000))
+
+# read replicas (chat.replicas): users stay on the primary this long after their own writes,
+# and a replica further behind than the max lag is skipped (checked every LAG_CHECK_SEC)
+CHAT_DB_PIN_SEC = float(os.environ.get('CHAT_DB_PIN_SEC', 5))
+CHAT_DB_REPLICA_MAX_LAG_SEC = float(os.environ.get('CHAT_DB_REPLICA_MAX_LAG_SEC', 2))
+CHAT_DB_LAG_CHECK_SEC = float(os.environ.get('CHAT_DB_LAG_CHECK_SEC', 5))
+
+# ws/session/: rooms one multiplexed socket may be subscribed to at once
+CHAT_SESSION_MAX_ROOMS = int(os.environ.get('CHAT_SESSION_MAX_ROOMS', 50))
+
+# "chat.msgpack.v1" sockets (chat.wire): frames at least this big go out zlib-compressed;
+# incoming compressed frames may not inflate past the max
+CHAT_WS_COMPRESS_MIN_BYTES = int(os.environ.get('CHAT_WS_COMPRESS_MIN_BYTES', 512))
+CHAT_WS_MAX_FRAME_BYTES = int(os.environ.get('CHAT_WS_MAX_FRAME_BYTES', 65536))
+
+# per-user token buckets in Redis (chat.ratelimit): bucket -> (tokens per second, burst)
+CHAT_RATE_LIMIT_ENABLED = os.environ.get('CHAT_RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+CHAT_RATE_LIMITS = {
+    "message.send": (5, 20),
+    "receipt": (10, 30),
+    "typing": (5, 10),
+    "rest": (10, 40),   # chat REST views (DRF throttle)
+    "search": (5, 20),  # user / message search
+    "export": (0.1, 5),  # conversation exports (streamed or queued)
+}
+# per-user exceptions, e.g. {"support_bot": {"message.send": (50, 200)}}
+CHAT_RATE_LIMIT_OVERRIDES = {}
+
+# "sync": insert in the consumer before broadcasting (default)
+# "stream": assign id + broadcast, persist later from a Redis stream (chat.ingest)
+CHAT_INGEST_MODE = os.environ.get('CHAT_INGEST_MODE', 'sync')
+CHAT_INGEST_STREAM = os.environ.get('CHAT_INGEST_STREAM', 'chat:ingest')
+CHAT_INGEST_BATCH_SIZE = int(os.environ.get('CHAT_INGEST_BATCH_SIZE', 500))
+# replayed entries past this many deliveries go to the dead-letter stream (chat.ingest)
+CHAT_INGEST_MAX_DELIVERIES = int(os.environ.get('CHAT_INGEST_MAX_DELIVERIES', 5))
+# drains run one at a time; the lock outlives a crashed drain by this much (chat.ingest)
+CHAT_INGEST_DRAIN_LOCK_SEC = int(os.environ.get('CHAT_INGEST_DRAIN_LOCK_SEC', 60))
+
+# conversation exports (chat.export): rows per DB fetch, where queued exports are
+# written (relative to MEDIA_ROOT) and how long they can be downloaded
+CHAT_EXPORT_CHUNK = int(os.environ.get('CHAT_EXPORT_CHUNK', 2000))
+CHAT_EXPORT_DIR = os.environ.get('CHAT_EXPORT_DIR', 'exports')
+CHAT_EXPORT_TTL_SEC = int(os.environ.get('CHAT_EXPORT_TTL_SEC', 24 * 3600))
+
+# per-process user record cache (accounts.usercache)
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', 10000))
+USER_CACHE_TTL_SEC = int(os.environ.get('USER_CACHE_TTL_SEC', 300))
+
+# /metrics (core.metrics): when set, scrapers must send "Authorization: Bearer <token>";
+# with METRICS_REQUIRE_TOKEN and no token, /metrics is forbidden to everyone
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_REQUIRE_TOKEN = os.environ.get('METRICS_REQUIRE_TOKEN', 'false').lower() == 'true'
@@ -11,5 +11,6 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
+CHAT_DB_THREADS = 1  # SQLite takes one writer at a time anyway
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -16,6 +16,32 @@ DATABASES = {
     }
 }
 
+# Pooled connections (Django's psycopg 3 pool): CHAT_DB_THREADS for the consumers plus
+# headroom for HTTP requests. Waiting longer than DB_POOL_TIMEOUT_SEC for a connection fails.
+if os.environ.get('DB_POOL', 'true').lower() == 'true':
+    DATABASES['default']['OPTIONS'] = {'pool': {
+        'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.environ.get('DB_POOL_MAX_SIZE') or CHAT_DB_THREADS + int(os.environ.get('DB_POOL_HTTP_CONNECTIONS', 8))),
+        'timeout': float(os.environ.get('DB_POOL_TIMEOUT_SEC', 10)),
+    }}
+else:  # e.g. behind pgbouncer: persistent per-thread connections instead
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Read replicas: DB_REPLICA_HOSTS=replica1,replica2:5433 (same name/user/password as the primary)
+for i, _hostport in enumerate(h.strip() for h in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if h.strip()):
+    _host, _, _port = _hostport.partition(':')
+    DATABASES[f'replica{i + 1}'] = {
+        **DATABASES['default'],
+        'HOST': _host,
+        'PORT': _port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{i + 1}')
+
+# /metrics stays closed unless METRICS_TOKEN is set
+METRICS_REQUIRE_TOKEN = os.environ.get('METRICS_REQUIRE_TOKEN', 'true').lower() == 'true'
+
 # Security settings
 SECURE_SSL_REDIRECT = True
 SESSION_COOKIE_SECURE = True
@@ -1,9 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from core.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),         # Optional
     
     path("api/auth/", include("accounts.urls")),
     path("api/chat/", include("chat.urls")),
+    path("metrics", metrics_view),
 ]
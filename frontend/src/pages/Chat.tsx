@@ -3,7 +3,7 @@ import { useEffect, useState, useRef } from "react"
 import { Link, useParams } from "react-router-dom"
 import { api } from "../api"
 import Room from "./Room"
-import type { ThreadItem, MessageStatus } from "../types"
+import type { DiscoverPage, InboxPage, ThreadItem, MessageStatus, UserPublic } from "../types"
 import { stopPresence } from "../presence"
 
 const safeLower = (s?: string | null) => (s ?? "").toLowerCase()
@@ -33,17 +33,59 @@ type InboxEvent =
 
 export default function Chat() {
   const [items, setItems] = useState<ThreadItem[]>([])
+  const [olderCursor, setOlderCursor] = useState<string | null>(null)
+  const [people, setPeople] = useState<UserPublic[]>([])
+  const [peopleCursor, setPeopleCursor] = useState<string | null>(null)
   const [me, setMe] = useState<string>("")
   const [search, setSearch] = useState("")
+  const [found, setFound] = useState<UserPublic[] | null>(null) // server-side user search
   const { username } = useParams<{ username: string }>()
   const wsRef = useRef<WebSocket | null>(null)
 
-  // initial load
+  // initial load: first inbox page + first page of people to start a chat with
   useEffect(() => {
-    api.get<ThreadItem[]>("/chat/users/").then(r => setItems(Array.isArray(r.data) ? r.data : []))
+    api.get<InboxPage>("/chat/users/").then(r => {
+      setItems(r.data?.results ?? [])
+      setOlderCursor(r.data?.before ?? null)
+    })
+    api.get<DiscoverPage>("/chat/discover/").then(r => {
+      setPeople(r.data?.results ?? [])
+      setPeopleCursor(r.data?.after ?? null)
+    })
     api.get("/auth/me/").then(r => setMe(r.data?.username ?? ""))
   }, [])
 
+  // user directory search (debounced); threads are still filtered locally
+  useEffect(() => {
+    const q = search.trim()
+    if (q.length < 2) { setFound(null); return }
+    const t = window.setTimeout(() => {
+      api.get<{ results: UserPublic[] }>("/chat/users/search/", { params: { q } })
+        .then(r => setFound(r.data.results))
+        .catch(() => setFound(null))
+    }, 250)
+    return () => window.clearTimeout(t)
+  }, [search])
+
+  function loadOlder() {
+    if (!olderCursor) return
+    api.get<InboxPage>("/chat/users/", { params: { before: olderCursor } }).then(r => {
+      setItems(prev => {
+        const seen = new Set(prev.map(t => t.user.username))
+        return [...prev, ...r.data.results.filter(t => !seen.has(t.user.username))]
+      })
+      setOlderCursor(r.data.before)
+    })
+  }
+
+  function loadMorePeople() {
+    if (!peopleCursor) return
+    api.get<DiscoverPage>("/chat/discover/", { params: { after: peopleCursor } }).then(r => {
+      setPeople(prev => [...prev, ...r.data.results])
+      setPeopleCursor(r.data.after)
+    })
+  }
+
   // inbox websocket for realtime thread updates
   useEffect(() => {
     const token = localStorage.getItem("access")
@@ -84,15 +126,20 @@ export default function Chat() {
     window.location.href = "/login"
   }
 
-  const filtered = items.filter(t => {
-    const u = t?.user
+  const matches = (u?: UserPublic) => {
     const q = safeLower(search)
     return (
       safeLower(u?.username).includes(q) ||
       safeLower(u?.first_name).includes(q) ||
       safeLower(u?.last_name).includes(q)
     )
-  })
+  }
+  const filtered = items.filter(t => matches(t?.user))
+  // a thread.update may have turned someone into a contact since discover loaded
+  const contacts = new Set(items.map(t => t.user.username))
+  const newPeople = found
+    ? found.filter(u => !contacts.has(u.username))
+    : people.filter(u => !contacts.has(u.username) && matches(u))
 
   return (
     <div className="h-screen w-screen bg-[#111] flex items-center justify-center">
@@ -175,7 +222,42 @@ export default function Chat() {
                 )
               })
             ) : (
-              <li className="px-4 py-3 text-gray-500 text-sm">No users found</li>
+              <li className="px-4 py-3 text-gray-500 text-sm">No conversations found</li>
+            )}
+            {olderCursor && (
+              <li>
+                <button onClick={loadOlder} className="w-full px-4 py-2 text-sm text-[#075E54] hover:bg-gray-50">
+                  Load older chats
+                </button>
+              </li>
+            )}
+
+            {/* People without a conversation yet */}
+            {newPeople.length > 0 && (
+              <li className="px-4 py-2 text-xs font-semibold uppercase text-gray-500 bg-[#f7f7f7]">Start a new chat</li>
+            )}
+            {newPeople.map((u) => (
+              <li key={`p-${u.id}`}>
+                <Link
+                  to={`/chat/${u.username}`}
+                  className={`flex items-center gap-3 px-4 py-3 border-b border-gray-100 hover:bg-gray-50 ${u.username === username ? "bg-gray-100" : ""}`}
+                >
+                  <div className="w-10 h-10 rounded-full bg-[#ddd] flex items-center justify-center font-semibold">
+                    {u.username.charAt(0).toUpperCase()}
+                  </div>
+                  <div className="min-w-0">
+                    <div className="font-medium text-gray-900 truncate">{`${u.first_name ?? ""} ${u.last_name ?? ""}`.trim() || u.username}</div>
+                    <div className="text-xs text-gray-500 truncate">@{u.username}</div>
+                  </div>
+                </Link>
+              </li>
+            ))}
+            {peopleCursor && !found && (
+              <li>
+                <button onClick={loadMorePeople} className="w-full px-4 py-2 text-sm text-[#075E54] hover:bg-gray-50">
+                  More people
+                </button>
+              </li>
             )}
           </ul>
         </aside>
@@ -1,8 +1,8 @@
 // src/pages/Room.tsx
-import { useEffect, useRef, useState } from "react";
+import { useEffect, useLayoutEffect, useRef, useState } from "react";
 import { api } from "../api";
 import { useParams, useNavigate } from "react-router-dom";
-import type { Message, MessageStatus, WsInbound, WsOutbound } from "../types";
+import type { HistoryPage, Message, MessageStatus, WsInbound, WsOutbound } from "../types";
 
 function formatRelative(iso?: string | null) {
   if (!iso) return "offline";
@@ -89,6 +89,14 @@ export default function Room() {
   const typingTimer = useRef<number | null>(null);
   const lastTypingSent = useRef<number>(0);
   const chatEndRef = useRef<HTMLDivElement>(null);
+  const listRef = useRef<HTMLDivElement>(null);
+  // history paging: cursor for the next older page (null: nothing older)
+  const [olderCursor, setOlderCursor] = useState<string | null>(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  const roomRef = useRef(username);
+  const lastIdRef = useRef<number | null>(null);
+  const keepScroll = useRef<number | null>(null); // scrollHeight before a prepend
+  const lastScrollTop = useRef(0);
   const navigate = useNavigate();
 
   useEffect(() => {
@@ -114,11 +122,14 @@ export default function Room() {
   // Fetch history + open socket (logic unchanged)
   useEffect(() => {
     let mounted = true;
+    roomRef.current = username;
+    setOlderCursor(null);
 
     async function boot() {
-      const hist = await api.get<Message[]>(`/chat/history/${username}/`);
+      const hist = await api.get<HistoryPage>(`/chat/history/${username}/`);
       if (!mounted) return;
-      setMessages(hist.data);
+      setMessages(hist.data.results);
+      setOlderCursor(hist.data.before);
 
       const token = localStorage.getItem("access");
       const wsBase =
@@ -169,6 +180,15 @@ export default function Room() {
                 : m
             )
           );
+        } else if (msg.type === "receipt.bulk_delivered") {
+          const map = new Map(msg.items.map((i) => [i.id, i.ts]));
+          setMessages((prev) =>
+            prev.map((m) =>
+              map.has(m.id) && m.status === "sent"
+                ? { ...m, status: "delivered", delivered_at: map.get(m.id) ?? m.delivered_at }
+                : m
+            )
+          );
         } else if (msg.type === "typing") {
           setTypingPeer(!!msg.active);
           if (msg.active) {
@@ -178,6 +198,12 @@ export default function Room() {
               5000
             );
           }
+        } else if (msg.type === "rate_limited") {
+          // not sent: put the text back unless something new was typed
+          if (msg.event === "message.send" && msg.text) {
+            const dropped = msg.text;
+            setText((t) => t || dropped);
+          }
         }
       };
 
@@ -204,11 +230,48 @@ export default function Room() {
     };
   }, [username]);
 
-  // auto scroll on new messages
-  useEffect(() => {
-    chatEndRef.current?.scrollIntoView({ behavior: "smooth" });
+  // auto scroll on new messages; an older page keeps the view where it was
+  useLayoutEffect(() => {
+    const list = listRef.current;
+    if (keepScroll.current !== null && list) {
+      list.scrollTop += list.scrollHeight - keepScroll.current;
+      keepScroll.current = null;
+    }
+    const lastId = messages.length ? messages[messages.length - 1].id : null;
+    if (lastId !== lastIdRef.current) {
+      lastIdRef.current = lastId;
+      chatEndRef.current?.scrollIntoView({ behavior: "smooth" });
+    }
   }, [messages]);
 
+  async function loadOlder() {
+    if (!olderCursor || loadingOlder) return;
+    const room = username;
+    setLoadingOlder(true);
+    try {
+      const r = await api.get<HistoryPage>(`/chat/history/${room}/`, {
+        params: { before: olderCursor },
+      });
+      if (roomRef.current !== room) return;
+      keepScroll.current = listRef.current?.scrollHeight ?? null;
+      setMessages((prev) => {
+        const have = new Set(prev.map((m) => m.id));
+        return [...r.data.results.filter((m) => !have.has(m.id)), ...prev];
+      });
+      setOlderCursor(r.data.before);
+    } catch {
+    } finally {
+      setLoadingOlder(false);
+    }
+  }
+
+  // scrolling up to the top loads the previous page (not the scroll down to the newest)
+  function onListScroll(e: React.UIEvent<HTMLDivElement>) {
+    const top = e.currentTarget.scrollTop;
+    if (top < 40 && top < lastScrollTop.current) loadOlder();
+    lastScrollTop.current = top;
+  }
+
   function sendWS(payload: WsOutbound) {
     const ws = wsRef.current;
     if (!ws || ws.readyState !== WebSocket.OPEN) return;
@@ -280,7 +343,23 @@ export default function Room() {
       </div>
 
       {/* Messages */}
-      <div className="flex-1 overflow-y-auto p-4 space-y-2 bg-chat-pattern bg-repeat">
+      <div
+        ref={listRef}
+        onScroll={onListScroll}
+        className="flex-1 overflow-y-auto p-4 space-y-2 bg-chat-pattern bg-repeat"
+      >
+        {olderCursor && (
+          <div className="flex justify-center">
+            <button
+              type="button"
+              onClick={loadOlder}
+              disabled={loadingOlder}
+              className="px-3 py-1 text-xs bg-white text-gray-700 rounded-full shadow-sm hover:bg-gray-100 disabled:opacity-60"
+            >
+              {loadingOlder ? "Loading…" : "Load older messages"}
+            </button>
+          </div>
+        )}
         {messages.map((m, i) => {
           const curDate = new Date(m.created_at);
           const prev = messages[i - 1];
@@ -1,7 +1,7 @@
 import { useEffect, useState } from "react";
 import { api } from "../api";
 import { Link } from "react-router-dom";
-import type { UserPublic } from "../types";
+import type { DiscoverPage, UserPublic } from "../types";
 import { stopPresence } from '../presence'
 
 export default function Users() {
@@ -9,7 +9,7 @@ export default function Users() {
   const [me, setMe] = useState<string>("");
 
   useEffect(() => {
-    api.get<UserPublic[]>("/chat/users/").then((r) => setUsers(r.data));
+    api.get<DiscoverPage>("/chat/discover/").then((r) => setUsers(r.data.results));
     api.get("/auth/me/").then((r) => setMe(r.data.username));
   }, []);
 
@@ -17,10 +17,45 @@ export interface Message {
   sender: { id: number; username: string };
   receiver: { id: number; username: string };
 }
+/** GET /chat/history/:u/ — keyset page, chronological within the page */
+export interface HistoryPage {
+  results: Message[];
+  before: string | null; // cursor for older messages
+  after: string | null;  // cursor for newer messages
+}
+/** GET /chat/sync/?since= — changes across all threads since `cursor` */
+export interface SyncPage {
+  messages: Message[]; // current state of every new or re-receipted message
+  threads: ThreadItem[]; // summaries of the threads those messages belong to
+  cursor: string; // pass back as `since`
+  has_more: boolean;
+}
+/** GET /chat/messages/search/?q= — best match first */
+export interface MessageSearchPage {
+  results: { message: Message; score: number; snippet: string }[]; // snippet: escaped HTML, matches in <mark>
+  next: string | null;
+}
+export interface Presence {
+  online: boolean;
+  last_seen: string | null;
+  ttl?: number;
+}
 export interface ThreadItem {
   user: UserPublic;
   unread_count: number;
   last_message: (Message & { from_me: boolean }) | null;
+  presence?: Presence;
+}
+
+/** GET /chat/users/ — inbox page, most recent first */
+export interface InboxPage {
+  results: ThreadItem[];
+  before: string | null; // cursor for the next (older) page
+}
+/** GET /chat/discover/ — users without a conversation yet */
+export interface DiscoverPage {
+  results: UserPublic[];
+  after: string | null;
 }
 
 /** WS inbound events */
@@ -33,7 +68,10 @@ export type WsInbound =
       ts?: string | null;
     }
   | { type: "receipt.bulk_seen"; items: { id: number; ts?: string }[] }
-  | { type: "typing"; from: string; active: boolean };
+  | { type: "receipt.bulk_delivered"; items: { id: number; ts?: string }[] }
+  | { type: "typing"; from: string; active: boolean }
+  /** frame dropped by the server's rate limiter; `text` is echoed for message.send */
+  | { type: "rate_limited"; event: string; retry_after: number; text?: string };
 
 /** WS outbound events */
 export type WsOutbound =
@@ -42,3 +80,20 @@ export type WsOutbound =
   | { type: "receipt.seen_all" }
   | { type: "typing.start" }
   | { type: "typing.stop" };
+
+/** ws/session/: room events carry the conversation they belong to */
+export type SessionInbound =
+  | (WsInbound & { with: string })
+  | { type: "thread.update"; user: ThreadItem["user"]; unread_count: number; last_message: ThreadItem["last_message"] }
+  | { type: "subscribed" | "unsubscribed"; with: string }
+  | {
+      type: "error";
+      error: "not_subscribed" | "unknown_user" | "too_many_subscriptions";
+      event: string;
+      with?: string | null;
+    };
+
+export type SessionOutbound =
+  | { type: "ping" }
+  | { type: "subscribe" | "unsubscribe"; with: string }
+  | (WsOutbound & { with: string });